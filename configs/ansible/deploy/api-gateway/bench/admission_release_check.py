@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Checks that every chat request hands its admission slot back, however it ends. The
+gateway is staged as in run_bench.py (server_timing off, --model limited to --limit
+concurrent requests, every backend an unreachable port) and driven in-process through
+its ASGI app, so the timing of each disconnect is exact.
+
+  1. early-disconnect  the client is gone when the response starts, and Starlette
+                       cancels the body before first reading it.
+  2. backend-down      the body runs and the backend refuses the connection.
+
+--requests (more than --limit) requests go through each phase one after another; each
+must end with the model's active slot count back at 0.
+
+  python3 bench/admission_release_check.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+from run_bench import stage_gateway
+
+# Nothing listens on the discard port, so every upstream connect is refused
+DEAD_BACKEND = "127.0.0.1:9"
+
+
+def stage(workdir: str, model: str, limit: int) -> str:
+    stage_gateway(workdir, [DEAD_BACKEND])
+    app_dir = os.path.join(workdir, "gateway_app")
+    config_path = os.path.join(app_dir, "config.yaml")
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    config["logging"]["server_timing"] = False
+    config["admission"].update(enabled=True, model_limits={model: limit}, queue_timeout=2.0)
+    # No probe may open a circuit in the middle of the check
+    config["health_check"]["interval"] = 3600.0
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return app_dir
+
+
+async def chat(app, model: str, disconnect_early: bool) -> int:
+    """Sends one streaming chat request through the ASGI app and returns the status sent."""
+    body = json.dumps({"model": model, "stream": True,
+                       "messages": [{"role": "user", "content": "hello"}]}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "root_path": "", "query_string": b"", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    body_read = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if not disconnect_early:
+            # Stays connected until the response has been sent
+            await body_read.wait()
+        return {"type": "http.disconnect"}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            # A server may yield here (uvicorn does under flow control); the pending
+            # cancellation then lands before Starlette first reads the body
+            await asyncio.sleep(0)
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            body_read.set()
+
+    await app(scope, receive, send)
+    return status
+
+
+async def run(args, workdir: str) -> list:
+    app_dir = stage(workdir, args.model, args.limit)
+    os.chdir(app_dir)
+    sys.path.insert(0, app_dir)
+    import main as gateway  # noqa: E402
+
+    failures = []
+    async with gateway.app.router.lifespan_context(gateway.app):
+        for phase, disconnect_early in (("early-disconnect", True), ("backend-down", False)):
+            statuses = []
+            for _ in range(args.requests):
+                statuses.append(await asyncio.wait_for(chat(gateway.app, args.model, disconnect_early), 10))
+            # Let bodies cancelled mid-flight finish unwinding
+            await asyncio.sleep(0.1)
+            active = gateway.admission.stats()["models"][args.model]["active"]
+            print(f"{phase + ':':18} {args.requests} requests, statuses {sorted(set(map(str, statuses)))}, "
+                  f"active slots {active}")
+            if active != 0:
+                failures.append(f"{phase}: {active} admission slot(s) still held")
+            if 429 in statuses:
+                failures.append(f"{phase}: requests were rejected with 429 after earlier ones leaked slots")
+    return failures
+
+
+async def main(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="admission-check-")
+    try:
+        failures = await run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="llama4:16x17b")
+    parser.add_argument("--limit", type=int, default=2, help="Concurrent requests allowed for --model")
+    parser.add_argument("--requests", type=int, default=5, help="Requests per phase")
+    sys.exit(asyncio.run(main(parser.parse_args())))
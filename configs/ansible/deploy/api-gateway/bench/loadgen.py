@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Async load generator for the Citadel gateways (gateway_app/main.py and webui_gateway.py).
+
+Runs a weighted mix of request types against a gateway and reports, per type and overall:
+p50/p95/p99 time to first body byte (TTFB) and full response time, requests/s, streamed
+chunks/s and errors. With --gateway-pid it also samples the CPU time and RSS of that
+process and its children (the gunicorn/uvicorn workers) from /proc.
+
+Request types (--mix name=weight,...):
+  openai_stream   POST /v1/chat/completions  "stream": true  (SSE)
+  openai          POST /v1/chat/completions  non-streaming
+  ollama_stream   POST /api/chat             "stream": true  (NDJSON)
+  ollama          POST /api/chat             "stream": false
+  embed           POST /v1/embeddings        --embed-batch texts per request
+
+Every prompt carries a unique nonce so response caching and single-flight coalescing do not
+short-circuit the run; pass --repeat-prompts to measure those paths instead.
+
+By default the load is closed-loop: --concurrency workers each send a request as soon as their
+previous one finishes. --rate switches to open-loop arrivals at that many requests/s, with
+latency measured from the scheduled send time so a stalled gateway cannot hide its queueing.
+
+  python3 loadgen.py --url http://127.0.0.1:8000 --concurrency 32 --duration 30 \\
+      --mix openai_stream=3,ollama_stream=1 --output run.json --baseline baselines/main.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+SCENARIOS = ("openai_stream", "openai", "ollama_stream", "ollama", "embed")
+# Metrics compared against a baseline: (path in the report, True if higher is better)
+COMPARED = [
+    ("ttfb_ms.p50", False), ("ttfb_ms.p95", False), ("ttfb_ms.p99", False),
+    ("total_ms.p50", False), ("total_ms.p95", False), ("total_ms.p99", False),
+    ("requests_per_second", True),
+]
+RESOURCE_COMPARED = [("cpu_ms_per_request", False), ("peak_rss_mb", False)]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"unknown request type '{name}' (expected one of {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "mean": round(sum(values) / len(values), 2) if values else None,
+        "max": round(values[-1], 2) if values else None,
+    }
+
+
+class Sample:
+    __slots__ = ("scenario", "ttfb", "total", "chunks", "error")
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.ttfb = None
+        self.total = None
+        self.chunks = 0
+        self.error = None
+
+
+class ProcessSampler:
+    """Samples CPU time and RSS of a process tree from /proc (Linux only)."""
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.ticks = os.sysconf("SC_CLK_TCK")
+        self.page = os.sysconf("SC_PAGE_SIZE")
+        self.cpu_start = None
+        self.cpu_end = None
+        self.rss = []
+
+    def _tree(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces; fields resume after its closing paren
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        tree, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, []))
+        return tree
+
+    def read(self):
+        """Returns (cpu seconds, rss bytes) summed over the tree."""
+        cpu, rss = 0.0, 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            # utime and stime are fields 14 and 15 of stat; rss (pages) is field 24
+            cpu += (int(fields[11]) + int(fields[12])) / self.ticks
+            rss += int(fields[21]) * self.page
+        return cpu, rss
+
+    async def run(self):
+        self.cpu_start, rss = self.read()
+        self.rss.append(rss)
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                self.cpu_end, rss = self.read()
+                self.rss.append(rss)
+        except asyncio.CancelledError:
+            self.cpu_end, rss = self.read()
+            self.rss.append(rss)
+            raise
+
+    def report(self, elapsed: float, requests: int) -> Dict[str, Any]:
+        cpu = (self.cpu_end or self.cpu_start) - self.cpu_start
+        return {
+            "pid": self.pid,
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else None,
+            "cpu_ms_per_request": round(1000 * cpu / requests, 3) if requests else None,
+            "avg_rss_mb": round(sum(self.rss) / len(self.rss) / 2**20, 1),
+            "peak_rss_mb": round(max(self.rss) / 2**20, 1),
+        }
+
+
+class LoadGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.names = list(self.mix)
+        self.weights = [self.mix[name] for name in self.names]
+        self.samples: List[Sample] = []
+        self.sent = 0
+        self.recording_from = None
+
+    def build(self, scenario: str, nonce: int):
+        args = self.args
+        suffix = "" if args.repeat_prompts else f" [{nonce}]"
+        messages = [{"role": "user", "content": f"{args.prompt}{suffix}"}]
+        if scenario in ("openai_stream", "openai"):
+            return "/v1/chat/completions", {"model": args.model, "messages": messages,
+                                            "stream": scenario == "openai_stream", "max_tokens": args.max_tokens}
+        if scenario in ("ollama_stream", "ollama"):
+            return "/api/chat", {"model": args.model, "messages": messages, "stream": scenario == "ollama_stream",
+                                 "options": {"num_predict": args.max_tokens}}
+        texts = [f"{args.prompt} passage {i}{suffix}" for i in range(args.embed_batch)]
+        return "/v1/embeddings", {"model": args.embed_model, "input": texts}
+
+    async def send(self, client: httpx.AsyncClient, scenario: str, scheduled: float) -> Sample:
+        sample = Sample(scenario)
+        self.sent += 1
+        path, body = self.build(scenario, self.sent)
+        tail = b""
+        try:
+            async with client.stream("POST", path, json=body) as response:
+                async for chunk in response.aiter_raw():
+                    if sample.ttfb is None:
+                        sample.ttfb = time.monotonic() - scheduled
+                        # The WebUI gateway reports backend failures in-band with a 200
+                        if chunk.startswith(b'{"error"'):
+                            sample.error = "in_band_error"
+                    if scenario.endswith("_stream"):
+                        sample.chunks += chunk.count(b"data: " if scenario == "openai_stream" else b"\n")
+                    tail = (tail + chunk)[-256:]
+                if response.status_code >= 400:
+                    sample.error = f"http_{response.status_code}"
+                elif scenario == "openai_stream" and b"[DONE]" not in tail:
+                    sample.error = sample.error or "incomplete_stream"
+                elif scenario == "ollama_stream" and b'"done":true' not in tail.replace(b" ", b""):
+                    sample.error = sample.error or "incomplete_stream"
+        except httpx.HTTPError as e:
+            sample.error = type(e).__name__
+        sample.total = time.monotonic() - scheduled
+        if scenario == "openai_stream":
+            # Do not count the "data: [DONE]" terminator as a token
+            sample.chunks = max(0, sample.chunks - 1)
+        return sample
+
+    async def timed(self, client: httpx.AsyncClient, scenario: str, scheduled: float):
+        sample = await self.send(client, scenario, scheduled)
+        # Requests scheduled during warmup are sent but not reported
+        if scheduled >= self.recording_from:
+            self.samples.append(sample)
+
+    def pick(self) -> str:
+        return random.choices(self.names, self.weights)[0]
+
+    async def closed_loop(self, client, deadline, budget):
+        async def worker():
+            while time.monotonic() < deadline and (budget is None or self.sent < budget):
+                await self.timed(client, self.pick(), time.monotonic())
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def open_loop(self, client, deadline, budget):
+        in_flight = set()
+        next_at = time.monotonic()
+        while time.monotonic() < deadline and (budget is None or self.sent < budget):
+            # Poisson arrivals at --rate requests/s
+            next_at += random.expovariate(self.args.rate)
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(self.timed(client, self.pick(), next_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=max(args.concurrency, 100))
+        timeout = httpx.Timeout(args.timeout, connect=10.0)
+        sampler = ProcessSampler(args.gateway_pid) if args.gateway_pid else None
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout,
+                                     headers={"Content-Type": "application/json"}) as client:
+            started = time.monotonic()
+            self.recording_from = started + args.warmup
+            deadline = started + args.warmup + args.duration if args.duration else float("inf")
+            budget = args.requests or None
+            sampler_task = None
+            if sampler:
+                # Start measuring the gateway once warmup is over
+                async def sample_after_warmup():
+                    await asyncio.sleep(args.warmup)
+                    await sampler.run()
+                sampler_task = asyncio.create_task(sample_after_warmup())
+            load = self.open_loop if args.rate else self.closed_loop
+            await load(client, deadline, budget)
+            finished = time.monotonic()
+            if sampler_task:
+                sampler_task.cancel()
+                await asyncio.gather(sampler_task, return_exceptions=True)
+        elapsed = finished - self.recording_from
+        return self.report(elapsed, sampler)
+
+    def report(self, elapsed: float, sampler: Optional[ProcessSampler]) -> Dict[str, Any]:
+        args = self.args
+        groups: Dict[str, List[Sample]] = {}
+        for sample in self.samples:
+            groups.setdefault(sample.scenario, []).append(sample)
+        groups["overall"] = self.samples
+
+        def section(samples: List[Sample]) -> Dict[str, Any]:
+            ok = [s for s in samples if s.error is None]
+            errors: Dict[str, int] = {}
+            for s in samples:
+                if s.error:
+                    errors[s.error] = errors.get(s.error, 0) + 1
+            stream_seconds = sum(s.total - s.ttfb for s in ok if s.chunks and s.ttfb is not None)
+            return {
+                "requests": len(samples),
+                "errors": errors,
+                "error_rate": round(1 - len(ok) / len(samples), 4) if samples else None,
+                "requests_per_second": round(len(ok) / elapsed, 2) if elapsed > 0 else None,
+                "ttfb_ms": summarize([1000 * s.ttfb for s in ok if s.ttfb is not None]),
+                "total_ms": summarize([1000 * s.total for s in ok]),
+                "chunks_per_second": round(sum(s.chunks for s in ok) / elapsed, 1) if elapsed > 0 else None,
+                "chunks_per_stream_second": round(sum(s.chunks for s in ok) / stream_seconds, 1)
+                if stream_seconds else None,
+            }
+
+        return {
+            "label": args.label,
+            "url": args.url,
+            "started": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 3),
+            "settings": {
+                "mix": self.mix, "concurrency": args.concurrency, "rate": args.rate, "duration": args.duration,
+                "requests": args.requests, "warmup": args.warmup, "model": args.model,
+                "max_tokens": args.max_tokens, "embed_batch": args.embed_batch,
+            },
+            "scenarios": {name: section(samples) for name, samples in groups.items()},
+            "resources": sampler.report(elapsed, len(self.samples)) if sampler else None,
+        }
+
+
+def lookup(report: Dict[str, Any], path: str):
+    value = report
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+            floor_ms: float = 2.0) -> List[str]:
+    """Returns a line per metric that got worse than the baseline by more than `tolerance`."""
+    regressions = []
+
+    def check(label, now, then, higher_is_better, floor=0.0):
+        if now is None or then is None:
+            return
+        worse = then - now if higher_is_better else now - then
+        # Small absolute differences in fast metrics are noise, not regressions
+        if worse > max(tolerance * abs(then), floor):
+            regressions.append(f"{label}: {then} -> {now}")
+
+    for name, section in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        for path, higher_is_better in COMPARED:
+            floor = floor_ms if path.endswith(("p50", "p95", "p99")) else 0.0
+            check(f"{name}.{path}", lookup(section, path), lookup(before, path), higher_is_better, floor)
+        now_errors, then_errors = section.get("error_rate"), before.get("error_rate")
+        if now_errors is not None and then_errors is not None and now_errors > then_errors + 0.01:
+            regressions.append(f"{name}.error_rate: {then_errors} -> {now_errors}")
+    if current.get("resources") and baseline.get("resources"):
+        for key, higher_is_better in RESOURCE_COMPARED:
+            check(f"resources.{key}", current["resources"].get(key), baseline["resources"].get(key),
+                  higher_is_better)
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n{report['label'] or report['url']}: {report['elapsed_seconds']}s measured")
+    print(f"{'type':<15}{'reqs':>7}{'err%':>7}{'req/s':>9}{'ttfb p50':>10}{'p95':>9}{'p99':>9}"
+          f"{'total p50':>11}{'p95':>9}{'p99':>9}{'chunks/s':>10}")
+    for name, s in report["scenarios"].items():
+        ttfb, total = s["ttfb_ms"], s["total_ms"]
+        error_rate = f"{100 * s['error_rate']:.1f}" if s["error_rate"] is not None else "-"
+        cells = [ttfb["p50"], ttfb["p95"], ttfb["p99"], total["p50"], total["p95"], total["p99"]]
+        cells = [f"{c:.1f}" if c is not None else "-" for c in cells]
+        print(f"{name:<15}{s['requests']:>7}{error_rate:>7}{s['requests_per_second'] or 0:>9.1f}"
+              f"{cells[0]:>10}{cells[1]:>9}{cells[2]:>9}{cells[3]:>11}{cells[4]:>9}{cells[5]:>9}"
+              f"{s['chunks_per_second'] or 0:>10.0f}")
+        if s["errors"]:
+            print(f"{'':<15}errors: {', '.join(f'{k}={v}' for k, v in sorted(s['errors'].items()))}")
+    resources = report.get("resources")
+    if resources:
+        print(f"gateway pid {resources['pid']}: cpu {resources['cpu_seconds']}s ({resources['cpu_percent']}%), "
+              f"{resources['cpu_ms_per_request']} ms/request, rss avg {resources['avg_rss_mb']} MiB, "
+              f"peak {resources['peak_rss_mb']} MiB")
+
+
+def check_baseline(report: Dict[str, Any], args) -> bool:
+    """
+    Prints the comparison with --baseline and saves --save-baseline. False on a regression, and
+    when the baseline is missing (unless this run is saved as it), so a check never passes vacuously.
+    """
+    passed = True
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            passed = False
+            print(f"\nREGRESSION against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+        else:
+            print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    elif args.baseline and args.save_baseline != args.baseline:
+        passed = False
+        print(f"\nNO BASELINE at {args.baseline}: nothing to compare against. Record one on this "
+              f"machine first with --update-baseline (run_bench.py) or --save-baseline (loadgen.py).")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+    return passed
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--concurrency", type=int, default=16, help="Closed-loop workers")
+    parser.add_argument("--rate", type=float, help="Open-loop arrival rate in requests/s (overrides --concurrency)")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds (0: stop after --requests)")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of load before measuring")
+    parser.add_argument("--mix", default="openai_stream=3,ollama_stream=1", help="Weighted request types")
+    parser.add_argument("--model", default="llama3:8b")
+    parser.add_argument("--embed-model", default="nomic-embed-text:v1.5")
+    parser.add_argument("--embed-batch", type=int, default=8, help="Texts per embedding request")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--prompt", default="Summarize the quarterly infrastructure report")
+    parser.add_argument("--repeat-prompts", action="store_true", help="Send identical prompts (exercise caching)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression vs. baseline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Gateway base URL")
+    parser.add_argument("--label", help="Name for this run in the report")
+    parser.add_argument("--gateway-pid", type=int, help="Sample CPU/RSS of this process and its children")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Compare against this saved report")
+    parser.add_argument("--save-baseline", help="Save this run's report as a baseline")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if not args.duration and not args.requests:
+        parser.error("set --duration or --requests")
+
+    report = asyncio.run(LoadGenerator(args).run())
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not check_baseline(report, args):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
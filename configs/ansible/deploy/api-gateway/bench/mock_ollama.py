@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Mock Ollama backend for load-testing the gateways. Standard library only, so the
+mock costs as little CPU as possible and the numbers reflect the gateway.
+
+  GET  /api/tags, /api/ps         every model in --models (all loaded, unless --load-time is set)
+  POST /api/generate              no prompt: loads the model and sets its keep_alive, like Ollama
+  POST /api/chat                  NDJSON stream (or one JSON object with "stream": false)
+  POST /v1/chat/completions       SSE stream (or one JSON object without "stream": true)
+  POST /api/embed, /v1/embeddings --embed-dim vectors after --embed-latency seconds
+
+Generation timing: the first token is sent --ttft seconds after the request arrives,
+then one token per chunk at --token-rate tokens/s. A response has --tokens tokens,
+or fewer when the request sets options.num_predict / max_tokens.
+
+Error injection: --error-rate answers that fraction of requests with --error-status
+before anything is streamed; --abort-rate drops the connection halfway through a stream.
+
+--warm-ttft simulates Ollama's prompt cache: a conversation (model + first user message)
+this process has answered before gets that TTFT instead of --ttft. Run one mock process
+per simulated node so each keeps its own cache.
+
+--load-time simulates VRAM residency: a model that is not loaded adds that many seconds
+to the first token (concurrent requests wait for the same load). It stays loaded for
+--keep-alive seconds after its last request (or the keep_alive the request sends) and
+at most --max-loaded models are resident, least recently used evicted first. /api/ps then
+lists only the loaded models, with expires_at.
+
+Like Ollama, generation stops as soon as the client hangs up, also while a non-streaming
+answer is being generated; /mock/stats counts those requests as "cancelled".
+
+Usage: python3 mock_ollama.py --port 11501 [--port 11502] [--ttft 0.2] [--token-rate 50]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+# Ollama (Go's encoding/json) emits compact JSON
+dumps = partial(json.dumps, separators=(",", ":"))
+WORDS = [" The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", "."]
+DEFAULT_MODELS = "llama3.2:3b,llama3:8b,llama4:16x17b,mistral:7b,qwen3:8b,nous-hermes2:latest," \
+                 "nomic-embed-text:v1.5,mxbai-embed-large:335m,all-minilm:l6-v2"
+REASONS = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error",
+           502: "Bad Gateway", 503: "Service Unavailable"}
+
+ARGS = None
+STATS = {"requests": 0, "streams": 0, "tokens": 0, "errors": 0, "aborts": 0, "cancelled": 0, "warm": 0,
+         "loads": 0, "evictions": 0}
+# Conversations whose prompt prefix this "node" has processed (LRU)
+PROMPT_CACHE = OrderedDict()
+# model -> [ready at, expires at] for models resident in the simulated VRAM (LRU)
+LOADED = OrderedDict()
+
+
+class Abort(Exception):
+    """Raised by a stream to drop the connection without finishing the response."""
+
+
+def head(status, content_type, length=None):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}", f"Content-Type: {content_type}"]
+    lines.append(f"Content-Length: {length}" if length is not None else "Transfer-Encoding: chunked")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def token_budget(body):
+    requested = body.get("max_tokens") or (body.get("options") or {}).get("num_predict")
+    return min(ARGS.tokens, requested) if requested and requested > 0 else ARGS.tokens
+
+
+def prefill_seconds(body):
+    """TTFT for a request: --warm-ttft when its conversation is in the prompt cache."""
+    if ARGS.warm_ttft is None:
+        return ARGS.ttft
+    first_user = next((m.get("content") for m in body.get("messages") or () if m.get("role") == "user"), None)
+    key = dumps([body.get("model"), first_user])
+    warm = key in PROMPT_CACHE
+    PROMPT_CACHE[key] = True
+    PROMPT_CACHE.move_to_end(key)
+    if len(PROMPT_CACHE) > 4096:
+        PROMPT_CACHE.popitem(last=False)
+    if warm:
+        STATS["warm"] += 1
+        return ARGS.warm_ttft
+    return ARGS.ttft
+
+
+def keep_alive_seconds(value):
+    if value is None:
+        return ARGS.keep_alive
+    if isinstance(value, (int, float)):
+        return float(value) if value >= 0 else float("inf")
+    units = {"ms": 1e-3, "s": 1, "m": 60, "h": 3600}
+    for suffix in ("ms", "s", "m", "h"):
+        if value.endswith(suffix) and value[:-len(suffix)].lstrip("-").replace(".", "", 1).isdigit():
+            seconds = float(value[:-len(suffix)]) * units[suffix]
+            return seconds if seconds >= 0 else float("inf")
+    return ARGS.keep_alive
+
+
+def load_seconds(body):
+    """Seconds until the model is loaded (0 when resident); marks it used with the request's keep_alive."""
+    if not ARGS.load_time:
+        return 0.0
+    model = body.get("model")
+    now = time.monotonic()
+    for name in [m for m, (_, expires) in LOADED.items() if expires <= now]:
+        del LOADED[name]
+    entry = LOADED.get(model)
+    if entry is None:
+        STATS["loads"] += 1
+        entry = LOADED[model] = [now + ARGS.load_time, 0.0]
+        while ARGS.max_loaded and len(LOADED) > ARGS.max_loaded:
+            LOADED.popitem(last=False)
+            STATS["evictions"] += 1
+    LOADED.move_to_end(model)
+    delay = max(0.0, entry[0] - now)
+    # Ollama counts keep_alive from the end of the request; the start is close enough here
+    entry[1] = now + delay + keep_alive_seconds(body.get("keep_alive"))
+    return delay
+
+
+def loaded_list():
+    if not ARGS.load_time:
+        return model_list()
+    now = time.monotonic()
+    models = []
+    for entry in model_list():
+        state = LOADED.get(entry["name"])
+        if state is not None and state[0] <= now < state[1]:
+            remaining = min(state[1] - now, 10 * 365 * 86400)
+            models.append({**entry, "expires_at": (datetime.now(timezone.utc) + timedelta(seconds=remaining)).isoformat()})
+    return models
+
+
+async def load_model(body):
+    """/api/generate without a prompt: Ollama's way to load a model (and set keep_alive)."""
+    if body.get("prompt"):
+        return 400, "application/json", {"error": "the mock only supports /api/generate without a prompt"}
+    started = time.monotonic()
+    delay = load_seconds(body)
+    if delay:
+        await asyncio.sleep(delay)
+    return 200, "application/json", {
+        "model": body.get("model"), "created_at": "2024-01-01T00:00:00Z", "response": "",
+        "done": True, "done_reason": "load", "load_duration": int((time.monotonic() - started) * 1e9),
+    }
+
+
+async def generate(count, ttft):
+    """Yields token strings on the given TTFT and the configured inter-token schedule."""
+    started = time.monotonic()
+    abort_at = count // 2 if random.random() < ARGS.abort_rate else None
+    for i in range(count):
+        # Schedule against the start time so sleep overshoot does not accumulate
+        due = started + ttft + (i / ARGS.token_rate if ARGS.token_rate > 0 else 0)
+        delay = due - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if i == abort_at:
+            STATS["aborts"] += 1
+            raise Abort()
+        STATS["tokens"] += 1
+        yield WORDS[i % len(WORDS)]
+
+
+async def ollama_chat(body):
+    model = body.get("model")
+    count = token_budget(body)
+    ttft = load_seconds(body) + prefill_seconds(body)
+    if body.get("stream", True) is False:
+        content = "".join([token async for token in generate(count, ttft)])
+        return 200, "application/json", {
+            "model": model, "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content}, "done_reason": "stop", "done": True,
+            "prompt_eval_count": 16, "eval_count": count, "eval_duration": int(count / max(ARGS.token_rate, 1e-9) * 1e9),
+        }
+
+    async def stream():
+        started = time.monotonic()
+        async for token in generate(count, ttft):
+            yield dumps({"model": model, "created_at": "2024-01-01T00:00:00Z",
+                         "message": {"role": "assistant", "content": token}, "done": False}).encode() + b"\n"
+        eval_ns = int((time.monotonic() - started - ttft) * 1e9)
+        yield dumps({"model": model, "created_at": "2024-01-01T00:00:00Z",
+                     "message": {"role": "assistant", "content": ""}, "done_reason": "stop", "done": True,
+                     "total_duration": int((time.monotonic() - started) * 1e9), "prompt_eval_count": 16,
+                     "prompt_eval_duration": int(ttft * 1e9), "eval_count": count,
+                     "eval_duration": max(eval_ns, 1)}).encode() + b"\n"
+    return 200, "application/x-ndjson", stream()
+
+
+async def openai_chat(body):
+    model = body.get("model")
+    count = token_budget(body)
+    ttft = load_seconds(body) + prefill_seconds(body)
+    completion_id = f"chatcmpl-{random.getrandbits(48):012x}"
+    created = int(time.time())
+    if not body.get("stream"):
+        content = "".join([token async for token in generate(count, ttft)])
+        return 200, "application/json", {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 16, "completion_tokens": count, "total_tokens": 16 + count},
+        }
+
+    async def stream():
+        async for token in generate(count, ttft):
+            yield b"data: " + dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}, "finish_reason": None}],
+            }).encode() + b"\n\n"
+        yield b"data: " + dumps({
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }).encode() + b"\n\n"
+        # Like Ollama, a usage-only chunk when the client asks for it
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield b"data: " + dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": {"prompt_tokens": 16, "completion_tokens": count, "total_tokens": 16 + count},
+            }).encode() + b"\n\n"
+        yield b"data: [DONE]\n\n"
+    return 200, "text/event-stream", stream()
+
+
+async def embed_vectors(body):
+    texts = body.get("input", [])
+    texts = [texts] if isinstance(texts, str) else texts
+    if ARGS.embed_latency:
+        await asyncio.sleep(ARGS.embed_latency)
+    base = [round((i % 97) / 97, 4) for i in range(ARGS.embed_dim)]
+    return [[float(len(text))] + base[1:] for text in texts], sum(len(t.split()) for t in texts)
+
+
+async def ollama_embed(body):
+    vectors, tokens = await embed_vectors(body)
+    return 200, "application/json", {"model": body.get("model"), "embeddings": vectors, "prompt_eval_count": tokens}
+
+
+async def openai_embed(body):
+    vectors, tokens = await embed_vectors(body)
+    return 200, "application/json", {
+        "object": "list", "model": body.get("model"),
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+def model_list():
+    return [{"name": name, "model": name, "size": 4_000_000_000, "size_vram": 4_000_000_000,
+             "details": {"family": name.split(":")[0]}} for name in ARGS.models]
+
+
+async def route(method, path, body):
+    STATS["requests"] += 1
+    path = path.split("?")[0]
+    if method == "GET" and path == "/api/tags":
+        return 200, "application/json", {"models": model_list()}
+    if method == "GET" and path == "/api/ps":
+        return 200, "application/json", {"models": loaded_list()}
+    if method == "GET" and path == "/mock/stats":
+        return 200, "application/json", STATS
+    handlers = {"/api/chat": ollama_chat, "/v1/chat/completions": openai_chat, "/api/generate": load_model,
+                "/api/embed": ollama_embed, "/v1/embeddings": openai_embed}
+    if method != "POST" or path not in handlers:
+        return 404, "application/json", {"error": f"{method} {path} not found"}
+    if random.random() < ARGS.error_rate:
+        STATS["errors"] += 1
+        return ARGS.error_status, "application/json", {"error": "injected failure"}
+    return await handlers[path](json.loads(body or b"{}"))
+
+
+async def until_hangup(reader, work):
+    """Runs `work`, cancelling it if the client closes the connection first (None then)."""
+    task = asyncio.ensure_future(work)
+    # Clients do not pipeline, so nothing but EOF arrives while a request is being answered
+    hangup = asyncio.ensure_future(reader.read(1))
+    await asyncio.wait({task, hangup}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        hangup.cancel()
+        # The next readline() on this connection fails while the read is still pending
+        try:
+            await hangup
+        except asyncio.CancelledError:
+            pass
+        return task.result()
+    task.cancel()
+    STATS["cancelled"] += 1
+    return None
+
+
+async def connection(reader, writer):
+    streaming = False
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, path, _ = request_line.decode().split(" ", 2)
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode().partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip())
+            body = await reader.readexactly(length) if length else b""
+            answer = await until_hangup(reader, route(method, path, body))
+            if answer is None:
+                break
+            status, content_type, payload = answer
+            if isinstance(payload, dict):
+                data = dumps(payload).encode()
+                writer.write(head(status, content_type, len(data)) + data)
+                await writer.drain()
+                continue
+            STATS["streams"] += 1
+            streaming = True
+            writer.write(head(status, content_type))
+            async for chunk in payload:
+                writer.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            streaming = False
+    except Abort:
+        writer.transport.abort()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        if streaming:
+            STATS["cancelled"] += 1
+    finally:
+        writer.close()
+
+
+async def main():
+    servers = [await asyncio.start_server(connection, ARGS.host, port, backlog=1024) for port in ARGS.port]
+    print(f"Mock Ollama on {', '.join(f'{ARGS.host}:{p}' for p in ARGS.port)}: ttft {ARGS.ttft}s, "
+          f"{ARGS.token_rate} tokens/s, {ARGS.tokens} tokens, error rate {ARGS.error_rate}, "
+          f"abort rate {ARGS.abort_rate}", flush=True)
+    await asyncio.gather(*(server.serve_forever() for server in servers))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, action="append", help="Listen port; repeat for several backends")
+    parser.add_argument("--models", default=DEFAULT_MODELS, help="Comma-separated models for /api/tags and /api/ps")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--warm-ttft", type=float, help="TTFT for conversations already in the simulated prompt cache")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tokens per second after the first (0: no delay)")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per response")
+    parser.add_argument("--embed-dim", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per /api/embed call")
+    parser.add_argument("--load-time", type=float, default=0.0,
+                        help="Seconds to load a model that is not resident (0: every model is always loaded)")
+    parser.add_argument("--keep-alive", type=float, default=300.0, help="Seconds a model stays loaded after a request")
+    parser.add_argument("--max-loaded", type=int, default=0, help="Models resident at once (0: no limit)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--abort-rate", type=float, default=0.0, help="Fraction of streams cut off halfway")
+    parser.add_argument("--seed", type=int, help="Seed the error/abort dice for repeatable runs")
+    ARGS = parser.parse_args()
+    ARGS.port = ARGS.port or [11434]
+    ARGS.models = [m.strip() for m in ARGS.models.split(",") if m.strip()]
+    if ARGS.seed is not None:
+        random.seed(ARGS.seed)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+End-to-end gateway benchmark: starts the mock Ollama backends, runs each gateway against
+them and drives it with loadgen.py, then compares the run with the saved baseline.
+
+For each target the gateway is staged in a temporary directory with every model_map host
+rewritten to a mock backend and its state files (shared segment, access log, embedding
+cache) inside that directory, and started the way it runs in production:
+  main    gunicorn -k uvicorn.workers.UvicornWorker main:app (uvicorn --workers if gunicorn is missing)
+  webui   uvicorn webui_gateway:app
+With --direct the same load is also sent straight to a mock backend, and the report gets a
+"gateway_overhead_ms" section: the gateway's TTFB/total percentiles minus the direct ones.
+
+Results go to bench/results/<target>-<timestamp>.json. Baselines live in
+bench/baselines/<target>.json; the run exits non-zero when a metric regresses by more than
+--tolerance, or when there is no baseline to compare with. Latencies and CPU depend on the
+machine, so none are committed: record one first with --update-baseline (which replaces the
+baseline with this run), then compare later runs against it with the same options.
+
+  python3 bench/run_bench.py --target main --workers 4 --concurrency 64 --duration 30 --direct --update-baseline
+  python3 bench/run_bench.py --target main --workers 4 --concurrency 64 --duration 30 --direct
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+import yaml
+
+import loadgen
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+GATEWAY_DIR = os.path.dirname(BENCH_DIR)
+# The WebUI gateway only proxies chat
+TARGET_SCENARIOS = {"main": loadgen.SCENARIOS, "webui": ("openai_stream", "openai", "ollama_stream", "ollama")}
+
+
+def stage_gateway(workdir, mock_hosts, discovery=False, preload=False):
+    """
+    Copies the gateway into `workdir`, pointing every model_map host at a mock backend and
+    every file it writes (shared segment, access log, embedding cache) inside `workdir`, so
+    a run on a gateway host never touches the live workers' state and starts from zero.
+    Discovery polling, preloading and usage accounting are off unless asked for.
+    """
+    shutil.copytree(os.path.join(GATEWAY_DIR, "gateway_app"), os.path.join(workdir, "gateway_app"),
+                    ignore=shutil.ignore_patterns("__pycache__", "cache"))
+    shutil.copy(os.path.join(GATEWAY_DIR, "webui_gateway.py"), workdir)
+    config_path = os.path.join(workdir, "gateway_app", "config.yaml")
+    with open(config_path) as f:
+        config = yaml.safe_load(f)
+    hosts = []
+    for target in config["model_map"].values():
+        for entry in target if isinstance(target, list) else [target]:
+            host = entry["host"] if isinstance(entry, dict) else entry
+            if host not in hosts:
+                hosts.append(host)
+    # Spread the real nodes over the mock backends so replica routing still has choices
+    mapping = {host: mock_hosts[i % len(mock_hosts)] for i, host in enumerate(hosts)}
+
+    def remap(target):
+        if isinstance(target, list):
+            return [remap(entry) for entry in target]
+        if isinstance(target, dict):
+            return {**target, "host": mapping[target["host"]]}
+        return mapping[target]
+    config["model_map"] = {model: remap(target) for model, target in config["model_map"].items()}
+    config.setdefault("shared_state", {})["path"] = os.path.join(workdir, "state.bin")
+    config.setdefault("embedding_cache", {})["path"] = os.path.join(workdir, "embeddings")
+    logging = config.setdefault("logging", {})
+    logging.setdefault("access_log", {})["path"] = os.path.join(workdir, "access.log")
+    config.setdefault("discovery", {})["enabled"] = discovery
+    config.setdefault("residency", {}).setdefault("preload", {})["enabled"] = preload
+    # Never write bench traffic into the production usage table
+    config.setdefault("usage", {})["enabled"] = False
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return mapping
+
+
+def start_gateway(target, workdir, port, workers):
+    if target == "main":
+        cwd = os.path.join(workdir, "gateway_app")
+        if importlib.util.find_spec("gunicorn"):
+            command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "uvicorn.workers.UvicornWorker",
+                       "-b", f"127.0.0.1:{port}", "main:app"]
+        else:
+            command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers)]
+    else:
+        cwd = workdir
+        command = [sys.executable, "-m", "uvicorn", "webui_gateway:app", "--port", str(port),
+                   "--workers", str(workers)]
+    log = open(os.path.join(workdir, f"{target}.log"), "w")
+    return subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def start_mock(args, workdir):
+    command = [sys.executable, os.path.join(BENCH_DIR, "mock_ollama.py"), "--ttft", str(args.ttft),
+               "--token-rate", str(args.token_rate), "--tokens", str(args.tokens),
+               "--error-rate", str(args.error_rate), "--abort-rate", str(args.abort_rate)]
+    if args.seed is not None:
+        command += ["--seed", str(args.seed)]
+    for port in args.mock_ports:
+        command += ["--port", str(port)]
+    log = open(os.path.join(workdir, "mock.log"), "w")
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def stop(process):
+    if process.poll() is None:
+        # Signal the whole session so gunicorn/uvicorn workers go down with their parent
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+
+def wait_ready(url, path, process, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} during startup")
+        try:
+            if httpx.get(url + path, timeout=2.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"{url}{path} not ready after {timeout}s")
+
+
+def load_args(args, url, label, mix, gateway_pid=None):
+    run = argparse.Namespace(**vars(args))
+    run.url, run.label, run.mix, run.gateway_pid = url, label, mix, gateway_pid
+    return run
+
+
+def overhead(gateway, direct):
+    """Per-scenario gateway-minus-direct latency percentiles in milliseconds."""
+    result = {}
+    for name, section in gateway["scenarios"].items():
+        base = direct["scenarios"].get(name)
+        if not base:
+            continue
+        result[name] = {
+            f"{metric}.{q}": round(section[metric][q] - base[metric][q], 2)
+            for metric in ("ttfb_ms", "total_ms") for q in ("p50", "p95", "p99")
+            if section[metric][q] is not None and base[metric][q] is not None
+        }
+    return result
+
+
+def bench_target(target, args, workdir):
+    mix = ",".join(part for part in args.mix.split(",")
+                   if part.strip().partition("=")[0] in TARGET_SCENARIOS[target])
+    if not mix:
+        print(f"Skipping {target}: none of --mix applies to it")
+        return True
+    url = f"http://127.0.0.1:{args.gateway_port}"
+    gateway = start_gateway(target, workdir, args.gateway_port, args.workers)
+    try:
+        wait_ready(url, "/health" if target == "main" else "/api/tags", gateway)
+        print(f"Benchmarking {target} gateway (pid {gateway.pid}, mix {mix})")
+        report = asyncio.run(loadgen.LoadGenerator(load_args(args, url, target, mix, gateway.pid)).run())
+    finally:
+        stop(gateway)
+    loadgen.print_report(report)
+    report["target"] = target
+    report["settings"].update(workers=args.workers, mock={
+        "backends": len(args.mock_ports), "ttft": args.ttft, "token_rate": args.token_rate,
+        "tokens": args.tokens, "error_rate": args.error_rate, "abort_rate": args.abort_rate,
+    })
+
+    if args.direct:
+        direct_url = f"http://127.0.0.1:{args.mock_ports[0]}"
+        print(f"Sending the same load directly to the mock backend at {direct_url}")
+        direct = asyncio.run(loadgen.LoadGenerator(load_args(args, direct_url, "direct", mix)).run())
+        loadgen.print_report(direct)
+        report["direct"] = direct["scenarios"]
+        report["gateway_overhead_ms"] = overhead(report, direct)
+        for name, values in report["gateway_overhead_ms"].items():
+            print(f"{target} overhead {name}: " + ", ".join(f"{k} {v:+.1f}" for k, v in values.items()))
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    with open(os.path.join(args.results_dir, f"{target}-{stamp}.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    args.baseline = os.path.join(args.baseline_dir, f"{target}.json")
+    args.save_baseline = args.baseline if args.update_baseline else None
+    return loadgen.check_baseline(report, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=("main", "webui", "both"), default="both")
+    parser.add_argument("--workers", type=int, default=1, help="Gateway worker processes")
+    parser.add_argument("--gateway-port", type=int, default=18000)
+    parser.add_argument("--mock-ports", default="11501,11502", help="One mock backend per port")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Mock time to first token (s)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Mock tokens per second")
+    parser.add_argument("--tokens", type=int, default=64, help="Mock tokens per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Mock error injection rate")
+    parser.add_argument("--abort-rate", type=float, default=0.0, help="Mock mid-stream disconnect rate")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--discovery", action="store_true", help="Keep model discovery polling the mocks")
+    parser.add_argument("--preload", action="store_true", help="Keep residency preloading on")
+    parser.add_argument("--direct", action="store_true", help="Also measure the mock directly for overhead")
+    parser.add_argument("--results-dir", default=os.path.join(BENCH_DIR, "results"))
+    parser.add_argument("--baseline-dir", default=os.path.join(BENCH_DIR, "baselines"))
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the staged gateway and its logs")
+    loadgen.add_arguments(parser)
+    args = parser.parse_args()
+    args.mock_ports = [int(p) for p in args.mock_ports.split(",")]
+    loadgen.parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix="gateway-bench-")
+    mapping = stage_gateway(workdir, [f"127.0.0.1:{port}" for port in args.mock_ports],
+                            discovery=args.discovery, preload=args.preload)
+    print("Mock backends: " + ", ".join(f"{real} -> {mock}" for real, mock in mapping.items()))
+    mock = start_mock(args, workdir)
+    passed = True
+    try:
+        for port in args.mock_ports:
+            wait_ready(f"http://127.0.0.1:{port}", "/api/tags", mock)
+        targets = ("main", "webui") if args.target == "both" else (args.target,)
+        for target in targets:
+            passed = bench_target(target, args, workdir) and passed
+    finally:
+        stop(mock)
+        if args.keep_workdir:
+            print(f"Staged gateway and logs kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
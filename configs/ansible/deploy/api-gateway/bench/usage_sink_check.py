@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Checks the usage sink (gateway_app/usage.py) against a real PostgreSQL: records go in
+without waiting, arrive in the table in batches, and a stalled database costs dropped
+(and counted) records rather than request latency.
+
+  1. write   --records usage records are queued at --write-rate; all of them must land
+             in the table, in batches of at most --batch-size.
+  2. stall   another connection holds an ACCESS EXCLUSIVE lock on the table for --stall
+             seconds while records keep coming; the queue fills, the excess is dropped and
+             counted, and record() stays as cheap as before.
+  3. recover after the lock is released, new records are written again.
+
+The table (--table, default gateway_usage_check) is created and dropped by the check.
+
+  python3 bench/usage_sink_check.py --dsn postgresql://citadel_llm_user@127.0.0.1:5432/citadel_llm_db
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gateway_app"))
+
+from usage import UsageSink  # noqa: E402
+
+STATS = {"prompt_tokens": 16, "eval_tokens": 64, "eval_seconds": 1.3}
+
+
+def record_batch(sink: UsageSink, count: int, durations: list):
+    """Queues `count` records, appending each record() call's duration in seconds."""
+    for i in range(count):
+        started = time.perf_counter()
+        sink.record("llama3:8b", "127.0.0.1:11434", "openai", f"client-{i % 7}", True, "completed",
+                    STATS, 0.2, 1.5)
+        durations.append(time.perf_counter() - started)
+
+
+def timings(durations: list) -> str:
+    durations = sorted(durations)
+    p99 = durations[int(len(durations) * 0.99)]
+    return f"record() p99 {p99 * 1e6:.0f}us, max {durations[-1] * 1e6:.0f}us"
+
+
+async def wait_until(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+async def row_count(dsn: str, password, table: str) -> int:
+    connection = await asyncpg.connect(dsn, password=password)
+    try:
+        return await connection.fetchval(f"SELECT count(*) FROM {table}")
+    finally:
+        await connection.close()
+
+
+async def main(args) -> int:
+    password = os.getenv("POSTGRES_PASSWORD") or None
+    sink = UsageSink(args.dsn, password=password, table=args.table, max_queue=args.max_queue,
+                     batch_size=args.batch_size, flush_interval=args.flush_interval, pool_size=2,
+                     write_timeout=args.write_timeout, create_table=True, retry_interval=1.0)
+    await sink.start()
+    failures = []
+    try:
+        if not await wait_until(lambda: sink.stats()["connected"], 10):
+            print(f"Could not connect: {sink.last_error}")
+            return 1
+
+        # 1. Steady writes
+        started = time.monotonic()
+        durations = []
+        for offset in range(0, args.records, args.batch_size):
+            record_batch(sink, min(args.batch_size, args.records - offset), durations)
+            # Arrivals spread out the way requests finish, at --write-rate
+            await asyncio.sleep(args.batch_size / args.write_rate)
+        written = await wait_until(lambda: sink.written >= args.records, 30)
+        rows = await row_count(args.dsn, password, args.table)
+        print(f"write:   {sink.written} written in {sink.batches} batches, {rows} rows, "
+              f"{time.monotonic() - started:.2f}s, {timings(durations)}")
+        if not written or rows != args.records or sum(sink.dropped.values()):
+            failures.append(f"write: expected {args.records} rows, found {rows}, dropped {sink.dropped}")
+
+        # 2. Database stalled by a lock held from another connection
+        locker = await asyncpg.connect(args.dsn, password=password)
+        transaction = locker.transaction()
+        await transaction.start()
+        await locker.execute(f"LOCK TABLE {args.table} IN ACCESS EXCLUSIVE MODE")
+        before = dict(sink.dropped)
+        written_before = sink.written
+        stall_records = 0
+        durations = []
+        stall_started = time.monotonic()
+        while time.monotonic() - stall_started < args.stall:
+            record_batch(sink, args.rate // 20, durations)
+            stall_records += args.rate // 20
+            await asyncio.sleep(0.05)
+        queue_full = sink.dropped["queue_full"] - before["queue_full"]
+        print(f"stall:   {stall_records} records over {args.stall:.0f}s, {queue_full} dropped (queue full), "
+              f"queue {sink.queue.qsize()}/{sink.max_queue}, {timings(durations)}")
+        if queue_full == 0:
+            failures.append("stall: no records were dropped while the table was locked")
+        # A record() that waited on the locked table would take seconds; single calls of a
+        # millisecond or two happen on any host (scheduler and GC pauses), so the tight bound
+        # applies to the p99 and only a wait-sized bound to the slowest call
+        durations.sort()
+        p99 = durations[int(len(durations) * 0.99)]
+        if p99 > 0.001:
+            failures.append(f"stall: record() p99 was {p99 * 1000:.1f}ms")
+        if durations[-1] > 0.05:
+            failures.append(f"stall: record() took {durations[-1] * 1000:.1f}ms")
+        await transaction.rollback()
+        await locker.close()
+        # Batches stuck behind the lock either landed or timed out and were counted
+        await wait_until(lambda: sink.queue.empty() and not sink.stats()["flushing"], args.write_timeout * 4)
+        write_failed = sink.dropped["write_failed"] - before["write_failed"]
+        accounted = sink.written - written_before + queue_full + write_failed
+        print(f"         after the lock: {sink.written - written_before} written, {write_failed} write_failed")
+        if accounted != stall_records:
+            failures.append(f"stall: {stall_records} records but {accounted} accounted for")
+
+        # 3. Recovery
+        written_before = sink.written
+        record_batch(sink, args.batch_size, [])
+        recovered = await wait_until(lambda: sink.written - written_before >= args.batch_size, 10)
+        rows = await row_count(args.dsn, password, args.table)
+        print(f"recover: {sink.written - written_before} written, {rows} rows in total")
+        if not recovered:
+            failures.append("recover: records were not written after the lock was released")
+        if rows != sink.written:
+            failures.append(f"rows: table has {rows} rows, sink reports {sink.written} written")
+    finally:
+        await sink.stop()
+        if not args.keep:
+            connection = await asyncpg.connect(args.dsn, password=password)
+            await connection.execute(f"DROP TABLE IF EXISTS {args.table}")
+            await connection.close()
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print("OK" if not failures else f"{len(failures)} check(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default="postgresql://citadel_llm_user@127.0.0.1:5432/citadel_llm_db",
+                        help="Password from POSTGRES_PASSWORD, as in the gateway")
+    parser.add_argument("--table", default="gateway_usage_check")
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--flush-interval", type=float, default=0.5)
+    parser.add_argument("--max-queue", type=int, default=2000)
+    parser.add_argument("--write-timeout", type=float, default=2.0)
+    parser.add_argument("--write-rate", type=int, default=20000, help="Records per second in the write phase")
+    parser.add_argument("--stall", type=float, default=5.0, help="Seconds the table stays locked")
+    parser.add_argument("--rate", type=int, default=2000, help="Records per second during the stall")
+    parser.add_argument("--keep", action="store_true", help="Leave the table in place")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Per-chunk overhead microbenchmark for the streaming NDJSON <-> SSE transcoder.
+
+Feeds synthetic upstream streams (one token per chunk, the way Ollama emits them)
+through gateway_app.transcode and reports the cost per chunk next to a plain
+passthrough and a naive parse-to-dict/re-serialize converter.
+
+Usage: python3 bench_transcode.py [--chunks 2000] [--repeat 20]
+"""
+import argparse
+import json
+import time
+from functools import partial
+
+from gateway_app.transcode import NDJSONToSSE, SSEToNDJSON
+
+MODEL = "llama3:8b"
+# Ollama (Go's encoding/json) emits compact JSON
+dumps = partial(json.dumps, separators=(",", ":"), ensure_ascii=False)
+WORDS = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", ".", "\n", " \"quoted\"", " ünïcode"]
+
+
+def sse_stream(n):
+    chunks = []
+    for i in range(n):
+        event = {
+            "id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1700000000, "model": MODEL,
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": WORDS[i % len(WORDS)]}, "finish_reason": None}],
+        }
+        chunks.append(b"data: " + dumps(event).encode() + b"\n\n")
+    final = {"id": "chatcmpl-1", "object": "chat.completion.chunk", "created": 1700000000, "model": MODEL,
+             "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+    chunks.append(b"data: " + dumps(final).encode() + b"\n\ndata: [DONE]\n\n")
+    return chunks
+
+
+def ndjson_stream(n):
+    chunks = []
+    for i in range(n):
+        event = {"model": MODEL, "created_at": "2024-01-01T00:00:00Z",
+                 "message": {"role": "assistant", "content": WORDS[i % len(WORDS)]}, "done": False}
+        chunks.append(dumps(event).encode() + b"\n")
+    final = {"model": MODEL, "created_at": "2024-01-01T00:00:00Z", "message": {"role": "assistant", "content": ""},
+             "done_reason": "stop", "done": True, "eval_count": n, "eval_duration": n * 20_000_000}
+    chunks.append(dumps(final).encode() + b"\n")
+    return chunks
+
+
+class Passthrough:
+    def feed(self, chunk):
+        return chunk
+
+    def close(self):
+        return b""
+
+
+class NaiveSSEToNDJSON:
+    """Reference implementation: full dict round trip for every event."""
+    def feed(self, chunk):
+        out = []
+        for line in chunk.split(b"\n"):
+            if line.startswith(b"data: ") and line[6:] != b"[DONE]":
+                event = json.loads(line[6:])
+                for choice in event["choices"]:
+                    content = choice["delta"].get("content")
+                    if content:
+                        out.append(json.dumps({
+                            "model": event["model"], "created_at": "2024-01-01T00:00:00Z",
+                            "message": {"role": "assistant", "content": content}, "done": False,
+                        }).encode() + b"\n")
+        return b"".join(out)
+
+    def close(self):
+        return b""
+
+
+def run(factory, chunks, repeat):
+    best = float("inf")
+    produced = 0
+    for _ in range(repeat):
+        transcoder = factory()
+        out = []
+        started = time.perf_counter_ns()
+        for chunk in chunks:
+            out.append(transcoder.feed(chunk))
+        out.append(transcoder.close())
+        elapsed = time.perf_counter_ns() - started
+        best = min(best, elapsed)
+        produced = sum(len(o) for o in out)
+    return best / len(chunks), produced
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=2000, help="Tokens per synthetic stream")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per case; the fastest is reported")
+    args = parser.parse_args()
+
+    sse, ndjson = sse_stream(args.chunks), ndjson_stream(args.chunks)
+    cases = [
+        ("passthrough (SSE)", Passthrough, sse),
+        ("naive SSE -> NDJSON", NaiveSSEToNDJSON, sse),
+        ("SSE -> NDJSON", lambda: SSEToNDJSON(MODEL), sse),
+        ("NDJSON -> SSE", lambda: NDJSONToSSE(MODEL), ndjson),
+    ]
+    print(f"{args.chunks} chunks per stream, best of {args.repeat} runs")
+    print(f"{'case':<24}{'ns/chunk':>12}{'chunks/s':>14}{'output bytes':>14}")
+    for name, factory, chunks in cases:
+        per_chunk, produced = run(factory, chunks, args.repeat)
+        print(f"{name:<24}{per_chunk:>12.0f}{1e9 / per_chunk:>14,.0f}{produced:>14,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# access_log.py
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+ACCESS_LOGGER = "citadel-gateway.access"
+
+
+class RequestTiming:
+    """
+    Where one request's time went. mark(phase) charges the time since the previous mark
+    to `phase`, so the phases add up to the total.
+    """
+    __slots__ = ("started", "last", "phases", "fields")
+
+    def __init__(self):
+        self.started = self.last = time.monotonic()
+        self.phases: Dict[str, float] = {}
+        # Extra attributes for the access record (model, backend, cache status, ...)
+        self.fields: Dict[str, Any] = {}
+
+    def mark(self, phase: str):
+        now = time.monotonic()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self.last)
+        self.last = now
+
+    def server_timing(self) -> str:
+        """Server-Timing header value (durations in milliseconds) for the phases so far."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={(time.monotonic() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+class _QueuedHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread unformatted; drops them when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue, on_drop: Callable[[], None]):
+        super().__init__(log_queue)
+        self.on_drop = on_drop
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread. Only what may change or vanish before it
+        # gets there is rendered now: %-style arguments and a live exception's traceback.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.on_drop()
+
+
+class _JSONFormatter(logging.Formatter):
+    """One JSON object per line; access records are logged as dicts."""
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = record.msg if isinstance(record.msg, dict) else {"message": record.getMessage()}
+        timestamp = self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z"
+        return json.dumps({"ts": timestamp, **data}, separators=(",", ":"), default=str)
+
+
+class LogWriter:
+    """
+    Takes log I/O off the event loop. The root logger gets a single handler that puts
+    records on a bounded queue; a background thread (logging.handlers.QueueListener)
+    formats them and writes application logs to stderr (the journal) and access records
+    to `access_path` ("-" or empty: stderr). If the writer falls behind, records are
+    dropped and counted instead of blocking a request.
+    """
+    def __init__(self, level: str, fmt: str, access_path: Optional[str] = None, max_queue: int = 10000):
+        self.queue: queue.Queue = queue.Queue(max(1, max_queue))
+        self.max_queue = max(1, max_queue)
+        self.dropped = 0
+        self.on_drop: Optional[Callable[[str], None]] = None
+        self.access_path = access_path if access_path and access_path != "-" else None
+        open_error = None
+
+        app_handler = logging.StreamHandler(sys.stderr)
+        app_handler.setFormatter(logging.Formatter(fmt))
+        app_handler.addFilter(lambda record: not record.name.startswith(ACCESS_LOGGER))
+        access_handler = None
+        if self.access_path is not None:
+            try:
+                # Reopens the file after logrotate moves it
+                access_handler = logging.handlers.WatchedFileHandler(self.access_path)
+            except OSError as e:
+                open_error = e
+                self.access_path = None
+        if access_handler is None:
+            access_handler = logging.StreamHandler(sys.stderr)
+        access_handler.setFormatter(_JSONFormatter())
+        access_handler.addFilter(lambda record: record.name.startswith(ACCESS_LOGGER))
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_QueuedHandler(self.queue, self._record_drop))
+        # Access records are emitted at INFO whatever LOG_LEVEL says
+        logging.getLogger(ACCESS_LOGGER).setLevel(logging.INFO)
+        self.listener = logging.handlers.QueueListener(self.queue, app_handler, access_handler,
+                                                       respect_handler_level=True)
+        self.listener.start()
+        if open_error is not None:
+            logging.getLogger("citadel-gateway").error(
+                f"Could not open access log {access_path}: {open_error}; writing access records to stderr")
+
+    def _record_drop(self):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop("queue_full")
+
+    def stop(self):
+        """Writes out what is still queued and stops the writer thread."""
+        try:
+            self.listener.stop()
+        except queue.Full:
+            # No room for the stop sentinel; the daemon thread ends with the process
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queue.qsize(),
+            "max_queue": self.max_queue,
+            "dropped": self.dropped,
+            "access_path": self.access_path or "stderr",
+        }
+
+
+class AccessLog:
+    """
+    Structured access records, one per request. Errors (status >= 400) and requests slower
+    than `slow_threshold` seconds are always kept; other requests are sampled at
+    `sample_rate`. A token bucket caps records at `max_per_second` per worker (0: no cap).
+    """
+    def __init__(self, sample_rate: float = 1.0, slow_threshold: float = 10.0,
+                 max_per_second: float = 0.0, exclude_paths: Iterable[str] = ()):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.slow_threshold = slow_threshold
+        self.max_per_second = max_per_second
+        self.exclude_paths = set(exclude_paths)
+        self.logger = logging.getLogger(ACCESS_LOGGER)
+        self.on_drop: Optional[Callable[[str], None]] = None
+        self._tokens = max_per_second
+        self._refilled_at = time.monotonic()
+        self.written = 0
+        self.sampled_out = 0
+        self.rate_limited = 0
+
+    def _skip(self, reason: str):
+        if self.on_drop is not None:
+            self.on_drop(reason)
+
+    def write(self, record: Dict[str, Any]):
+        if record["path"] in self.exclude_paths:
+            return
+        keep = record["status"] >= 400 or record["duration_ms"] >= self.slow_threshold * 1000
+        if not keep and self.sample_rate < 1.0:
+            if random.random() >= self.sample_rate:
+                self.sampled_out += 1
+                self._skip("sampled")
+                return
+            # Lets log queries weight sampled records back up
+            record["sample_rate"] = self.sample_rate
+        if self.max_per_second > 0:
+            now = time.monotonic()
+            self._tokens = min(self.max_per_second, self._tokens + (now - self._refilled_at) * self.max_per_second)
+            self._refilled_at = now
+            if self._tokens < 1.0:
+                self.rate_limited += 1
+                self._skip("rate_limited")
+                return
+            self._tokens -= 1.0
+        self.written += 1
+        # Serialized to JSON on the writer thread
+        self.logger.info(record)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "written": self.written,
+            "sampled_out": self.sampled_out,
+            "rate_limited": self.rate_limited,
+            "sample_rate": self.sample_rate,
+            "max_per_second": self.max_per_second,
+        }
+
+
+class AccessLogMiddleware:
+    """
+    ASGI middleware that gives every HTTP request a RequestTiming (request.state.timing),
+    adds the Server-Timing header when the response starts, and writes the access record
+    once the last body chunk is sent or the client goes away.
+    """
+    def __init__(self, app, access_log: Optional[AccessLog] = None, server_timing: bool = True):
+        self.app = app
+        self.access_log = access_log
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        scope.setdefault("state", {})["timing"] = timing
+        response = {"status": 500, "bytes": 0, "complete": False}
+
+        async def send_timed(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                if "ttfb" not in timing.phases:
+                    # Anything but a proxied chat: the endpoint's own work
+                    timing.mark("handler")
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", timing.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response["complete"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            if self.access_log is not None:
+                timing.mark("stream")
+                client = scope.get("client")
+                record = {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": response["status"],
+                    "duration_ms": round((timing.last - timing.started) * 1000, 1),
+                    "bytes": response["bytes"],
+                    "client": client[0] if client else None,
+                    "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in timing.phases.items()},
+                    **timing.fields,
+                }
+                if not response["complete"]:
+                    record["aborted"] = True
+                self.access_log.write(record)
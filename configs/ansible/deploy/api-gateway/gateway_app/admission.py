@@ -0,0 +1,325 @@
+# admission.py
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+logger = logging.getLogger("citadel-gateway")
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; `retry_after` is a hint in whole seconds."""
+    def __init__(self, model: str, reason: str, retry_after: int):
+        super().__init__(f"{reason} for '{model}'")
+        self.model = model
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    A granted slot: one model slot plus one slot on the chosen backend. `claimed` is set
+    by whichever code path takes over responsibility for releasing it.
+    """
+    __slots__ = ("model", "choice", "host", "granted_at", "waited", "claimed", "released")
+
+    def __init__(self, model: str, choice: Any, host: str, waited: float):
+        self.model = model
+        self.choice = choice
+        self.host = host
+        self.granted_at = time.monotonic()
+        self.waited = waited
+        self.claimed = False
+        self.released = False
+
+
+class _Waiter:
+    __slots__ = ("model", "select", "enqueued_at", "future")
+
+    def __init__(self, model: str, select: Callable[[Set[str]], Any]):
+        self.model = model
+        self.select = select
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class _ModelState:
+    __slots__ = ("active", "queue", "admitted", "queued", "rejected", "timeouts", "waits", "hold_ewma",
+                 "key", "queue_key")
+
+    def __init__(self, key: Optional[str] = None, queue_key: Optional[str] = None):
+        self.active = 0
+        # Shared-state keys for the host-wide active count and queue depth, when shared
+        self.key = key
+        self.queue_key = queue_key
+        self.queue: List[tuple] = []  # heap of (-priority, seq, waiter)
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.waits: Deque[float] = deque(maxlen=1024)
+        self.hold_ewma: Optional[float] = None
+
+
+class AdmissionController:
+    """
+    Per-model and per-backend concurrency limits with a bounded wait queue per model.
+
+    A request is admitted when its model is under its limit and the router can pick a
+    replica whose backend is under its limit. Otherwise it waits in the model's queue,
+    highest priority first and FIFO within a priority. When the queue is full, or the
+    wait exceeds `queue_timeout`, the request is rejected with a Retry-After estimate
+    derived from the queue depth and the model's average slot hold time.
+    A limit of 0 means unlimited.
+
+    With `shared` (a shared_state.SharedState) the limits apply to all gateway workers
+    on the host together: active counts live in the shared segment and grants that hit a
+    limit are checked and taken under its lock. Queues stay per worker, so waiters poll
+    every `poll_interval` seconds for slots freed by other workers.
+    """
+    def __init__(self, model_limits: Optional[Dict[str, int]] = None, default_model_limit: int = 0,
+                 backend_limits: Optional[Dict[str, int]] = None, default_backend_limit: int = 0,
+                 max_queue: int = 32, queue_timeout: float = 60.0,
+                 shared: Any = None, poll_interval: float = 0.05):
+        self._models: Dict[str, _ModelState] = {}
+        self._backend_active: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self.shared = shared
+        self.poll_interval = poll_interval
+        self._poll_handle: Optional[asyncio.TimerHandle] = None
+        self._backend_keys: Dict[str, str] = {}
+        self._backend_prefix = shared.SEP.join(("admission", "backend_active", "")) if shared is not None else ""
+        self.configure(model_limits, default_model_limit, backend_limits, default_backend_limit,
+                       max_queue, queue_timeout)
+
+    def configure(self, model_limits: Optional[Dict[str, int]] = None, default_model_limit: int = 0,
+                  backend_limits: Optional[Dict[str, int]] = None, default_backend_limit: int = 0,
+                  max_queue: int = 32, queue_timeout: float = 60.0):
+        """Replaces the limits in place; active slots and queued requests are kept (used on reload)."""
+        self.model_limits = {m: int(n) for m, n in (model_limits or {}).items()}
+        self.default_model_limit = int(default_model_limit)
+        self.backend_limits = {h: int(n) for h, n in (backend_limits or {}).items()}
+        self.default_backend_limit = int(default_backend_limit)
+        self.max_queue = int(max_queue)
+        self.queue_timeout = float(queue_timeout)
+        # Raised limits may free capacity for requests already waiting
+        if any(state.queue for state in self._models.values()):
+            self._dispatch()
+
+    def model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.default_model_limit)
+
+    def backend_limit(self, host: str) -> int:
+        return self.backend_limits.get(host, self.default_backend_limit)
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            if self.shared is None:
+                state = self._models[model] = _ModelState()
+            else:
+                sep = self.shared.SEP
+                state = self._models[model] = _ModelState(sep.join(("admission", "model_active", model)),
+                                                          sep.join(("admission", "queue_depth", model)))
+        return state
+
+    def _queue_changed(self, state: _ModelState):
+        if state.queue_key is not None:
+            self.shared.set(state.queue_key, len(state.queue), self.shared.GAUGE)
+
+    def _backend_key(self, host: str) -> str:
+        key = self._backend_keys.get(host)
+        if key is None:
+            key = self._backend_keys[host] = self._backend_prefix + host
+        return key
+
+    def _model_active(self, state: _ModelState) -> int:
+        """Active slots for the model on this host (this worker only without shared state)."""
+        if state.key is None:
+            return state.active
+        return int(self.shared.total(state.key))
+
+    def _host_active(self) -> Dict[str, int]:
+        if self.shared is None:
+            return self._backend_active
+        hosts = set(self._backend_active) | set(self.backend_limits)
+        hosts.update(name[len(self._backend_prefix):] for name in self.shared.names(self._backend_prefix))
+        return {host: int(self.shared.total(self._backend_key(host))) for host in hosts}
+
+    def saturated_backends(self) -> Set[str]:
+        saturated = set()
+        for host, active in self._host_active().items():
+            limit = self.backend_limit(host)
+            if limit and active >= limit:
+                saturated.add(host)
+        return saturated
+
+    def _try_grant(self, model: str, select: Callable[[Set[str]], Any], waited: float) -> Optional[Ticket]:
+        if self.shared is not None and (self.model_limit(model) or self.backend_limits or self.default_backend_limit):
+            # Another worker may take the last slot between our check and our update
+            with self.shared.locked():
+                return self._grant(model, select, waited)
+        return self._grant(model, select, waited)
+
+    def _grant(self, model: str, select: Callable[[Set[str]], Any], waited: float) -> Optional[Ticket]:
+        state = self._state(model)
+        limit = self.model_limit(model)
+        if limit and self._model_active(state) >= limit:
+            return None
+        choice = select(self.saturated_backends())
+        if choice is None:
+            return None
+        host = choice.host
+        state.active += 1
+        state.admitted += 1
+        state.waits.append(waited)
+        self._backend_active[host] = self._backend_active.get(host, 0) + 1
+        if self.shared is not None:
+            self.shared.add(state.key, 1, self.shared.GAUGE)
+            self.shared.add(self._backend_key(host), 1, self.shared.GAUGE)
+        return Ticket(model, choice, host, waited)
+
+    def retry_after(self, model: str) -> int:
+        state = self._state(model)
+        hold = state.hold_ewma if state.hold_ewma is not None else 1.0
+        concurrency = self.model_limit(model) or 1
+        # The limit is host-wide when shared, so count every worker's waiters
+        depth = len(state.queue) if state.queue_key is None else int(self.shared.total(state.queue_key))
+        return max(1, math.ceil(hold * (depth + 1) / concurrency))
+
+    async def admit(self, model: str, select: Callable[[Set[str]], Any], priority: int = 0) -> Ticket:
+        """
+        Waits for a slot and returns its Ticket. `select(saturated_hosts)` must return the
+        chosen replica (anything with a `.host`) or None when every candidate is excluded.
+        Raises AdmissionRejected when the queue is full or the wait times out.
+        """
+        state = self._state(model)
+        # Nobody may overtake requests that are already waiting for this model
+        if not state.queue:
+            ticket = self._try_grant(model, select, 0.0)
+            if ticket is not None:
+                return ticket
+        if len(state.queue) >= self.max_queue:
+            state.rejected += 1
+            raise AdmissionRejected(model, "Queue full", self.retry_after(model))
+
+        waiter = _Waiter(model, select)
+        heapq.heappush(state.queue, (-priority, next(self._seq), waiter))
+        state.queued += 1
+        self._queue_changed(state)
+        self._schedule_poll()
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.future.done():
+                return waiter.future.result()
+            self._remove(waiter)
+            state.timeouts += 1
+            raise AdmissionRejected(model, "Timed out waiting in the admission queue", self.retry_after(model))
+        except asyncio.CancelledError:
+            # The client went away: hand back a slot granted in the meantime, or leave the queue
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(waiter.future.result())
+            else:
+                self._remove(waiter)
+            raise
+
+    def _remove(self, waiter: _Waiter):
+        state = self._state(waiter.model)
+        state.queue = [entry for entry in state.queue if entry[2] is not waiter]
+        heapq.heapify(state.queue)
+        self._queue_changed(state)
+        if not waiter.future.done():
+            waiter.future.cancel()
+
+    def release(self, ticket: Ticket):
+        """Returns the ticket's slots and admits waiting requests. Safe to call twice."""
+        if ticket.released:
+            return
+        ticket.released = True
+        state = self._state(ticket.model)
+        state.active -= 1
+        held = time.monotonic() - ticket.granted_at
+        state.hold_ewma = held if state.hold_ewma is None else 0.2 * held + 0.8 * state.hold_ewma
+        self._backend_active[ticket.host] -= 1
+        if self.shared is not None:
+            self.shared.add(state.key, -1, self.shared.GAUGE)
+            self.shared.add(self._backend_key(ticket.host), -1, self.shared.GAUGE)
+        self._dispatch()
+
+    def _schedule_poll(self):
+        # Other workers release slots without telling us, so look again while anyone waits
+        if self.shared is None or self._poll_handle is not None:
+            return
+        self._poll_handle = asyncio.get_running_loop().call_later(self.poll_interval, self._poll)
+
+    def _poll(self):
+        self._poll_handle = None
+        self._dispatch()
+        if any(state.queue for state in self._models.values()):
+            self._schedule_poll()
+
+    def _dispatch(self):
+        # Serve the model whose head request has waited longest first, so a busy model
+        # cannot starve another one that shares its backend
+        now = time.monotonic()
+        waiting = sorted(
+            (state.queue[0][2].enqueued_at, model) for model, state in self._models.items() if state.queue
+        )
+        for _, model in waiting:
+            state = self._models[model]
+            while state.queue:
+                waiter = state.queue[0][2]
+                ticket = self._try_grant(model, waiter.select, now - waiter.enqueued_at)
+                if ticket is None:
+                    break
+                heapq.heappop(state.queue)
+                self._queue_changed(state)
+                waiter.future.set_result(ticket)
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Requests waiting per model, across all workers when shared."""
+        if self.shared is None:
+            return {model: len(state.queue) for model, state in self._models.items()}
+        prefix = self.shared.SEP.join(("admission", "queue_depth", ""))
+        return {name[len(prefix):]: int(self.shared.total(name)) for name in self.shared.names(prefix)}
+
+    @staticmethod
+    def _percentile(values: List[float], q: float) -> Optional[float]:
+        if not values:
+            return None
+        return round(values[min(len(values) - 1, int(q * len(values)))], 4)
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for model, state in self._models.items():
+            waits = sorted(state.waits)
+            models[model] = {
+                "active": self._model_active(state),
+                "limit": self.model_limit(model) or None,
+                "queue_depth": len(state.queue),
+                "admitted": state.admitted,
+                "queued": state.queued,
+                "rejected": state.rejected,
+                "timeouts": state.timeouts,
+                "wait_p50": self._percentile(waits, 0.50),
+                "wait_p95": self._percentile(waits, 0.95),
+                "wait_p99": self._percentile(waits, 0.99),
+                "avg_hold_seconds": round(state.hold_ewma, 3) if state.hold_ewma is not None else None,
+            }
+            if self.shared is not None:
+                models[model]["worker_active"] = state.active
+        return {
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "shared": self.shared is not None,
+            "models": models,
+            "backends": {
+                host: {"active": active, "limit": self.backend_limit(host) or None}
+                for host, active in self._host_active().items()
+            },
+        }
@@ -0,0 +1,96 @@
+# cache.py
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("citadel-gateway")
+
+
+def request_cache_key(payload: Dict[str, Any]) -> str:
+    """Canonical hash of model, messages and sampling params (the stream flag is ignored)."""
+    canonical = {k: v for k, v in payload.items() if k != "stream" and v is not None}
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(payload: Dict[str, Any]) -> bool:
+    """Only non-streaming requests pinned to temperature 0 give repeatable answers."""
+    return not payload.get("stream") and payload.get("temperature") == 0
+
+
+class ResponseCache:
+    """
+    LRU cache of complete chat completion bodies, capped by total bytes, with a TTL
+    per model. Lives in one worker's memory; each worker keeps its own copy.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, default_ttl: float = 300.0,
+                 model_ttl: Optional[Dict[str, float]] = None, max_entry_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.default_ttl = default_ttl
+        self.model_ttl = model_ttl or {}
+        self._entries: "OrderedDict[str, Tuple[bytes, float, float]]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def ttl_for(self, model: str) -> float:
+        return float(self.model_ttl.get(model, self.default_ttl))
+
+    def get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        """Returns (body, age_seconds) for a fresh entry and marks it recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        body, stored_at, expires_at = entry
+        now = time.monotonic()
+        if now >= expires_at:
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body, now - stored_at
+
+    def put(self, key: str, model: str, body: bytes):
+        ttl = self.ttl_for(model)
+        if ttl <= 0 or len(body) > self.max_entry_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        now = time.monotonic()
+        self._entries[key] = (body, now, now + ttl)
+        self.size_bytes += len(body)
+        self.stores += 1
+        while self.size_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        body, _, _ = self._entries.pop(key)
+        self.size_bytes -= len(body)
+
+    def record_bypass(self):
+        self.bypassed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
@@ -2,32 +2,143 @@
 import os
 import yaml
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 # Set up a logger for this module
 logger = logging.getLogger(__name__)
 
+def validate_model_replicas(model_replicas: Dict[str, List[Dict[str, Any]]]) -> List[str]:
+    """
+    Checks every model_map entry (a single host or a list of weighted replicas) and
+    returns a list of human-readable errors. An empty list means the map is valid.
+    """
+    if not model_replicas:
+        return ["Empty model map"]
+
+    invalid_entries = []
+    for model_name, replicas in model_replicas.items():
+        # Check model name is a non-empty string
+        if not isinstance(model_name, str) or not model_name.strip():
+            invalid_entries.append(f"Invalid model name: '{model_name}' (must be non-empty string)")
+        if not replicas:
+            invalid_entries.append(f"No backend hosts for '{model_name}' (replica list is empty)")
+
+        for replica in replicas:
+            backend_host = replica["host"]
+            weight = replica["weight"]
+            # Check backend host format (should be host:port)
+            if not isinstance(backend_host, str) or not backend_host.strip():
+                invalid_entries.append(f"Invalid backend host for '{model_name}': '{backend_host}' (must be non-empty string)")
+            elif ':' not in backend_host or len(backend_host.split(':')) != 2:
+                invalid_entries.append(f"Invalid backend host format for '{model_name}': '{backend_host}' (expected format: host:port)")
+            else:
+                # Validate port is numeric
+                try:
+                    host, port = backend_host.split(':')
+                    if not host.strip():
+                        invalid_entries.append(f"Empty host in '{model_name}': '{backend_host}'")
+                    port_num = int(port)
+                    if not (1 <= port_num <= 65535):
+                        invalid_entries.append(f"Invalid port range for '{model_name}': {port_num} (must be 1-65535)")
+                except ValueError:
+                    invalid_entries.append(f"Non-numeric port for '{model_name}': '{backend_host}'")
+
+            # Check replica weight is a positive number
+            if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+                invalid_entries.append(f"Invalid weight for '{model_name}' on '{backend_host}': '{weight}' (must be a positive number)")
+
+    return invalid_entries
+
 class GatewayConfig:
     """
     A centralized class to load and manage gateway configuration from a YAML file.
     """
     def __init__(self, config_path="config.yaml"):
         self.model_map = {}
+        self.model_replicas = {}
         self.backend_hosts = []
+        self.upstream = {}
+        self.routing = {}
+        self.health_check = {}
+        self.reload = {}
+        self.response_cache = {}
+        self.coalescing = {}
+        self.discovery = {}
+        self.admission = {}
+        self.embeddings = {}
+        self.embedding_cache = {}
+        self.shared_state = {}
+        self.passthrough = {}
+        self.residency = {}
+        self.logging = {}
+        self.usage = {}
 
         try:
             with open(config_path, "r") as f:
                 config = yaml.safe_load(f)
                 
                 # Load the model map directly from the yaml file
-                self.model_map = config.get("model_map", {})
+                self.model_map = config.get("model_map", {}) or {}
                 logger.info(f"Successfully loaded {len(self.model_map)} model mappings from {config_path}")
 
+                # Each model maps to a single "host:port" or to a list of (optionally weighted) replicas
+                self.model_replicas = {
+                    model: self._normalize_replicas(value) for model, value in self.model_map.items()
+                }
+
                 # Automatically derive the list of unique backend hosts from the model map values
                 if self.model_map:
-                    self.backend_hosts = sorted(list(set(self.model_map.values())))
+                    self.backend_hosts = sorted(set(
+                        r["host"] for replicas in self.model_replicas.values() for r in replicas
+                        if isinstance(r["host"], str)
+                    ))
                     logger.info(f"Discovered {len(self.backend_hosts)} unique backend hosts.")
 
+                # Replica selection strategy for models with more than one backend
+                self.routing = config.get("routing", {}) or {}
+
+                # Active backend probing and circuit breaker thresholds
+                self.health_check = config.get("health_check", {}) or {}
+
+                # How often each worker checks this file for changes (hot reload)
+                self.reload = config.get("reload", {}) or {}
+
+                # Opt-in cache for deterministic (temperature 0, non-streaming) completions
+                self.response_cache = config.get("response_cache", {}) or {}
+
+                # Single-flight coalescing of identical in-flight chat requests
+                self.coalescing = config.get("coalescing", {}) or {}
+
+                # Live model discovery from each node's /api/tags and /api/ps
+                self.discovery = config.get("discovery", {}) or {}
+
+                # Per-model / per-backend concurrency limits and the wait queue in front of them
+                self.admission = config.get("admission", {}) or {}
+
+                # Micro-batching of concurrent embedding requests
+                self.embeddings = config.get("embeddings", {}) or {}
+
+                # Persistent memory-mapped embedding cache shared by all workers
+                self.embedding_cache = config.get("embedding_cache", {}) or {}
+
+                # Shared-memory segment for routing, admission and metrics across workers
+                self.shared_state = config.get("shared_state", {}) or {}
+
+                # Forward chat bodies unparsed instead of validating them with Pydantic
+                self.passthrough = config.get("passthrough", {}) or {}
+
+                # Model residency tracking, warm-replica preference and predictive preloading
+                self.residency = config.get("residency", {}) or {}
+
+                # Background log writer, JSON access records and the Server-Timing header
+                self.logging = config.get("logging", {}) or {}
+
+                # Per-request usage accounting batched into PostgreSQL
+                self.usage = config.get("usage", {}) or {}
+
+                # Connection pool and timeout settings for the upstream HTTP clients
+                self.upstream = config.get("upstream", {}) or {}
+
             if not self.model_map:
                 logger.warning(f"model_map in {config_path} is empty or not found.")
 
@@ -36,14 +147,98 @@ class GatewayConfig:
         except Exception as e:
             logger.error(f"CRITICAL: Error loading or parsing {config_path}: {e}")
 
-    def get_model_mapping(self) -> Dict[str, str]:
+    @staticmethod
+    def _normalize_replicas(value: Any) -> List[Dict[str, Any]]:
+        """
+        Turns a model_map value into a list of {"host", "weight"} entries. Accepts a
+        "host:port" string, a list of such strings, or a list of {host, weight} mappings.
+        Malformed entries are passed through so validation can report them.
+        """
+        entries = value if isinstance(value, list) else [value]
+        replicas = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                replicas.append({"host": entry.get("host"), "weight": entry.get("weight", 1)})
+            else:
+                replicas.append({"host": entry, "weight": 1})
+        return replicas
+
+    def get_model_mapping(self) -> Dict[str, Any]:
         """Returns the loaded model-to-host map."""
         return self.model_map
 
+    def get_model_replicas(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Returns the model map normalized to a list of weighted replicas per model."""
+        return self.model_replicas
+
     def get_backend_hosts(self) -> List[str]:
         """Returns the list of unique backend hosts derived from the model map."""
         return self.backend_hosts
 
+    def get_upstream_settings(self) -> Dict[str, float]:
+        """Returns the upstream connection pool settings (sizes, keep-alive, timeouts)."""
+        return self.upstream
+
+    def get_routing_settings(self) -> Dict[str, Any]:
+        """Returns the replica selection settings (strategy, EWMA smoothing)."""
+        return self.routing
+
+    def get_health_check_settings(self) -> Dict[str, Any]:
+        """Returns the backend probe interval/timeout and circuit breaker settings."""
+        return self.health_check
+
+    def get_reload_settings(self) -> Dict[str, Any]:
+        """Returns the hot reload settings (file watch interval)."""
+        return self.reload
+
+    def get_response_cache_settings(self) -> Dict[str, Any]:
+        """Returns the response cache settings (enabled, size cap, TTLs)."""
+        return self.response_cache
+
+    def get_coalescing_settings(self) -> Dict[str, Any]:
+        """Returns the single-flight settings (enabled, join window, eligible models)."""
+        return self.coalescing
+
+    def get_discovery_settings(self) -> Dict[str, Any]:
+        """Returns the live model discovery settings (poll TTL, staleness, unmapped routing)."""
+        return self.discovery
+
+    def get_admission_settings(self) -> Dict[str, Any]:
+        """Returns the admission control settings (concurrency limits, queue size and timeout)."""
+        return self.admission
+
+    def get_embeddings_settings(self) -> Dict[str, Any]:
+        """Returns the embedding batcher settings (batch window, maximum batch size, timeout)."""
+        return self.embeddings
+
+    def get_embedding_cache_settings(self) -> Dict[str, Any]:
+        """Returns the persistent embedding cache settings (directory, arena size, index entries)."""
+        return self.embedding_cache
+
+    def get_shared_state_settings(self) -> Dict[str, Any]:
+        """Returns the cross-worker shared state settings (segment path, worker and key capacity)."""
+        return self.shared_state
+
+    def get_passthrough_settings(self) -> Dict[str, Any]:
+        """Returns the chat request passthrough settings (enabled; off means full validation)."""
+        return self.passthrough
+
+    def get_residency_settings(self) -> Dict[str, Any]:
+        """Returns the model residency settings (cold penalty, eviction guard, preloading)."""
+        return self.residency
+
+    def get_logging_settings(self) -> Dict[str, Any]:
+        """Returns the logging settings (writer queue, access log sampling, Server-Timing)."""
+        return self.logging
+
+    def get_usage_settings(self) -> Dict[str, Any]:
+        """Returns the usage accounting settings (PostgreSQL sink, batching, queue bound)."""
+        return self.usage
+
+    def validate(self) -> List[str]:
+        """Returns the validation errors for the loaded model map (empty when valid)."""
+        return validate_model_replicas(self.model_replicas)
+
     def reload_config(self, config_path="config.yaml"):
         """Reload configuration from file."""
         logger.info(f"Reloading configuration from {config_path}")
@@ -0,0 +1,170 @@
+# discovery.py
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import httpx
+
+logger = logging.getLogger("citadel-gateway")
+
+
+class HostInventory:
+    """Last known /api/tags and /api/ps results for one Ollama node."""
+    __slots__ = ("host", "models", "loaded", "updated_at", "error")
+
+    def __init__(self, host: str):
+        self.host = host
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.loaded: Dict[str, Dict[str, Any]] = {}
+        self.updated_at: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class ModelDiscovery:
+    """
+    Polls every Ollama node's /api/tags and /api/ps concurrently and merges the results
+    into a model -> replicas index held in memory. Readers never wait on a backend: they
+    get the current index, and a stale index (older than `ttl`) triggers a background
+    refresh (stale-while-revalidate). A node's data is dropped once older than `max_stale`.
+    """
+    def __init__(self, upstream_pool, hosts: Iterable[str], ttl: float = 30.0,
+                 max_stale: float = 300.0, timeout: float = 5.0):
+        self.upstream_pool = upstream_pool
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.timeout = timeout
+        self.inventories: Dict[str, HostInventory] = {host: HostInventory(host) for host in hosts}
+        self.index: Dict[str, Dict[str, Any]] = {}
+        self.refreshed_at = 0.0
+        self.refreshes = 0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[], None]] = []
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Registers a callback run after every index rebuild."""
+        self._listeners.append(callback)
+
+    async def start(self):
+        # The first poll runs in the background; until it lands, readers see an empty index
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Model discovery refresh failed: {e}")
+            await asyncio.sleep(self.ttl)
+
+    def ensure_fresh(self):
+        """Starts a background refresh if the index is older than the TTL. Never blocks."""
+        if time.monotonic() - self.refreshed_at < self.ttl:
+            return
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def refresh(self):
+        await asyncio.gather(*(self._poll(inv) for inv in list(self.inventories.values())))
+        self._rebuild()
+        self.refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    async def _poll(self, inventory: HostInventory):
+        client = self.upstream_pool.client(inventory.host)
+        tags, ps = await asyncio.gather(
+            client.get("/api/tags", timeout=self.timeout),
+            client.get("/api/ps", timeout=self.timeout),
+            return_exceptions=True,
+        )
+        try:
+            if isinstance(tags, BaseException):
+                raise tags
+            tags.raise_for_status()
+            inventory.models = {m["name"]: m for m in tags.json().get("models", []) if "name" in m}
+        except (httpx.HTTPError, OSError, ValueError) as e:
+            inventory.error = f"{type(e).__name__}: {e}"
+            return
+        # /api/ps is best effort: older Ollama versions do not have it
+        loaded = {}
+        if not isinstance(ps, BaseException) and ps.status_code == 200:
+            try:
+                loaded = {m["name"]: m for m in ps.json().get("models", []) if "name" in m}
+            except ValueError:
+                pass
+        inventory.loaded = loaded
+        inventory.updated_at = time.monotonic()
+        inventory.error = None
+
+    def _fresh(self, inventory: HostInventory) -> bool:
+        return inventory.updated_at is not None and time.monotonic() - inventory.updated_at <= self.max_stale
+
+    def _rebuild(self):
+        index: Dict[str, Dict[str, Any]] = {}
+        for host, inventory in sorted(self.inventories.items()):
+            if not self._fresh(inventory):
+                continue
+            for name, info in inventory.models.items():
+                entry = index.setdefault(name, {"hosts": [], "loaded_on": [], "info": info})
+                entry["hosts"].append(host)
+                if name in inventory.loaded:
+                    entry["loaded_on"].append(host)
+        # Rebind in one step so readers always see a complete index
+        self.index = index
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Model discovery listener failed: {e}")
+
+    def set_hosts(self, hosts: Iterable[str]):
+        """Tracks new backends and forgets removed ones (used on config reload)."""
+        hosts = set(hosts)
+        for host in hosts:
+            self.inventories.setdefault(host, HostInventory(host))
+        for host in list(self.inventories):
+            if host not in hosts:
+                del self.inventories[host]
+        self._rebuild()
+
+    def known_hosts(self) -> Set[str]:
+        """Hosts with a recent successful inventory."""
+        return {host for host, inv in self.inventories.items() if self._fresh(inv)}
+
+    def hosts_for(self, model: str) -> List[str]:
+        entry = self.index.get(model)
+        return list(entry["hosts"]) if entry else []
+
+    def missing_hosts(self, model: str, hosts: Iterable[str]) -> Set[str]:
+        """Hosts that reported a fresh inventory which does not contain the model."""
+        present = set(self.hosts_for(model))
+        known = self.known_hosts()
+        return {host for host in hosts if host in known and host not in present}
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "refreshes": self.refreshes,
+            "age_seconds": round(now - self.refreshed_at, 1) if self.refreshed_at else None,
+            "ttl": self.ttl,
+            "hosts": {
+                host: {
+                    "models": sorted(inv.models),
+                    "loaded": sorted(inv.loaded),
+                    "age_seconds": round(now - inv.updated_at, 1) if inv.updated_at is not None else None,
+                    "error": inv.error,
+                }
+                for host, inv in self.inventories.items()
+            },
+        }
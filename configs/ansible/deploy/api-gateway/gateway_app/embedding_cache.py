@@ -0,0 +1,190 @@
+# embedding_cache.py
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+from array import array
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger("citadel-gateway")
+
+# index file: header, then `slot_count` fixed-size slots (open addressing, linear probing)
+#   header: magic, version, slot_count, arena_floats, head (absolute float position of the next write)
+#   slot:   sha256 key digest, absolute float offset of the vector in the arena, dimension (0 = empty)
+# arena file: a ring of float32 values. Vectors are appended at `head`; anything more than
+#   `arena_floats` behind head has been overwritten, which is how old entries are evicted (FIFO).
+MAGIC = b"CEMB"
+VERSION = 1
+HEADER = struct.Struct("<4sIQQQ")
+HEAD_OFFSET = 24
+SLOT = struct.Struct("<32sQI4x")
+MAX_PROBE = 32
+
+
+def cache_key(model: str, text: str, extras: Optional[Dict[str, Any]] = None) -> bytes:
+    """sha256 over the model, the backend options that change the vector, and the text."""
+    digest = hashlib.sha256(model.encode())
+    digest.update(b"\0")
+    if extras:
+        digest.update(repr(sorted(extras.items())).encode())
+    digest.update(b"\0")
+    digest.update(text.encode())
+    return digest.digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache shared by all gateway workers.
+
+    Both files are memory-mapped, so every worker reads the same pages from the page
+    cache without copying them into its own heap, and the cache survives restarts.
+    Reads take no lock: a reader copies the slot and the vector, then re-checks that
+    neither the slot nor the arena region changed underneath it. Writers serialize on
+    an flock of the index file and publish a slot's digest last.
+    """
+    def __init__(self, path: str, max_bytes: int = 1024 * 1024 * 1024, max_entries: int = 262144):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.arena_floats = max(1024, max_bytes // 4)
+        # Keep the table at most half full so probe chains stay short
+        self.slot_count = 1 << max(10, (2 * max_entries - 1).bit_length())
+        self.mask = self.slot_count - 1
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        index_path = os.path.join(path, "index.bin")
+        arena_path = os.path.join(path, "vectors.f32")
+        index_size = HEADER.size + self.slot_count * SLOT.size
+        self._index_fd = os.open(index_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._arena_fd = os.open(arena_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            header = os.pread(self._index_fd, HEADER.size, 0)
+            expected = (MAGIC, VERSION, self.slot_count, self.arena_floats)
+            if len(header) < HEADER.size or HEADER.unpack(header)[:4] != expected \
+                    or os.fstat(self._index_fd).st_size != index_size:
+                # New cache, or the size settings changed: start over with empty files
+                logger.info(f"Initializing embedding cache at {path} ({self.arena_floats * 4} bytes, "
+                            f"{self.slot_count} slots)")
+                os.ftruncate(self._index_fd, 0)
+                os.ftruncate(self._index_fd, index_size)
+                os.ftruncate(self._arena_fd, 0)
+                os.ftruncate(self._arena_fd, self.arena_floats * 4)
+                os.pwrite(self._index_fd, HEADER.pack(MAGIC, VERSION, self.slot_count, self.arena_floats, 0), 0)
+        self._index = mmap.mmap(self._index_fd, index_size)
+        self._arena = mmap.mmap(self._arena_fd, self.arena_floats * 4)
+        self._floats = memoryview(self._arena).cast("f")
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._index_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._index_fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._floats.release()
+        self._arena.close()
+        self._index.close()
+        os.close(self._arena_fd)
+        os.close(self._index_fd)
+
+    def _head(self) -> int:
+        return struct.unpack_from("<Q", self._index, HEAD_OFFSET)[0]
+
+    def _slot_position(self, slot: int) -> int:
+        return HEADER.size + slot * SLOT.size
+
+    def _valid(self, offset: int, head: int) -> bool:
+        return offset + self.arena_floats >= head
+
+    def _lookup(self, digest: bytes) -> Optional[List[float]]:
+        start = int.from_bytes(digest[:8], "little")
+        for probe in range(MAX_PROBE):
+            position = self._slot_position((start + probe) & self.mask)
+            raw = self._index[position:position + SLOT.size]
+            key, offset, dim = SLOT.unpack(raw)
+            if dim == 0:
+                return None
+            if key != digest:
+                continue
+            if not self._valid(offset, self._head()):
+                return None
+            ring = offset % self.arena_floats
+            vector = self._floats[ring:ring + dim].tolist()
+            # Discard the copy if a writer evicted or replaced the entry while we read it
+            if self._index[position:position + SLOT.size] != raw or not self._valid(offset, self._head()):
+                return None
+            return vector
+        return None
+
+    def get_many(self, keys: Sequence[bytes]) -> List[Optional[List[float]]]:
+        """Looks up many keys at once; missing entries come back as None."""
+        found = [self._lookup(key) for key in keys]
+        hits = sum(1 for vector in found if vector is not None)
+        self.hits += hits
+        self.misses += len(found) - hits
+        return found
+
+    def put_many(self, items: Sequence[Tuple[bytes, Sequence[float]]]):
+        """Stores vectors under one lock acquisition."""
+        with self._locked():
+            for digest, vector in items:
+                self._put(digest, vector)
+
+    def _put(self, digest: bytes, vector: Sequence[float]):
+        dim = len(vector)
+        if dim == 0 or dim > self.arena_floats:
+            return
+        head = self._head()
+        if head % self.arena_floats + dim > self.arena_floats:
+            # Vectors are stored contiguously; skip the ring's tail end
+            head += self.arena_floats - head % self.arena_floats
+        offset = head
+        # Advance head before overwriting so readers see the old entries as evicted first
+        struct.pack_into("<Q", self._index, HEAD_OFFSET, head + dim)
+        ring = offset % self.arena_floats
+        self._floats[ring:ring + dim] = array("f", vector)
+
+        start = int.from_bytes(digest[:8], "little")
+        target = None
+        oldest = None
+        for probe in range(MAX_PROBE):
+            slot = (start + probe) & self.mask
+            key, slot_offset, slot_dim = SLOT.unpack_from(self._index, self._slot_position(slot))
+            if slot_dim == 0 or key == digest or not self._valid(slot_offset, head + dim):
+                target = slot
+                break
+            if oldest is None or slot_offset < oldest[1]:
+                oldest = (slot, slot_offset)
+        if target is None:
+            # Probe window full of live entries: drop the oldest of them
+            target = oldest[0]
+            self.evictions += 1
+        position = self._slot_position(target)
+        # Clear the digest first, so no reader can pair the old key with the new vector
+        self._index[position:position + 32] = bytes(32)
+        struct.pack_into("<QI", self._index, position + 32, offset, dim)
+        self._index[position:position + 32] = digest
+        self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        head = self._head()
+        return {
+            "path": self.path,
+            "max_bytes": self.arena_floats * 4,
+            "slots": self.slot_count,
+            "written_bytes": head * 4,
+            "wrapped": head > self.arena_floats,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "index_evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
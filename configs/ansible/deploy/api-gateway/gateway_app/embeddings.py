@@ -0,0 +1,122 @@
+# embeddings.py
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("citadel-gateway")
+
+# send(model, texts, extras) -> (vectors in input order, prompt tokens for the whole batch)
+SendBatch = Callable[[str, List[str], Dict[str, Any]], Awaitable[Tuple[List[List[float]], int]]]
+
+
+class _PendingBatch:
+    __slots__ = ("model", "extras", "texts", "waiters", "timer")
+
+    def __init__(self, model: str, extras: Dict[str, Any]):
+        self.model = model
+        self.extras = extras
+        self.texts: List[str] = []
+        # (offset, count, future) per caller, so vectors can be scattered back
+        self.waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Gathers concurrent embedding requests for the same model into one backend call.
+    A batch is sent when it reaches `max_batch_size` texts or `window` seconds after
+    its first request arrived, whichever comes first; each caller then gets back
+    exactly the vectors for its own inputs. Requests larger than `max_batch_size` are
+    split across batches.
+    """
+    def __init__(self, send: SendBatch, window: float = 0.005, max_batch_size: int = 64):
+        self.send = send
+        self.window = window
+        self.max_batch_size = max(1, max_batch_size)
+        self._pending: Dict[Tuple[str, Tuple], _PendingBatch] = {}
+        self._tasks = set()
+        self.requests = 0
+        self.texts = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.largest_batch = 0
+
+    async def embed(self, model: str, texts: List[str],
+                    extras: Optional[Dict[str, Any]] = None) -> Tuple[List[List[float]], int]:
+        """Returns (one vector per text, approximate prompt tokens for these texts)."""
+        extras = extras or {}
+        self.requests += 1
+        self.texts += len(texts)
+        if not texts:
+            return [], 0
+        futures = [
+            self._enqueue(model, texts[i:i + self.max_batch_size], extras)
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        vectors: List[List[float]] = []
+        tokens = 0
+        for part_vectors, part_tokens in await asyncio.gather(*futures):
+            vectors.extend(part_vectors)
+            tokens += part_tokens
+        return vectors, tokens
+
+    def _enqueue(self, model: str, texts: List[str], extras: Dict[str, Any]) -> asyncio.Future:
+        # Only requests with identical backend parameters can share a call
+        key = (model, tuple(sorted((k, repr(v)) for k, v in extras.items())))
+        batch = self._pending.get(key)
+        if batch is not None and len(batch.texts) + len(texts) > self.max_batch_size:
+            self._flush(key)
+            batch = None
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch(model, extras)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        future = asyncio.get_running_loop().create_future()
+        batch.waiters.append((len(batch.texts), len(texts), future))
+        batch.texts.extend(texts)
+        if len(batch.texts) >= self.max_batch_size:
+            self._flush(key)
+        return future
+
+    def _flush(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: _PendingBatch):
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch.texts))
+        try:
+            vectors, tokens = await self.send(batch.model, batch.texts, batch.extras)
+            if len(vectors) != len(batch.texts):
+                raise ValueError(f"backend returned {len(vectors)} vectors for {len(batch.texts)} inputs")
+        except Exception as e:
+            self.failed_batches += 1
+            logger.error(f"Embedding batch of {len(batch.texts)} for '{batch.model}' failed: {e}")
+            for _, _, future in batch.waiters:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        total_chars = sum(len(t) for t in batch.texts) or 1
+        for offset, count, future in batch.waiters:
+            if future.done():
+                continue
+            # The backend reports tokens per call; attribute them by share of input characters
+            chars = sum(len(t) for t in batch.texts[offset:offset + count])
+            future.set_result((vectors[offset:offset + count], round(tokens * chars / total_chars)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "texts": self.texts,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else None,
+            "largest_batch": self.largest_batch,
+            "window": self.window,
+            "max_batch_size": self.max_batch_size,
+        }
@@ -0,0 +1,192 @@
+# health.py
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+import httpx
+
+logger = logging.getLogger("citadel-gateway")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Per-backend breaker. Opens after `failure_threshold` consecutive failures, stays
+    open for `recovery_timeout` seconds, then lets one trial request through (half-open)
+    while the rest stay rejected. The trial's success closes it again, its failure
+    re-opens it; a trial that reports neither within `recovery_timeout` (its client went
+    away) makes room for another.
+    """
+    def __init__(self, host: str, failure_threshold: int = 3, recovery_timeout: float = 30.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+        return self._state
+
+    def trial_in_flight(self) -> bool:
+        return self.trial_started_at is not None and \
+            time.monotonic() - self.trial_started_at < self.recovery_timeout
+
+    def available(self) -> bool:
+        """True when requests may be routed to the backend (closed, or half-open with no trial running)."""
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and not self.trial_in_flight())
+
+    def record_attempt(self):
+        """Called when a request is sent to the backend; in half-open it becomes the trial."""
+        if self.state == HALF_OPEN and not self.trial_in_flight():
+            self.trial_started_at = time.monotonic()
+
+    def record_success(self):
+        if self._state != CLOSED:
+            logger.info(f"Circuit for {self.host} closed after a successful request/probe.")
+        self._state = CLOSED
+        self.consecutive_failures = 0
+        self.trial_started_at = None
+        self.last_error = None
+
+    def record_failure(self, error: str = ""):
+        self.consecutive_failures += 1
+        self.last_error = error or self.last_error
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self._state != OPEN:
+                logger.warning(f"Circuit for {self.host} opened after {self.consecutive_failures} consecutive failures: {error}")
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+            self.trial_started_at = None
+
+
+class HealthProber:
+    """
+    Background task that probes every backend's /api/tags on a fixed interval and
+    feeds the results into that backend's circuit breaker. Live request outcomes are
+    reported through `record_success` / `record_failure`.
+    """
+    def __init__(self, upstream_pool, hosts: Iterable[str], interval: float = 15.0,
+                 timeout: float = 5.0, failure_threshold: int = 3, recovery_timeout: float = 30.0):
+        self.upstream_pool = upstream_pool
+        self.interval = interval
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.breakers: Dict[str, CircuitBreaker] = {
+            host: CircuitBreaker(host, failure_threshold, recovery_timeout) for host in hosts
+        }
+        self.last_probe: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Health prober started for {len(self.breakers)} backends (every {self.interval}s).")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Health probe round failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.probe(host) for host in self.breakers))
+
+    async def probe(self, host: str):
+        started = time.monotonic()
+        try:
+            response = await self.upstream_pool.client(host).get("/api/tags", timeout=self.timeout)
+            response.raise_for_status()
+        except (httpx.HTTPError, OSError) as e:
+            error = f"{type(e).__name__}: {e}"
+            result = {"ok": False, "at": time.time(), "error": error}
+        else:
+            error = None
+            result = {"ok": True, "at": time.time(), "latency_ms": round((time.monotonic() - started) * 1000, 1)}
+        # A config reload may have removed the host while the probe was out
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            return
+        if error is None:
+            breaker.record_success()
+        else:
+            breaker.record_failure(f"probe failed ({error})")
+        self.last_probe[host] = result
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(host, self.failure_threshold, self.recovery_timeout)
+        return breaker
+
+    def set_hosts(self, hosts: Iterable[str]):
+        """Adds breakers for new backends and drops removed ones (used on config reload)."""
+        hosts = set(hosts)
+        for host in hosts:
+            self._breaker(host)
+        for host in list(self.breakers):
+            if host not in hosts:
+                del self.breakers[host]
+                self.last_probe.pop(host, None)
+
+    def record_attempt(self, host: str):
+        breaker = self.breakers.get(host)
+        if breaker is not None:
+            breaker.record_attempt()
+
+    def record_success(self, host: str):
+        breaker = self.breakers.get(host)
+        if breaker is not None:
+            breaker.record_success()
+
+    def record_failure(self, host: str, error: str = ""):
+        # Hosts removed by a config reload may still finish requests; ignore those
+        breaker = self.breakers.get(host)
+        if breaker is not None:
+            breaker.record_failure(error)
+
+    def unavailable_hosts(self) -> Set[str]:
+        """Hosts whose breaker is open, or half-open with its trial running; routing skips these."""
+        return {host for host, breaker in self.breakers.items() if not breaker.available()}
+
+    def status(self) -> Dict[str, Any]:
+        """Per-backend breaker state and last probe result, for /health."""
+        backends = {}
+        for host, breaker in self.breakers.items():
+            backends[host] = {
+                "state": breaker.state,
+                "consecutive_failures": breaker.consecutive_failures,
+                "trial_in_flight": breaker.trial_in_flight(),
+                "last_error": breaker.last_error,
+                "last_probe": self.last_probe.get(host),
+            }
+        open_count = sum(1 for b in backends.values() if b["state"] == OPEN)
+        if not backends or open_count == 0:
+            status = "healthy"
+        elif open_count < len(backends):
+            status = "degraded"
+        else:
+            status = "unhealthy"
+        return {"status": status, "backends": backends}
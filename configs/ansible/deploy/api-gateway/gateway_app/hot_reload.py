@@ -0,0 +1,93 @@
+# hot_reload.py
+import asyncio
+import logging
+import os
+import signal
+from typing import Callable, Optional
+
+from config import GatewayConfig
+
+logger = logging.getLogger("citadel-gateway")
+
+
+class ConfigWatcher:
+    """
+    Reloads config.yaml without restarting workers. Every worker polls the file's
+    mtime and also reloads on SIGHUP. A new config is only applied if it passes
+    validation; otherwise the current routing table stays in place.
+
+    `apply` receives the validated GatewayConfig and is expected to swap the
+    routing state in a single assignment, so requests already in flight keep
+    using the table they started with.
+    """
+    def __init__(self, config_path: str, apply: Callable[[GatewayConfig], None],
+                 watch_interval: float = 2.0):
+        self.config_path = config_path
+        self.apply = apply
+        self.watch_interval = watch_interval
+        self.reloads = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self._mtime = self._current_mtime()
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def _current_mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.reload("SIGHUP")))
+        except (NotImplementedError, RuntimeError, ValueError):
+            logger.warning("SIGHUP reload is not available in this process; relying on file watch.")
+        if self.watch_interval > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            mtime = self._current_mtime()
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                await self.reload("file change")
+
+    async def reload(self, reason: str = "manual") -> bool:
+        """Loads, validates and applies the config file. Returns True if applied."""
+        async with self._lock:
+            logger.info(f"Reloading {self.config_path} ({reason})")
+            new_config = GatewayConfig(self.config_path)
+            errors = new_config.validate()
+            if errors:
+                for error in errors:
+                    logger.error(f"Configuration validation error: {error}")
+                self.rejected += 1
+                self.last_error = f"{len(errors)} invalid entries found"
+                logger.error(f"Reload rejected, keeping the current routing table: {self.last_error}")
+                return False
+            try:
+                self.apply(new_config)
+            except Exception as e:
+                self.rejected += 1
+                self.last_error = str(e)
+                logger.error(f"Reload failed while applying the new config, keeping the current one: {e}")
+                return False
+            self.reloads += 1
+            self.last_error = None
+            logger.info(f"Reload applied: {len(new_config.get_model_mapping())} model mappings active")
+            return True
+
+    def stats(self):
+        return {"reloads": self.reloads, "rejected": self.rejected, "last_error": self.last_error}
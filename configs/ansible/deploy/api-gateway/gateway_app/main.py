@@ -2,27 +2,438 @@
 import os
 import logging
 import asyncio
+import base64
+import time
 import httpx
 import json
-from fastapi import FastAPI, HTTPException
+from array import array
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional, Union
 
 from config import GatewayConfig
+from upstream import UpstreamPool
+from routing import ReplicaRouter, conversation_key
+from health import HealthProber
+from hot_reload import ConfigWatcher
+from cache import ResponseCache, is_cacheable, request_cache_key
+from singleflight import SingleFlight
+from discovery import ModelDiscovery
+from metrics import GatewayMetrics, parse_final_stats
+from admission import AdmissionController, AdmissionRejected
+from transcode import SSEToNDJSON, UsageChunkFilter, openai_to_ollama_response, transcode_body, transcode_stream
+from embeddings import EmbeddingBatcher
+from embedding_cache import EmbeddingCache, cache_key
+from shared_state import SharedState
+from passthrough import RawChatRequest, parse_ollama_chat, parse_openai_chat
+from residency import ModelResidency
+from access_log import AccessLog, AccessLogMiddleware, LogWriter, RequestTiming
+from usage import UsageSink
 
 # === Initialize Configuration ===
-config = GatewayConfig()
+CONFIG_PATH = "config.yaml"
+config = GatewayConfig(CONFIG_PATH)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 MODEL_MAP = config.get_model_mapping()  # Simplified interface
 
-# === Logging ===
-logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s [%(levelname)s] %(message)s")
+# === Logging (queued and written by a background thread, never on the event loop) ===
+logging_settings = config.get_logging_settings()
+access_log_settings = logging_settings.get("access_log", {}) or {}
+log_writer = LogWriter(
+    LOG_LEVEL,
+    "%(asctime)s [%(levelname)s] %(message)s",
+    access_path=access_log_settings.get("path") if access_log_settings.get("enabled", False) else None,
+    max_queue=int(logging_settings.get("max_queue", 10000)),
+)
 logger = logging.getLogger("citadel-gateway")
+access_log = None
+if access_log_settings.get("enabled", False):
+    access_log = AccessLog(
+        sample_rate=float(access_log_settings.get("sample_rate", 1.0)),
+        slow_threshold=float(access_log_settings.get("slow_threshold", 10.0)),
+        max_per_second=float(access_log_settings.get("max_per_second", 0)),
+        exclude_paths=access_log_settings.get("exclude_paths", []) or [],
+    )
+SERVER_TIMING = bool(logging_settings.get("server_timing", True))
+
+for error in config.validate():
+    logger.error(f"Configuration validation error: {error}")
+
+# === Cross-Worker Shared State (routing load, admission slots and metrics for the whole host) ===
+shared_state_settings = config.get_shared_state_settings()
+shared_state = None
+if shared_state_settings.get("enabled", False):
+    # The segment is mapped at startup (lifespan); until then every value is per worker
+    shared_state = SharedState(
+        shared_state_settings.get("path", "/dev/shm/citadel-gateway/state.bin"),
+        max_workers=int(shared_state_settings.get("max_workers", 16)),
+        max_keys=int(shared_state_settings.get("max_keys", 16384)),
+        reap_interval=float(shared_state_settings.get("reap_interval", 10.0)),
+    )
+
+# === Replica Routing ===
+def affinity_load_factor(settings: Dict[str, Any]) -> float:
+    affinity = settings.get("affinity", {}) or {}
+    return float(affinity.get("load_factor", 1.25)) if affinity.get("enabled", False) else 0.0
+
+routing_settings = config.get_routing_settings()
+router = ReplicaRouter(
+    config.get_model_replicas(),
+    strategy=routing_settings.get("strategy", "least_outstanding"),
+    ewma_alpha=float(routing_settings.get("ewma_alpha", 0.3)),
+    shared=shared_state,
+    affinity_load_factor=affinity_load_factor(routing_settings),
+)
+AFFINITY_SESSION_HEADER = (routing_settings.get("affinity", {}) or {}).get("session_header", "X-Session-ID")
+
+# === Upstream Connection Pools ===
+upstream_pool = UpstreamPool(config.get_upstream_settings())
+
+# === Backend Health Probing & Circuit Breakers ===
+health_settings = config.get_health_check_settings()
+prober = HealthProber(
+    upstream_pool,
+    config.get_backend_hosts(),
+    interval=float(health_settings.get("interval", 15.0)),
+    timeout=float(health_settings.get("timeout", 5.0)),
+    failure_threshold=int(health_settings.get("failure_threshold", 3)),
+    recovery_timeout=float(health_settings.get("recovery_timeout", 30.0)),
+)
+
+# === Response Cache (opt-in, deterministic non-streaming requests only) ===
+cache_settings = config.get_response_cache_settings()
+response_cache = None
+if cache_settings.get("enabled", False):
+    response_cache = ResponseCache(
+        max_bytes=int(cache_settings.get("max_bytes", 64 * 1024 * 1024)),
+        default_ttl=float(cache_settings.get("default_ttl", 300.0)),
+        model_ttl=cache_settings.get("model_ttl", {}) or {},
+        max_entry_bytes=int(cache_settings.get("max_entry_bytes", 1024 * 1024)),
+    )
+    logger.info(f"Response cache enabled ({response_cache.max_bytes} bytes max).")
+
+# === Single-Flight Coalescing of Identical In-Flight Requests ===
+coalescing_settings = config.get_coalescing_settings()
+singleflight = None
+if coalescing_settings.get("enabled", False):
+    singleflight = SingleFlight(
+        window=float(coalescing_settings.get("window", 30.0)),
+        models=coalescing_settings.get("models") or None,
+    )
+COALESCE_DETERMINISTIC_ONLY = bool(coalescing_settings.get("deterministic_only", False))
+
+# === Prometheus Metrics (host-wide with shared state, otherwise per worker labelled with the pid) ===
+metrics = GatewayMetrics(shared=shared_state)
+log_writer.on_drop = lambda reason: metrics.log_dropped.inc((reason,))
+if access_log is not None:
+    access_log.on_drop = log_writer.on_drop
+
+def upstream_error_type(error: Exception) -> str:
+    """Short label for the errors counter."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"http_{error.response.status_code}"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.ConnectError):
+        return "connect"
+    return type(error).__name__
+
+# === Admission Control (per-model / per-backend limits with a bounded wait queue) ===
+def admission_limits(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """AdmissionController limits from the config; raises on a bad value, before anything is changed."""
+    return dict(
+        model_limits={model: int(limit) for model, limit in (settings.get("model_limits", {}) or {}).items()},
+        default_model_limit=int(settings.get("default_model_limit", 0)),
+        backend_limits={host: int(limit) for host, limit in (settings.get("backend_limits", {}) or {}).items()},
+        default_backend_limit=int(settings.get("default_backend_limit", 0)),
+        max_queue=int(settings.get("max_queue", 32)),
+        queue_timeout=float(settings.get("queue_timeout", 60.0)),
+    )
+
+admission_settings = config.get_admission_settings()
+admission = None
+if admission_settings.get("enabled", False):
+    admission = AdmissionController(
+        **admission_limits(admission_settings),
+        shared=shared_state,
+        poll_interval=float(shared_state_settings.get("poll_interval", 0.05)),
+    )
+    metrics.queue_depth.source = lambda: {(model,): depth for model, depth in admission.queue_depths().items()}
+PRIORITY_HEADER = admission_settings.get("priority_header", "X-Priority")
+
+# === Chat Request Passthrough (forward the client's bytes instead of validating and re-serializing) ===
+passthrough_settings = config.get_passthrough_settings()
+CHAT_PASSTHROUGH = bool(passthrough_settings.get("enabled", True))
+
+# === Embedding Micro-Batching ===
+embeddings_settings = config.get_embeddings_settings()
+EMBEDDING_TIMEOUT = float(embeddings_settings.get("timeout", 60.0))
+
+async def embed_upstream(model_id: str, texts: List[str], extras: Dict[str, Any]):
+    """Sends one batch to a replica's native /api/embed; returns (vectors, prompt tokens)."""
+    active_router = router
+    replica = routed(active_router.select(model_id, exclude=routing_exclusions(model_id, active_router)))
+    if replica is None:
+        raise RuntimeError(f"No healthy backend available for {model_id}")
+    backend_host = replica.host
+    active_router.acquire(replica)
+    started = time.monotonic()
+    try:
+        response = await upstream_pool.request(
+            backend_host, "POST", "/api/embed", json={"model": model_id, "input": texts, **extras},
+            timeout=EMBEDDING_TIMEOUT,
+        )
+        response.raise_for_status()
+        prober.record_success(backend_host)
+        active_router.observe_latency(replica, time.monotonic() - started)
+        if residency is not None:
+            residency.touch(model_id, backend_host)
+        data = response.json()
+        return data.get("embeddings", []), int(data.get("prompt_eval_count", 0))
+    except httpx.HTTPStatusError as e:
+        metrics.errors.inc((backend_host, upstream_error_type(e)))
+        if e.response.status_code >= 500:
+            prober.record_failure(backend_host, f"HTTP {e.response.status_code}")
+        raise
+    except httpx.RequestError as e:
+        metrics.errors.inc((backend_host, upstream_error_type(e)))
+        prober.record_failure(backend_host, f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        active_router.release(replica)
+
+embedding_batcher = None
+if embeddings_settings.get("enabled", True):
+    embedding_batcher = EmbeddingBatcher(
+        embed_upstream,
+        window=float(embeddings_settings.get("batch_window", 0.005)),
+        max_batch_size=int(embeddings_settings.get("max_batch_size", 64)),
+    )
+
+# === Persistent Embedding Cache ===
+embedding_cache_settings = config.get_embedding_cache_settings()
+# Opened at startup (lifespan), so importing this module creates no files
+embedding_cache = None
+
+def open_embedding_cache() -> Optional[EmbeddingCache]:
+    if not embedding_cache_settings.get("enabled", False):
+        return None
+    path = embedding_cache_settings.get("path", "/opt/citadel-gateway/cache/embeddings")
+    try:
+        return EmbeddingCache(
+            path,
+            max_bytes=int(embedding_cache_settings.get("max_bytes", 1024 * 1024 * 1024)),
+            max_entries=int(embedding_cache_settings.get("max_entries", 262144)),
+        )
+    except OSError as e:
+        logger.error(f"Embedding cache disabled, could not open {path}: {e}")
+        return None
+
+# === Live Model Discovery ===
+discovery_settings = config.get_discovery_settings()
+discovery = None
+if discovery_settings.get("enabled", True):
+    discovery = ModelDiscovery(
+        upstream_pool,
+        config.get_backend_hosts(),
+        ttl=float(discovery_settings.get("ttl", 30.0)),
+        max_stale=float(discovery_settings.get("max_stale", 300.0)),
+        timeout=float(discovery_settings.get("timeout", 5.0)),
+    )
+DISCOVERY_ROUTE_UNMAPPED = bool(discovery_settings.get("route_unmapped", True))
+
+# Pre-serialized bodies for /v1/models and /api/tags, rebuilt whenever discovery or config changes
+MODEL_LISTINGS = {"openai": b'{"data":[]}', "ollama": b'{"models":[]}'}
+
+def rebuild_model_listings():
+    """
+    Recomputes the model listings from the discovery index and the routing table.
+    A mapped model is listed when a node reports it, or when none of its nodes has
+    reported yet. With route_unmapped, models found on the nodes become routable too.
+    """
+    global MODEL_LISTINGS
+    active_router = router
+    if discovery is None:
+        listed = {model: {} for model in active_router.models()}
+    else:
+        index = discovery.index
+        if DISCOVERY_ROUTE_UNMAPPED:
+            active_router.set_discovered({model: entry["hosts"] for model, entry in index.items()})
+        known = discovery.known_hosts()
+        listed = {}
+        for model in active_router.models():
+            if model in index:
+                listed[model] = index[model]["info"]
+            elif not any(r.host in known for r in active_router.replicas[model]):
+                listed[model] = {}
+
+    if not listed:
+        logger.warning("No models are available from the model map or live discovery.")
+    openai_models = [{"id": model, "object": "model"} for model in listed]
+    ollama_models = [{**info, "name": model, "model": model} for model, info in listed.items()]
+    MODEL_LISTINGS = {
+        "openai": json.dumps({"data": openai_models}).encode(),
+        "ollama": json.dumps({"models": ollama_models}).encode(),
+    }
+    logger.info(f"Model listings rebuilt: {len(listed)} models available.")
+
+def routed(replica):
+    """Marks a replica as picked for a request (the breaker's trial when half-open); returns it."""
+    if replica is not None:
+        prober.record_attempt(replica.host)
+    return replica
+
+def routing_exclusions(model_id: str, active_router: ReplicaRouter) -> set:
+    """Hosts to skip for a model: open circuits, plus nodes that report not having it."""
+    excluded = prober.unavailable_hosts()
+    if discovery is not None:
+        replica_hosts = [r.host for r in active_router.replicas.get(model_id, ())]
+        missing = discovery.missing_hosts(model_id, replica_hosts)
+        # If discovery says no replica has the model, trust the map rather than reject
+        if missing and len(missing) < len(replica_hosts):
+            excluded = excluded | missing
+    return excluded
+
+if discovery is not None:
+    discovery.add_listener(rebuild_model_listings)
+rebuild_model_listings()
+
+# === Model Residency (prefer nodes with the model loaded, preload hot models on idle nodes) ===
+residency_settings = config.get_residency_settings()
+residency = None
+if residency_settings.get("enabled", False):
+    preload_settings = residency_settings.get("preload", {}) or {}
+
+    def record_load(model_id: str, host: str, result: str, seconds: float):
+        metrics.preloads.inc((model_id, host, result))
+        if result == "loaded":
+            metrics.load_seconds.observe((model_id, host, "preload"), seconds)
+
+    residency = ModelResidency(
+        upstream_pool,
+        lambda: router,
+        routing_exclusions,
+        discovery=discovery,
+        shared=shared_state,
+        cold_penalty=float(residency_settings.get("cold_penalty", 4.0)),
+        server_keep_alive=residency_settings.get("server_keep_alive", "5m"),
+        max_loaded=int(residency_settings.get("max_loaded", 0)),
+        min_residency=float(residency_settings.get("min_residency", 300.0)),
+        preload=bool(preload_settings.get("enabled", False)),
+        keep_alive=preload_settings.get("keep_alive", "30m"),
+        min_rate=float(preload_settings.get("min_rate", 1.0)),
+        interval=float(preload_settings.get("interval", 15.0)),
+        rate_window=float(preload_settings.get("rate_window", 300.0)),
+        refresh_before=float(preload_settings.get("refresh_before", 60.0)),
+        cooldown=float(preload_settings.get("cooldown", 60.0)),
+        timeout=float(preload_settings.get("timeout", 300.0)),
+        on_load=record_load,
+        on_evict=lambda model_id, host: metrics.evictions.inc((model_id, host)),
+    )
+    # The router is rebuilt on hot reload and carries this over
+    router.residency = residency
+    if discovery is not None:
+        discovery.add_listener(residency.sync)
+
+# === Usage Accounting (per-request token counts batched into PostgreSQL, off the request path) ===
+usage_settings = config.get_usage_settings()
+usage_sink = None
+if usage_settings.get("enabled", False):
+    usage_sink = UsageSink(
+        usage_settings.get("dsn", "postgresql://citadel_llm_user@192.168.10.35:5432/citadel_llm_db"),
+        # Kept out of config.yaml; the role writes it to the service environment from the vault
+        password=os.getenv(usage_settings.get("password_env", "POSTGRES_PASSWORD")) or None,
+        table=usage_settings.get("table", "gateway_usage"),
+        max_queue=int(usage_settings.get("max_queue", 10000)),
+        batch_size=int(usage_settings.get("batch_size", 500)),
+        flush_interval=float(usage_settings.get("flush_interval", 1.0)),
+        pool_size=int(usage_settings.get("pool_size", 2)),
+        write_timeout=float(usage_settings.get("write_timeout", 5.0)),
+        connect_timeout=float(usage_settings.get("connect_timeout", 5.0)),
+        retry_interval=float(usage_settings.get("retry_interval", 10.0)),
+        create_table=bool(usage_settings.get("create_table", False)),
+        on_result=lambda result, count: metrics.usage_records.inc((result,), count),
+    )
+# Attributes usage to a client; falls back to the caller's address
+USAGE_CLIENT_HEADER = usage_settings.get("client_header", "X-Client-ID")
+
+# === Hot Reload ===
+def apply_config(new_config: GatewayConfig):
+    """
+    Swaps in the routing table from a validated config. Everything that can fail (the
+    router, the model map, the admission limits) is built first; then the live state is
+    changed in one step with no await in between, so each request sees either the old
+    table or the new one, and a bad value leaves the current config fully in place.
+    Requests already streaming keep the router they started with. Upstream pool and
+    health check settings only take effect on restart.
+    """
+    global config, MODEL_MAP, router
+    new_routing = new_config.get_routing_settings()
+    new_router = ReplicaRouter(
+        new_config.get_model_replicas(),
+        strategy=new_routing.get("strategy", "least_outstanding"),
+        ewma_alpha=float(new_routing.get("ewma_alpha", 0.3)),
+        previous=router,
+        affinity_load_factor=affinity_load_factor(new_routing),
+    )
+    new_model_map = new_config.get_model_mapping()
+    new_hosts = new_config.get_backend_hosts()
+    new_limits = admission_limits(new_config.get_admission_settings()) if admission is not None else None
+
+    config, MODEL_MAP, router = new_config, new_model_map, new_router
+    prober.set_hosts(new_hosts)
+    if new_limits is not None:
+        admission.configure(**new_limits)
+    if discovery is not None:
+        discovery.set_hosts(new_hosts)
+    else:
+        rebuild_model_listings()
+
+reload_settings = config.get_reload_settings()
+config_watcher = ConfigWatcher(
+    CONFIG_PATH,
+    apply_config,
+    watch_interval=float(reload_settings.get("watch_interval", 2.0)),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global embedding_cache
+    if shared_state is not None:
+        await shared_state.start()
+    embedding_cache = open_embedding_cache()
+    await upstream_pool.start(config.get_backend_hosts())
+    await prober.start()
+    if discovery is not None:
+        await discovery.start()
+    if residency is not None:
+        await residency.start()
+    if usage_sink is not None:
+        await usage_sink.start()
+    await config_watcher.start()
+    yield
+    await config_watcher.stop()
+    if usage_sink is not None:
+        await usage_sink.stop()
+    if residency is not None:
+        await residency.stop()
+    if discovery is not None:
+        await discovery.stop()
+    await prober.stop()
+    await upstream_pool.close()
+    if embedding_cache is not None:
+        embedding_cache.close()
+        embedding_cache = None
+    if shared_state is not None:
+        await shared_state.stop()
+    log_writer.stop()
 
 # === FastAPI App ===
-app = FastAPI(title="Citadel AI Unified Gateway")
+app = FastAPI(title="Citadel AI Unified Gateway", lifespan=lifespan)
 
 # === CORS Middleware ===
 app.add_middleware(
@@ -33,6 +444,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# === Access Log & Server-Timing (outermost, so it times everything else) ===
+app.add_middleware(AccessLogMiddleware, access_log=access_log, server_timing=SERVER_TIMING)
+
 # === Pydantic Models ===
 class ChatCompletionRequest(BaseModel):
     model: str
@@ -40,6 +454,7 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = False
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
+    stream_options: Optional[Dict[str, Any]] = None
 
 class ModelInfo(BaseModel):
     id: str
@@ -51,69 +466,489 @@ class ModelList(BaseModel):
 class OllamaNativeChatRequest(BaseModel):
     model: str
     messages: List[Dict[str, Any]]
-    stream: Optional[bool] = False
+    stream: Optional[bool] = True  # Ollama streams unless the client asks otherwise
+    options: Optional[Dict[str, Any]] = None
+
+class EmbeddingsRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    encoding_format: Optional[str] = "float"
+    dimensions: Optional[int] = None
+
+class OllamaEmbedRequest(BaseModel):
+    model: str
+    input: Union[str, List[str]]
+    truncate: Optional[bool] = None
+    options: Optional[Dict[str, Any]] = None
+    keep_alive: Optional[Union[str, int]] = None
 
 # === Streaming Proxy ===
-async def stream_proxied_response(backend_url: str, payload: ChatCompletionRequest):
-    async with httpx.AsyncClient(timeout=300.0) as client:
+async def stream_proxied_response(payload: Union[ChatCompletionRequest, RawChatRequest], cache_key: Optional[str] = None,
+                                  ticket=None, active_router: Optional[ReplicaRouter] = None,
+                                  affinity_key: Optional[str] = None, timing: Optional[RequestTiming] = None,
+                                  api: str = "openai", client: Optional[str] = None):
+    backend_path = "/v1/chat/completions"
+    if isinstance(payload, RawChatRequest):
+        body = payload.body
+    else:
+        body = json.dumps(payload.dict(exclude_none=True)).encode()
+    if ticket is not None:
+        # Admission control already picked the replica and reserved its slots
+        replica = ticket.choice
+    else:
+        # Pin the routing table for this request so a hot reload cannot swap it mid-stream
+        active_router = router
+        # Select and claim the replica before the first await so concurrent requests see the load
+        replica = routed(active_router.select(payload.model, exclude=routing_exclusions(payload.model, active_router),
+                                              affinity_key=affinity_key))
+        if replica is None:
+            yield f'data: {{"error": "No healthy backend available for {payload.model}"}}\n\n'.encode()
+            return
+        if timing is not None:
+            timing.mark("route")
+    backend_host = replica.host
+    active_router.acquire(replica)
+    logger.debug(f"Routing '{payload.model}' to replica '{backend_host}' ({active_router.strategy})")
+    labels = (payload.model, backend_host)
+    # Affinity outcomes count for keyed requests to models with a choice of replicas
+    track_affinity = active_router.affinity_host(payload.model, affinity_key) is not None
+    # Decided before the request is sent: once it is, the node starts loading the model
+    cold = residency is not None and residency.is_cold(payload.model, backend_host)
+    if timing is not None:
+        timing.fields["backend"] = backend_host
+        if cold:
+            timing.fields["cold_start"] = True
+    metrics.requests.inc(labels)
+    metrics.in_flight.inc(labels)
+    started = time.monotonic()
+    first_byte_at = None
+    final_stats = None
+    outcome = "error"
+    # The last two chunks are enough to find the final stats chunk / usage block
+    tail = [b"", b""]
+    # Only buffer the body when it is going to be stored in the response cache
+    body_parts = [] if cache_key else None
+    if ticket is not None:
+        # From here on the finally below releases it; until then the response does (release_unclaimed)
+        ticket.claimed = True
+    try:
+        async with upstream_pool.stream(
+            backend_host,
+            "POST",
+            backend_path,
+            content=body,
+            headers={"Content-Type": "application/json"},
+            # Pool wait and TCP connect end once the request headers start going out
+            on_connected=(lambda: timing.mark("connect")) if timing is not None else None,
+        ) as response:
+            response.raise_for_status()
+            prober.record_success(backend_host)
+            async for chunk in response.aiter_bytes():
+                if first_byte_at is None:
+                    first_byte_at = time.monotonic()
+                    if timing is not None:
+                        timing.mark("ttfb")
+                    active_router.observe_latency(replica, first_byte_at - started)
+                    metrics.ttfb.observe(labels, first_byte_at - started)
+                    if residency is not None:
+                        residency.touch(payload.model, backend_host)
+                        if cold:
+                            residency.record_cold_start(payload.model, first_byte_at - started)
+                            metrics.cold_starts.inc(labels)
+                            metrics.load_seconds.observe(labels + ("request",), first_byte_at - started)
+                    if track_affinity:
+                        outcome, prefill_saved = active_router.observe_affinity(
+                            replica, affinity_key, first_byte_at - started)
+                        metrics.affinity.inc((payload.model, outcome))
+                        if prefill_saved:
+                            metrics.prefill_saved.inc((payload.model,), prefill_saved)
+                metrics.bytes.inc(labels, len(chunk))
+                metrics.chunks.inc(labels)
+                tail[0], tail[1] = tail[1], chunk
+                if body_parts is not None:
+                    body_parts.append(chunk)
+                yield chunk
+        finished = time.monotonic()
+        if residency is not None:
+            # Ollama's keep_alive counts from the end of the request
+            residency.touch(payload.model, backend_host)
+        metrics.stream_duration.observe(labels, finished - started)
+        active_router.observe_duration(replica, finished - started)
+        final_stats = parse_final_stats(tail[0] + tail[1])
+        if final_stats is not None:
+            metrics.tokens.inc(labels, final_stats["eval_tokens"])
+            if payload.stream and first_byte_at is not None:
+                # Upstream reports no durations. The first byte carries the first token, so the
+                # tokens after it over the time to the last byte is the decode speed, without
+                # queueing, prompt processing or model load.
+                final_stats["eval_seconds"] = finished - first_byte_at
+                if final_stats["eval_tokens"] > 1 and finished > first_byte_at:
+                    metrics.token_rate.observe(labels, (final_stats["eval_tokens"] - 1) / (finished - first_byte_at))
+        if body_parts is not None:
+            response_cache.put(cache_key, payload.model, b"".join(body_parts))
+        outcome = "completed"
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Backend error {e.response.status_code} from {backend_host}{backend_path}")
+        metrics.errors.inc((backend_host, upstream_error_type(e)))
+        if e.response.status_code >= 500:
+            prober.record_failure(backend_host, f"HTTP {e.response.status_code}")
+        error_chunk = f'data: {{"error": "Backend error: {e.response.status_code}"}}\n\n'
+        yield error_chunk.encode()
+    except httpx.RequestError as e:
+        logger.error(f"Connection failed to {backend_host}{backend_path}: {e}")
+        metrics.errors.inc((backend_host, upstream_error_type(e)))
+        prober.record_failure(backend_host, f"{type(e).__name__}: {e}")
+        error_chunk = f'data: {{"error": "Connection failed: {str(e)}"}}\n\n'
+        yield error_chunk.encode()
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client disconnected (or every coalesced subscriber did). Leaving the upstream
+        # context closes the backend connection, which makes Ollama stop generating.
+        elapsed = time.monotonic() - started
+        saved = active_router.remaining_seconds(replica, elapsed)
+        logger.info(f"Client gone after {elapsed:.1f}s; aborted '{payload.model}' on {backend_host} "
+                    f"(~{saved:.1f}s of generation saved)")
+        metrics.cancelled.inc((payload.model, "streaming"))
+        metrics.saved_seconds.inc(labels, saved)
+        outcome = "cancelled"
+        raise
+    finally:
+        if usage_sink is not None:
+            usage_sink.record(payload.model, backend_host, api, client, payload.stream, outcome, final_stats,
+                              first_byte_at - started if first_byte_at is not None else None,
+                              time.monotonic() - started)
+        metrics.in_flight.dec(labels)
+        active_router.release(replica)
+        if ticket is not None:
+            admission.release(ticket)
+
+async def wait_for_disconnect(request: Request):
+    """Returns once the client has closed its connection (the request body must already be read)."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+async def unless_disconnected(request: Request, work: asyncio.Task) -> bool:
+    """
+    Waits for `work` and returns True, or cancels it and returns False as soon as the
+    client disconnects. Used for waits that happen before the response starts, which
+    Starlette does not watch for disconnects.
+    """
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        watcher.cancel()
+    if work.done():
+        return True
+    work.cancel()
+    try:
+        await work
+    except asyncio.CancelledError:
+        return False
+    # It finished before the cancellation landed
+    return True
+
+async def prefetch(request: Request, body_stream, timing: RequestTiming):
+    """
+    Waits for the first chunk before the response starts, so the Server-Timing header can
+    include the upstream phases. Returns a stream that replays it, or None if the client
+    disconnected while waiting.
+    """
+    iterator = body_stream.__aiter__()
+    first = asyncio.ensure_future(iterator.__anext__())
+    connected = await unless_disconnected(request, first)
+    # For a request that joined a coalesced call, this is all of its time to first byte
+    timing.mark("ttfb")
+    if not connected:
+        return None
+    try:
+        chunk = first.result()
+    except StopAsyncIteration:
+        chunk = None
+
+    async def replay():
+        if chunk is None:
+            return
+        yield chunk
+        async for rest in iterator:
+            yield rest
+    return replay()
+
+def release_unclaimed(ticket):
+    """
+    Frees an admission ticket unless an upstream call took it over. A started
+    stream_proxied_response releases its own ticket; one that never started (the client
+    left before the body was first read, or the request joined another coalesced call)
+    would otherwise hold its slot for good.
+    """
+    if ticket is not None and not ticket.claimed:
+        admission.release(ticket)
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse that calls release_unclaimed() however it ends. Starlette cancels
+    the body without starting it when the client is already gone, so the body generator's
+    own finally cannot be relied on.
+    """
+    def __init__(self, content, ticket=None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
         try:
-            async with client.stream(
-                "POST",
-                backend_url,
-                json=payload.dict(exclude_none=True),
-                headers={"Content-Type": "application/json"},
-            ) as response:
-                response.raise_for_status()
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Backend error {e.response.status_code} from {backend_url}")
-            error_chunk = f'data: {{"error": "Backend error: {e.response.status_code}"}}\n\n'
-            yield error_chunk.encode()
-        except httpx.RequestError as e:
-            logger.error(f"Connection failed to {backend_url}: {e}")
-            error_chunk = f'data: {{"error": "Connection failed: {str(e)}"}}\n\n'
-            yield error_chunk.encode()
+            await super().__call__(scope, receive, send)
+        finally:
+            release_unclaimed(self.ticket)
 
 # === Endpoints ===
 @app.get("/health")
 async def health():
-    return {"status": "healthy"}
+    """Reports the circuit breaker state and last probe result of every backend."""
+    return prober.status()
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """Exposes per-backend connection pool statistics (requests vs. new connections)."""
+    return upstream_pool.stats()
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Exposes per-replica in-flight counters and latency estimates."""
+    return router.stats()
+
+@app.get("/config/reload/stats")
+async def reload_stats():
+    """Exposes hot reload counters for this worker."""
+    return config_watcher.stats()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Exposes response cache hit/miss counters for this worker."""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+@app.get("/shared/stats")
+async def shared_state_stats():
+    """Exposes the shared state segment's worker slots and key usage."""
+    if shared_state is None:
+        return {"enabled": False}
+    return {"enabled": True, **shared_state.stats()}
+
+@app.get("/singleflight/stats")
+async def singleflight_stats():
+    """Exposes how many identical requests were coalesced onto an in-flight call."""
+    if singleflight is None:
+        return {"enabled": False}
+    return {"enabled": True, **singleflight.stats()}
+
+@app.get("/discovery/stats")
+async def discovery_stats():
+    """Exposes the per-node model inventory used for listings and routing."""
+    if discovery is None:
+        return {"enabled": False}
+    return {"enabled": True, **discovery.stats()}
+
+@app.get("/logging/stats")
+async def logging_stats():
+    """Exposes the log writer queue, dropped records and access log sampling counters."""
+    stats = {"server_timing": SERVER_TIMING, "writer": log_writer.stats()}
+    if access_log is not None:
+        stats["access_log"] = access_log.stats()
+    return stats
+
+@app.get("/residency/stats")
+async def residency_stats():
+    """Exposes which models are loaded on each node, request rates, cold starts and preloads."""
+    if residency is None:
+        return {"enabled": False}
+    return {"enabled": True, **residency.stats()}
+
+@app.get("/usage/stats")
+async def usage_stats():
+    """Exposes usage accounting queue depth and written/dropped record counts for this worker."""
+    if usage_sink is None:
+        return {"enabled": False}
+    return {"enabled": True, **usage_sink.stats()}
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """Exposes per-model slots, queue depth, rejections and wait time percentiles."""
+    if admission is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format); covers every worker when shared state is on."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/v1/models", response_model=ModelList)
 async def list_models():
-    """Returns the list of models explicitly defined in the static MODEL_MAP."""
-    if not MODEL_MAP:
-        logger.warning("No models are defined in the MODEL_MAP configuration.")
-        return {"data": []}
-    
-    models = [{"id": model_id, "object": "model"} for model_id in MODEL_MAP.keys()]
-    return {"data": models}
+    """Returns the available models from memory; a stale index is refreshed in the background."""
+    if discovery is not None:
+        discovery.ensure_fresh()
+    return Response(content=MODEL_LISTINGS["openai"], media_type="application/json")
 
 @app.get("/api/tags")
 async def api_tags():
-    """Provides compatibility for UIs by showing mapped models."""
-    if not MODEL_MAP:
-        logger.warning("No models are defined in the MODEL_MAP configuration.")
-        return {"models": []}
-        
-    models = [{"name": model_id, "model": model_id} for model_id in MODEL_MAP.keys()]
-    logger.info(f"Presenting {len(models)} models from explicit configuration.")
-    return {"models": models}
-
-@app.post("/v1/chat/completions")
-async def chat_completions(payload: ChatCompletionRequest):
-    """Routes chat requests ONLY for models explicitly defined in the MODEL_MAP."""
+    """Provides compatibility for UIs by showing the available models, served from memory."""
+    if discovery is not None:
+        discovery.ensure_fresh()
+    return Response(content=MODEL_LISTINGS["ollama"], media_type="application/json")
+
+def stream_usage(payload: Union[ChatCompletionRequest, RawChatRequest]) -> bool:
+    """
+    Makes a streaming request end with a usage chunk, so token counts are known for metrics
+    and usage accounting. Returns whether the client asked for the chunk itself.
+    """
+    if isinstance(payload, RawChatRequest):
+        return payload.include_usage()
+    options = payload.stream_options or {}
+    if options.get("include_usage") is True:
+        return True
+    payload.stream_options = {**options, "include_usage": True}
+    return False
+
+def client_response(body_stream, payload: Union[ChatCompletionRequest, RawChatRequest], api: str,
+                    strip_usage: bool = False):
+    """
+    Upstream calls always speak the OpenAI API, so cache entries and coalesced calls are
+    shared by both API styles; Ollama-native clients get the bytes transcoded on the way out.
+    """
+    if api == "ollama":
+        if payload.stream:
+            return transcode_stream(body_stream, SSEToNDJSON(payload.model)), "application/x-ndjson"
+        return transcode_body(body_stream, openai_to_ollama_response, payload.model), "application/json"
+    if strip_usage:
+        # The client did not ask for the usage chunk the gateway requested
+        body_stream = transcode_stream(body_stream, UsageChunkFilter())
+    return body_stream, "text/event-stream" if payload.stream else "application/json"
+
+async def route_chat(payload: Union[ChatCompletionRequest, RawChatRequest], request: Request, api: str = "openai"):
+    """Routes chat requests for models in the MODEL_MAP or found on the nodes by discovery."""
     model_id = payload.model
+    timing: RequestTiming = request.state.timing
+    timing.fields.update(model=model_id, api=api, stream=payload.stream)
+    # Before any key is derived from the body, so coalesced streams all carry the usage chunk
+    strip_usage = bool(payload.stream) and not stream_usage(payload) and api == "openai"
 
-    if model_id in MODEL_MAP:
-        backend_host = MODEL_MAP[model_id]
-        logger.info(f"Routing '{model_id}' using explicit MODEL_MAP to '{backend_host}'")
-        backend_url = f"http://{backend_host}/v1/chat/completions"
-        return StreamingResponse(
-            stream_proxied_response(backend_url, payload),
-            media_type="application/x-ndjson" if payload.stream else "application/json",
-        )
+    # Deterministic, non-streaming requests may be answered from the response cache.
+    # Clients opt out per request with Cache-Control: no-cache (skip lookup) or no-store.
+    cache_key = None
+    cache_status = "BYPASS"
+    if response_cache is not None and router.has_model(model_id):
+        body = payload.dict(exclude_none=True)
+        cache_control = request.headers.get("cache-control", "").lower()
+        if is_cacheable(body) and "no-store" not in cache_control:
+            cache_key = request_cache_key(body)
+            if "no-cache" not in cache_control:
+                cached = response_cache.get(cache_key)
+                if cached is not None:
+                    cached_body, age = cached
+                    if api == "ollama":
+                        cached_body = openai_to_ollama_response(cached_body, model_id)
+                    timing.mark("cache")
+                    timing.fields["cache"] = "HIT"
+                    return Response(
+                        content=cached_body,
+                        media_type="application/json",
+                        headers={"X-Cache": "HIT", "Age": str(int(age))},
+                    )
+                cache_status = "MISS"
+            else:
+                # Skip the lookup but store the fresh answer
+                cache_status = "REFRESH"
+                response_cache.record_bypass()
+        else:
+            response_cache.record_bypass()
+
+    if router.has_model(model_id):
+        # Fail fast when every replica's circuit is open instead of waiting on connect timeouts
+        if router.select(model_id, exclude=routing_exclusions(model_id, router)) is None:
+            logger.warning(f"No healthy backend for '{model_id}'; all replicas have open circuits")
+            raise HTTPException(
+                status_code=503,
+                detail=f"Model '{model_id}' is temporarily unavailable: no healthy backend."
+            )
+        if residency is not None:
+            residency.record_request(model_id)
+        client = None
+        if usage_sink is not None:
+            client = request.headers.get(USAGE_CLIENT_HEADER) or (request.client.host if request.client else None)
+        # Turns of one conversation go to the same replica so its prompt cache is reused
+        affinity_key = None
+        if router.affinity_load_factor:
+            affinity_key = conversation_key(model_id, payload.messages, request.headers.get(AFFINITY_SESSION_HEADER))
+
+        flight_key = None
+        if singleflight is not None and singleflight.eligible(model_id) and \
+                (payload.temperature == 0 or not COALESCE_DETERMINISTIC_ONLY):
+            flight_key = ("stream:" if payload.stream else "full:") + request_cache_key(payload.dict(exclude_none=True))
+
+        # Wait for a model/backend slot; requests joining an in-flight call need none
+        ticket = None
+        active_router = router
+        if admission is not None and not (flight_key and singleflight.joinable(flight_key)):
+            try:
+                priority = int(request.headers.get(PRIORITY_HEADER, 0))
+            except ValueError:
+                priority = 0
+            admit = asyncio.ensure_future(admission.admit(
+                model_id,
+                # The slot is granted as soon as a replica is picked, so that is when it is tried
+                lambda saturated: routed(active_router.select(
+                    model_id, exclude=routing_exclusions(model_id, active_router) | saturated,
+                    affinity_key=affinity_key)),
+                priority,
+            ))
+            try:
+                # A client that gives up while queued leaves the queue instead of taking a slot later
+                if not await unless_disconnected(request, admit):
+                    logger.info(f"Client gone while queued for '{model_id}'")
+                    metrics.cancelled.inc((model_id, "queued"))
+                    return Response(status_code=499)
+                ticket = admit.result()
+            except AdmissionRejected as e:
+                logger.warning(f"Rejecting request for '{model_id}': {e} (retry after {e.retry_after}s)")
+                metrics.rejected.inc((model_id, "timeout" if e.reason.startswith("Timed out") else "queue_full"))
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"Model '{model_id}' is at capacity: {e.reason.lower()}.",
+                    headers={"Retry-After": str(e.retry_after)},
+                )
+            metrics.queue_wait.observe((model_id,), ticket.waited)
+        # Nothing below may lose the ticket: it goes to the response, or is released here
+        try:
+            timing.mark("route")
+            if response_cache is not None:
+                timing.fields["cache"] = cache_status
+
+            if flight_key is not None:
+                # Identical requests already in flight share one upstream call
+                body_stream = singleflight.stream(flight_key, lambda: stream_proxied_response(
+                    payload, cache_key, ticket, active_router, affinity_key, timing, api, client))
+            else:
+                body_stream = stream_proxied_response(payload, cache_key, ticket, active_router, affinity_key,
+                                                      timing, api, client)
+            body_stream, media_type = client_response(body_stream, payload, api, strip_usage)
+            if SERVER_TIMING:
+                body_stream = await prefetch(request, body_stream, timing)
+                if body_stream is None:
+                    logger.info(f"Client gone before the first byte from '{model_id}'")
+                    release_unclaimed(ticket)
+                    return Response(status_code=499)
+            return AdmittedStreamingResponse(
+                body_stream,
+                ticket,
+                media_type=media_type,
+                headers={"X-Cache": cache_status} if response_cache is not None else None,
+            )
+        except BaseException:
+            release_unclaimed(ticket)
+            raise
     else:
         logger.warning(f"Rejecting request for unmapped model_id: '{model_id}'")
         raise HTTPException(
@@ -121,16 +956,134 @@ async def chat_completions(payload: ChatCompletionRequest):
             detail=f"Model '{model_id}' not found. This gateway only routes explicitly mapped models."
         )
 
-@app.post("/api/chat")
-async def api_chat(payload: OllamaNativeChatRequest):
-    """Compatibility endpoint that forwards to the main chat logic."""
-    logger.info(f"Received request on native /api/chat for model '{payload.model}'")
+def validated(model_class, body: bytes):
+    """Full Pydantic validation of a chat body, failing with FastAPI's usual 422."""
+    try:
+        return model_class.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+
+def passthrough(parse, body: bytes) -> RawChatRequest:
+    try:
+        return parse(body)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/v1/chat/completions", openapi_extra={"requestBody": {"content": {"application/json": {
+    "schema": ChatCompletionRequest.model_json_schema()}}, "required": True}})
+async def chat_completions(request: Request):
+    """
+    OpenAI-compatible chat endpoint (SSE when streaming). With passthrough on, the body
+    is forwarded byte for byte, unknown fields included; otherwise it is validated.
+    """
+    body = await request.body()
+    request.state.timing.mark("read")
+    payload = passthrough(parse_openai_chat, body) if CHAT_PASSTHROUGH else validated(ChatCompletionRequest, body)
+    request.state.timing.mark("validate")
+    return await route_chat(payload, request)
+
+@app.post("/api/chat", openapi_extra={"requestBody": {"content": {"application/json": {
+    "schema": OllamaNativeChatRequest.model_json_schema()}}, "required": True}})
+async def api_chat(request: Request):
+    """Ollama-native chat endpoint: same routing, with the response transcoded to NDJSON."""
+    body = await request.body()
+    request.state.timing.mark("read")
+    if CHAT_PASSTHROUGH:
+        openai_payload = passthrough(parse_ollama_chat, body)
+        request.state.timing.mark("validate")
+        logger.debug(f"Received request on native /api/chat for model '{openai_payload.model}'")
+        return await route_chat(openai_payload, request, api="ollama")
+    payload = validated(OllamaNativeChatRequest, body)
+    logger.debug(f"Received request on native /api/chat for model '{payload.model}'")
+    options = payload.options or {}
+    # num_predict -1 / -2 mean "no limit" in Ollama
+    num_predict = options.get("num_predict")
     openai_payload = ChatCompletionRequest(
         model=payload.model,
         messages=payload.messages,
-        stream=payload.stream
+        stream=payload.stream,
+        temperature=options.get("temperature"),
+        max_tokens=num_predict if num_predict and num_predict > 0 else None,
+        # Token counts for the final NDJSON chunk (and usage accounting)
+        stream_options={"include_usage": True} if payload.stream else None,
     )
-    return await chat_completions(openai_payload)
+    request.state.timing.mark("validate")
+    return await route_chat(openai_payload, request, api="ollama")
+
+async def batched_embeddings(model_id: str, texts: List[str], extras: Dict[str, Any]):
+    """
+    Embeds through the persistent cache and the batcher: cached vectors are returned in
+    bulk and only the misses are sent to a backend (batched with other requests).
+    """
+    if not router.has_model(model_id):
+        logger.warning(f"Rejecting embedding request for unmapped model_id: '{model_id}'")
+        raise HTTPException(status_code=404, detail=f"Model '{model_id}' not found.")
+    keys = None
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+    if embedding_cache is not None:
+        # keep_alive only affects how long the model stays loaded, not the vectors
+        vector_options = {k: v for k, v in extras.items() if k != "keep_alive"}
+        keys = [cache_key(model_id, text, vector_options) for text in texts]
+        vectors = embedding_cache.get_many(keys)
+    misses = [i for i, vector in enumerate(vectors) if vector is None]
+    if not misses:
+        return vectors, 0
+    if residency is not None:
+        residency.record_request(model_id, embedding=True)
+    try:
+        if embedding_batcher is None:
+            fresh, tokens = await embed_upstream(model_id, [texts[i] for i in misses], extras)
+        else:
+            fresh, tokens = await embedding_batcher.embed(model_id, [texts[i] for i in misses], extras)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Backend error: {e.response.status_code}")
+    except (httpx.RequestError, RuntimeError, ValueError) as e:
+        raise HTTPException(status_code=502, detail=f"Embedding failed: {e}")
+    if len(fresh) != len(misses):
+        # The batcher checks its batches; a direct call is checked here
+        logger.error(f"Backend returned {len(fresh)} vectors for {len(misses)} inputs of '{model_id}'")
+        raise HTTPException(status_code=502, detail=f"Embedding failed: backend returned {len(fresh)} vectors "
+                                                    f"for {len(misses)} inputs")
+    for i, vector in zip(misses, fresh):
+        vectors[i] = vector
+    if embedding_cache is not None:
+        embedding_cache.put_many([(keys[i], vectors[i]) for i in misses])
+    return vectors, tokens
+
+@app.post("/v1/embeddings")
+async def embeddings(payload: EmbeddingsRequest):
+    """OpenAI-compatible embeddings, micro-batched with other concurrent requests."""
+    texts = [payload.input] if isinstance(payload.input, str) else payload.input
+    extras = {"dimensions": payload.dimensions} if payload.dimensions else {}
+    vectors, tokens = await batched_embeddings(payload.model, texts, extras)
+    if payload.encoding_format == "base64":
+        # Packed float32 (little-endian on our hosts), as the OpenAI clients expect
+        vectors = [base64.b64encode(array("f", v).tobytes()).decode() for v in vectors]
+    body = {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "model": payload.model,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+    # Serialize directly: FastAPI's encoder walks every float in every vector
+    return Response(content=json.dumps(body, separators=(",", ":")), media_type="application/json")
+
+@app.post("/api/embed")
+async def api_embed(payload: OllamaEmbedRequest):
+    """Ollama-native embeddings, sharing batches with /v1/embeddings."""
+    texts = [payload.input] if isinstance(payload.input, str) else payload.input
+    extras = payload.dict(exclude_none=True, include={"truncate", "options", "keep_alive"})
+    vectors, tokens = await batched_embeddings(payload.model, texts, extras)
+    body = {"model": payload.model, "embeddings": vectors, "prompt_eval_count": tokens}
+    return Response(content=json.dumps(body, separators=(",", ":")), media_type="application/json")
+
+@app.get("/embeddings/stats")
+async def embeddings_stats():
+    """Exposes embedding batching and (per worker) persistent cache hit rates."""
+    return {
+        "batching": embedding_batcher.stats() if embedding_batcher is not None else {"enabled": False},
+        "cache": embedding_cache.stats() if embedding_cache is not None else {"enabled": False},
+    }
 
 # === Entrypoint ===
 if __name__ == "__main__":
@@ -0,0 +1,282 @@
+# metrics.py
+import json
+import os
+import re
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from shared_state import COUNTER, GAUGE, SEP, SharedState
+
+# Each worker is a separate process; without shared state the label keeps their
+# counters from looking like resets
+WORKER_ID = str(os.getpid())
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "", worker: bool = True) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if worker:
+        pairs.append(f'worker="{WORKER_ID}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 shared: Optional[SharedState] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # With shared state, series live in the host-wide segment under "name<SEP>label values"
+        self.shared = shared
+        self._keys: Dict[Tuple[str, ...], str] = {}
+
+    def _key(self, labels: Tuple[str, ...]) -> str:
+        key = self._keys.get(labels)
+        if key is None:
+            key = self._keys[labels] = SEP.join((self.name,) + tuple(labels))
+        return key
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonic counter. Updates are plain dict operations on the event loop thread, no locks;
+    in shared mode they are a store into this worker's column of the shared segment.
+    """
+    kind = "counter"
+    shared_kind = COUNTER
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        # Optional callable returning {labels: value}, read at render time instead of stored values
+        self.source: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1.0):
+        if self.shared is not None:
+            self.shared.add(self._key(labels), amount, self.shared_kind)
+            return
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def collect(self, series: List[Tuple[List[str], float]]) -> Dict[Tuple[str, ...], float]:
+        """Host-wide values from the shared snapshot entries for this metric."""
+        return {tuple(parts): value for parts, value in series}
+
+    def render(self, series: Optional[List[Tuple[List[str], float]]] = None) -> List[str]:
+        lines = self.header()
+        worker = self.shared is None
+        if self.source is not None:
+            values = self.source()
+        else:
+            values = self.values if worker else self.collect(series or [])
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels, worker=worker)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+    # Zeroed when a worker exits, so the host total only counts live workers
+    shared_kind = GAUGE
+
+    def set(self, labels: Tuple[str, ...], value: float):
+        if self.shared is not None:
+            self.shared.set(self._key(labels), value, GAUGE)
+            return
+        self.values[labels] = float(value)
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    """Fixed-bucket histogram; observe() is a bisect plus two additions."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS, shared: Optional[SharedState] = None):
+        super().__init__(name, documentation, labelnames, shared)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+        self._series_keys: Dict[Tuple[str, ...], List[str]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        if self.shared is not None:
+            keys = self._series_keys.get(labels)
+            if keys is None:
+                # One shared counter per bucket plus one for the sum
+                base = self._key(labels)
+                keys = self._series_keys[labels] = [f"{base}{SEP}{i}" for i in range(len(self.buckets) + 1)]
+                keys.append(f"{base}{SEP}sum")
+            self.shared.add(keys[bisect_left(self.buckets, value)])
+            self.shared.add(keys[-1], value)
+            return
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def collect(self, series: List[Tuple[List[str], float]]) -> Dict[Tuple[str, ...], List[float]]:
+        values: Dict[Tuple[str, ...], List[float]] = {}
+        for parts, value in series:
+            labels, slot = tuple(parts[:-1]), parts[-1]
+            row = values.get(labels)
+            if row is None:
+                row = values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            if slot == "sum":
+                row[-1] = value
+            elif slot.isdigit() and int(slot) <= len(self.buckets):
+                row[int(slot)] = int(value)
+        return values
+
+    def render(self, series: Optional[List[Tuple[List[str], float]]] = None) -> List[str]:
+        lines = self.header()
+        worker = self.shared is None
+        values = self.values if worker else self.collect(series or [])
+        for labels, row in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le, worker)} {cumulative}")
+            cumulative += row[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le, worker)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels, worker=worker)} {row[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels, worker=worker)} {cumulative}")
+        return lines
+
+
+class GatewayMetrics:
+    """
+    The gateway's Prometheus metrics, rendered in the text exposition format. With a
+    SharedState every worker records into the same segment and any worker renders the
+    whole host, so series carry no worker label.
+    """
+    def __init__(self, shared: Optional[SharedState] = None):
+        self.shared = shared
+        model_backend = ("model", "backend")
+        self.requests = Counter("citadel_gateway_requests_total", "Chat requests proxied to a backend.", model_backend, shared)
+        self.in_flight = Gauge("citadel_gateway_in_flight_requests", "Chat requests currently streaming.", model_backend, shared)
+        self.ttfb = Histogram("citadel_gateway_ttfb_seconds", "Time from upstream request to first byte.", model_backend,
+                              shared=shared)
+        self.stream_duration = Histogram("citadel_gateway_stream_duration_seconds", "Total upstream stream duration.",
+                                         model_backend, shared=shared)
+        self.bytes = Counter("citadel_gateway_streamed_bytes_total", "Bytes streamed from backends to clients.", model_backend, shared)
+        self.chunks = Counter("citadel_gateway_streamed_chunks_total", "Chunks streamed from backends to clients.", model_backend, shared)
+        self.tokens = Counter("citadel_gateway_generated_tokens_total", "Tokens generated by backends (usage.completion_tokens).", model_backend, shared)
+        self.token_rate = Histogram("citadel_gateway_generation_tokens_per_second", "Decode speed of streamed responses: tokens after the first over the time from first to last byte.",
+                                    model_backend, buckets=TOKEN_RATE_BUCKETS, shared=shared)
+        self.errors = Counter("citadel_gateway_upstream_errors_total", "Upstream failures by type.", ("backend", "type"), shared)
+        self.queue_depth = Gauge("citadel_gateway_admission_queue_depth", "Requests waiting for an admission slot.", ("model",), shared)
+        self.queue_wait = Histogram("citadel_gateway_admission_wait_seconds", "Time spent waiting for an admission slot.", ("model",),
+                                    shared=shared)
+        self.rejected = Counter("citadel_gateway_admission_rejected_total", "Requests rejected with 429.", ("model", "reason"), shared)
+        self.cancelled = Counter("citadel_gateway_cancelled_requests_total",
+                                 "Requests abandoned by the client, by where they were (queued or streaming).",
+                                 ("model", "stage"), shared)
+        self.saved_seconds = Counter("citadel_gateway_saved_gpu_seconds_total",
+                                     "Estimated backend GPU time saved by aborting generations nobody was reading.",
+                                     model_backend, shared)
+        self.affinity = Counter("citadel_gateway_affinity_requests_total",
+                                "Conversation-affinity routing outcomes (hit: same replica as the previous turn; "
+                                "spill: another one; first: no earlier turn seen).",
+                                ("model", "result"), shared)
+        self.prefill_saved = Counter("citadel_gateway_affinity_prefill_saved_seconds_total",
+                                     "Estimated prefill time saved by affinity hits (cold TTFB minus hit TTFB).",
+                                     ("model",), shared)
+        self.cold_starts = Counter("citadel_gateway_cold_starts_total",
+                                   "Chat requests routed to a node that did not have the model loaded.",
+                                   model_backend, shared)
+        self.load_seconds = Histogram("citadel_gateway_model_load_seconds",
+                                      "Model load latency: TTFB of cold-start requests, or the duration of a preload.",
+                                      ("model", "backend", "trigger"), shared=shared)
+        self.preloads = Counter("citadel_gateway_model_preloads_total",
+                                "Gateway-initiated model loads and keep_alive refreshes (result: loaded, refreshed, failed).",
+                                ("model", "backend", "result"), shared)
+        self.evictions = Counter("citadel_gateway_model_evictions_total",
+                                 "Models a node unloaded before their keep_alive ran out (swapped out for another model).",
+                                 model_backend, shared)
+        self.log_dropped = Counter("citadel_gateway_log_records_dropped_total",
+                                   "Log records not written (reason: queue_full, sampled, rate_limited).",
+                                   ("reason",), shared)
+        self.usage_records = Counter("citadel_gateway_usage_records_total",
+                                     "Usage accounting records (result: written, queue_full, write_failed).",
+                                     ("result",), shared)
+        self._metrics = [self.requests, self.in_flight, self.ttfb, self.stream_duration, self.bytes,
+                         self.chunks, self.tokens, self.token_rate, self.errors,
+                         self.queue_depth, self.queue_wait, self.rejected, self.cancelled, self.saved_seconds,
+                         self.affinity, self.prefill_saved, self.cold_starts, self.load_seconds,
+                         self.preloads, self.evictions, self.log_dropped, self.usage_records]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        if self.shared is None:
+            for metric in self._metrics:
+                lines.extend(metric.render())
+            return "\n".join(lines) + "\n"
+        # One pass over the segment, grouped by metric name
+        grouped: Dict[str, List[Tuple[List[str], float]]] = {}
+        for key, value in self.shared.items():
+            parts = key.split(SEP)
+            grouped.setdefault(parts[0], []).append((parts[1:], value))
+        for metric in self._metrics:
+            lines.extend(metric.render(grouped.get(metric.name, [])))
+        return "\n".join(lines) + "\n"
+
+
+_USAGE_BLOCK = re.compile(rb'"usage"\s*:\s*\{')
+_DECODER = json.JSONDecoder()
+
+
+def parse_final_stats(tail: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Extracts the token counts from the usage block at the end of an OpenAI-style response
+    (the usage chunk of a stream, or the usage key of a full body). Returns prompt_tokens
+    and eval_tokens, or None when there is no usage block.
+    """
+    if b'"usage"' not in tail:
+        return None
+    for line in reversed(tail.splitlines()):
+        line = line.strip()
+        if line.startswith(b"data:"):
+            line = line[5:].strip()
+        if not line.startswith(b"{"):
+            continue
+        try:
+            data: Dict[str, Any] = json.loads(line)
+        except ValueError:
+            continue
+        usage = data.get("usage")
+        if isinstance(usage, dict) and "completion_tokens" in usage:
+            return _usage_stats(usage)
+    # A non-streaming body that arrived in several chunks: the usage block is still whole
+    match = None
+    for match in _USAGE_BLOCK.finditer(tail):
+        pass
+    if match is not None:
+        try:
+            usage, _ = _DECODER.raw_decode(tail[match.end() - 1:].decode("utf-8", "replace"))
+        except ValueError:
+            return None
+        if isinstance(usage, dict) and "completion_tokens" in usage:
+            return _usage_stats(usage)
+    return None
+
+
+def _usage_stats(usage: Dict[str, Any]) -> Dict[str, Any]:
+    return {"prompt_tokens": usage.get("prompt_tokens"), "eval_tokens": int(usage["completion_tokens"])}
@@ -0,0 +1,106 @@
+# passthrough.py
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from pydantic_core import from_json
+
+
+class RawChatRequest:
+    """
+    A chat request forwarded upstream as bytes, with only the fields the gateway routes
+    on checked. Quacks like ChatCompletionRequest for route_chat and the streaming proxy.
+    """
+    __slots__ = ("body", "model", "stream", "temperature", "_data")
+
+    def __init__(self, body: bytes, data: Dict[str, Any], model: str, stream: bool, temperature: Optional[float]):
+        self.body = body
+        self.model = model
+        self.stream = stream
+        self.temperature = temperature
+        self._data = data
+
+    @property
+    def messages(self) -> Any:
+        return self._data.get("messages")
+
+    def include_usage(self) -> bool:
+        """
+        Makes a streaming request end with a usage chunk (token counts). Returns whether
+        the client asked for it itself; if not, the chunk is kept from the client.
+        """
+        if "stream_options" not in self._data:
+            # Spliced in front so the rest of the client's bytes go upstream unchanged
+            self.body = b'{"stream_options":{"include_usage":true},' + self.body.lstrip()[1:]
+            self._data = {**self._data, "stream_options": {"include_usage": True}}
+            return False
+        options = self._data["stream_options"] or {}
+        if not isinstance(options, dict) or options.get("include_usage") is True:
+            return True
+        self._data = {**self._data, "stream_options": {**options, "include_usage": True}}
+        self.body = json.dumps(self._data).encode()
+        return False
+
+    def dict(self, exclude_none: bool = True) -> Dict[str, Any]:
+        if exclude_none:
+            return {k: v for k, v in self._data.items() if v is not None}
+        return dict(self._data)
+
+
+def _load_object(body: bytes) -> Dict[str, Any]:
+    # One native parse, no model construction; long message contents are not revisited
+    try:
+        data = from_json(body, cache_strings=False)
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON body: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    return data
+
+
+def _number(value: Any, name: str) -> Optional[float]:
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise ValueError(f"'{name}' must be a number")
+    return value
+
+
+def _routing_fields(data: Dict[str, Any], default_stream: bool) -> Tuple[str, bool]:
+    model = data.get("model")
+    if not isinstance(model, str) or not model:
+        raise ValueError("'model' must be a non-empty string")
+    if not isinstance(data.get("messages"), list):
+        raise ValueError("'messages' must be a list")
+    stream = data.get("stream")
+    if stream is None:
+        stream = default_stream
+    elif not isinstance(stream, bool):
+        raise ValueError("'stream' must be a boolean")
+    return model, stream
+
+
+def parse_openai_chat(body: bytes) -> RawChatRequest:
+    """Reads model/stream/temperature from an OpenAI chat body that is forwarded unchanged."""
+    data = _load_object(body)
+    model, stream = _routing_fields(data, default_stream=False)
+    return RawChatRequest(body, data, model, stream, _number(data.get("temperature"), "temperature"))
+
+
+def parse_ollama_chat(body: bytes) -> RawChatRequest:
+    """Translates an Ollama /api/chat body into the OpenAI request sent upstream."""
+    data = _load_object(body)
+    # Ollama streams unless the client asks otherwise
+    model, stream = _routing_fields(data, default_stream=True)
+    options = data.get("options") or {}
+    if not isinstance(options, dict):
+        raise ValueError("'options' must be an object")
+    temperature = _number(options.get("temperature"), "options.temperature")
+    upstream = {"model": model, "messages": data["messages"], "stream": stream}
+    if stream:
+        # Token counts for the final NDJSON chunk (and usage accounting)
+        upstream["stream_options"] = {"include_usage": True}
+    if temperature is not None:
+        upstream["temperature"] = temperature
+    # num_predict -1 / -2 mean "no limit" in Ollama
+    num_predict = options.get("num_predict")
+    if isinstance(num_predict, int) and not isinstance(num_predict, bool) and num_predict > 0:
+        upstream["max_tokens"] = num_predict
+    return RawChatRequest(json.dumps(upstream).encode(), upstream, model, stream, temperature)
@@ -0,0 +1,439 @@
+# residency.py
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import httpx
+
+logger = logging.getLogger("citadel-gateway")
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ns|us|µs|ms|s|m|h)")
+DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+FRACTION = re.compile(r"\.(\d+)")
+
+
+def keep_alive_seconds(value: Any) -> float:
+    """
+    Seconds for an Ollama keep_alive value: a number of seconds or a Go duration such as
+    "30m" or "1h30m". Negative values mean "stay loaded forever" (infinity here).
+    """
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        text = str(value).strip()
+        parts = DURATION_PART.findall(text.lstrip("-"))
+        if not parts or "".join(n + u for n, u in parts) != text.lstrip("-"):
+            raise ValueError(f"Invalid keep_alive duration: {value!r}")
+        seconds = sum(float(n) * DURATION_UNITS[u] for n, u in parts)
+        if text.startswith("-"):
+            seconds = -seconds
+    return math.inf if seconds < 0 else seconds
+
+
+def expiry_deadline(value: Any) -> Optional[float]:
+    """Monotonic deadline for an /api/ps expires_at timestamp (RFC 3339, often with nanoseconds)."""
+    if not isinstance(value, str) or not value:
+        return None
+    # datetime takes at most microseconds
+    text = FRACTION.sub(lambda m: "." + (m.group(1) + "000000")[:6], value.replace("Z", "+00:00"), count=1)
+    try:
+        wall = datetime.fromisoformat(text).timestamp()
+    except (ValueError, OverflowError):
+        return None
+    return time.monotonic() + (wall - time.time())
+
+
+class Resident:
+    """One model loaded on one node."""
+    __slots__ = ("loaded_at", "last_used", "expires_at")
+
+    def __init__(self, now: float, expires_at: float):
+        self.loaded_at = now
+        self.last_used = now
+        self.expires_at = expires_at
+
+
+class LoadStats:
+    """Per-model cold starts, preloads and the time it takes a node to load the model."""
+    __slots__ = ("cold_starts", "preloads", "refreshes", "failures", "evictions", "load_seconds")
+
+    def __init__(self):
+        self.cold_starts = 0
+        self.preloads = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.evictions = 0
+        self.load_seconds: Optional[float] = None
+
+
+class ModelResidency:
+    """
+    Tracks which models are loaded in VRAM on which Ollama node, and warms models ahead
+    of demand.
+
+    Residency comes from each node's /api/ps (through ModelDiscovery's polls) and, between
+    polls, from the gateway's own traffic: a node that just answered for a model keeps it
+    loaded until the server's keep_alive runs out. The router adds `penalty()` to the load
+    of every candidate, so a request only goes to a node that has to load the model first
+    when the warm replicas are `cold_penalty` requests busier. A cold node that is full
+    (`max_loaded`) and would have to evict a model used within `min_residency` seconds
+    costs twice that, which keeps alternating traffic from swapping models in and out.
+
+    With preloading on, a background task (in one worker per host when shared state is
+    on) follows each model's request rate. For models above `min_rate` requests per
+    minute it loads the model on an idle replica when no replica is warm or every warm one
+    is busy, and re-sends `keep_alive` to warm replicas before it lapses. A preload never
+    runs while another is loading on the same node, within `cooldown` seconds of the last
+    one there, or when it would evict a protected or more frequently requested model.
+    """
+    def __init__(self, upstream_pool, router: Callable[[], Any], exclusions: Callable[[str, Any], Set[str]],
+                 discovery=None, shared: Any = None, cold_penalty: float = 4.0,
+                 server_keep_alive: Any = "5m", max_loaded: int = 0, min_residency: float = 300.0,
+                 preload: bool = False, keep_alive: Any = "30m", min_rate: float = 1.0,
+                 interval: float = 15.0, rate_window: float = 300.0, refresh_before: float = 60.0,
+                 cooldown: float = 60.0, timeout: float = 300.0,
+                 on_load: Optional[Callable[[str, str, str, float], None]] = None,
+                 on_evict: Optional[Callable[[str, str], None]] = None):
+        self.upstream_pool = upstream_pool
+        self.router = router
+        self.exclusions = exclusions
+        self.discovery = discovery
+        self.shared = shared
+        self.cold_penalty = cold_penalty
+        self.server_keep_alive = keep_alive_seconds(server_keep_alive)
+        self.max_loaded = max_loaded
+        self.min_residency = min_residency
+        self.preload = preload
+        self.keep_alive = keep_alive
+        self.keep_alive_seconds = keep_alive_seconds(keep_alive)
+        self.min_rate = min_rate
+        self.interval = interval
+        self.rate_window = rate_window
+        self.refresh_before = refresh_before
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self.on_load = on_load
+        self.on_evict = on_evict
+        # host -> model -> Resident; a host is in `known` once /api/ps or traffic told us about it
+        self.nodes: Dict[str, Dict[str, Resident]] = {}
+        self.known: Set[str] = set()
+        self._polled: Dict[str, float] = {}
+        self.models: Dict[str, LoadStats] = {}
+        # Request counts feeding the rates; host-wide in the shared segment when there is one
+        self.requests: Dict[str, int] = {}
+        self.embed_requests: Dict[str, int] = {}
+        # Models requested through the embeddings endpoints; Ollama loads them with /api/embed only
+        self.embedding_models: Set[str] = set()
+        self._counted: Dict[str, float] = {}
+        self.rates: Dict[str, float] = {}
+        self._sampled_at = time.monotonic()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._loading_model: Dict[str, str] = {}
+        self._last_load: Dict[str, float] = {}
+        # (model, host) -> consecutive failed loads / when to try again
+        self._failures: Dict[Tuple[str, str], int] = {}
+        self._retry_at: Dict[Tuple[str, str], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task is None and self.preload:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Model preloader started (every {self.interval}s, keep_alive {self.keep_alive}).")
+
+    async def stop(self):
+        for task in [self._task, *self._loading.values()]:
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Model preloader round failed: {e}")
+
+    def _stats(self, model: str) -> LoadStats:
+        stats = self.models.get(model)
+        if stats is None:
+            stats = self.models[model] = LoadStats()
+        return stats
+
+    def _leader(self) -> bool:
+        """True in the one worker per host that preloads and reports node-level events."""
+        if self.shared is None:
+            return True
+        workers = self.shared.workers()
+        return not workers or workers[0] == os.getpid()
+
+    # --- residency ---
+
+    def sync(self):
+        """Merges fresh /api/ps results from discovery (registered as a discovery listener)."""
+        if self.discovery is None:
+            return
+        now = time.monotonic()
+        for host, inventory in self.discovery.inventories.items():
+            polled = inventory.updated_at
+            if polled is None or polled <= self._polled.get(host, 0.0):
+                continue
+            self._polled[host] = polled
+            self.known.add(host)
+            resident = self.nodes.setdefault(host, {})
+            for model, info in inventory.loaded.items():
+                expires_at = expiry_deadline(info.get("expires_at"))
+                entry = resident.get(model)
+                if entry is None:
+                    # Load time unknown; counting from now keeps it protected rather than evictable
+                    entry = resident[model] = Resident(now, now + self.server_keep_alive)
+                if expires_at is not None:
+                    entry.expires_at = expires_at
+            for model in [m for m in resident if m not in inventory.loaded]:
+                entry = resident[model]
+                # Used since the poll was answered: the node has (re)loaded it after the snapshot
+                if entry.last_used > polled:
+                    continue
+                del resident[model]
+                if entry.expires_at > now:
+                    # Unloaded before its keep_alive ran out: the node swapped it out for another model
+                    self._stats(model).evictions += 1
+                    logger.info(f"'{model}' was evicted from {host} after {now - entry.loaded_at:.0f}s")
+                    if self.on_evict is not None and self._leader():
+                        self.on_evict(model, host)
+
+    def _live(self, host: str) -> Dict[str, Resident]:
+        resident = self.nodes.get(host)
+        if not resident:
+            return {}
+        now = time.monotonic()
+        for model in [m for m, entry in resident.items() if entry.expires_at <= now]:
+            del resident[model]
+        return resident
+
+    def is_cold(self, model: str, host: str) -> bool:
+        """True when the node is known not to have the model loaded (unknown nodes are not cold)."""
+        return host in self.known and model not in self._live(host)
+
+    def _victim(self, host: str) -> Optional[str]:
+        """The model a full node would unload to make room (least recently used), if any."""
+        resident = self._live(host)
+        if not self.max_loaded or len(resident) < self.max_loaded:
+            return None
+        return min(resident, key=lambda m: resident[m].last_used)
+
+    def _protected(self, host: str, model: str) -> bool:
+        entry = self.nodes[host][model]
+        return time.monotonic() - max(entry.loaded_at, entry.last_used) < self.min_residency
+
+    def penalty(self, model: str, host: str) -> float:
+        """Extra load, in requests, for sending the model to this node (0 when it is warm)."""
+        if not self.is_cold(model, host):
+            return 0.0
+        victim = self._victim(host)
+        if victim is not None and self._protected(host, victim):
+            return 2 * self.cold_penalty
+        return self.cold_penalty
+
+    def touch(self, model: str, host: str, keep_alive: Optional[float] = None):
+        """Records that the node is serving the model now, so it is loaded for keep_alive more seconds."""
+        now = time.monotonic()
+        self.known.add(host)
+        resident = self.nodes.setdefault(host, {})
+        expires_at = now + (self.server_keep_alive if keep_alive is None else keep_alive)
+        entry = resident.get(model)
+        if entry is None or entry.expires_at <= now:
+            resident[model] = Resident(now, expires_at)
+            return
+        entry.last_used = now
+        entry.expires_at = expires_at
+
+    def record_request(self, model: str, embedding: bool = False):
+        """Counts a request for the model's rate; `embedding` for the embeddings endpoints."""
+        kind = "embed_requests" if embedding else "requests"
+        if self.shared is not None:
+            self.shared.add(self.shared.SEP.join(("residency", kind, model)))
+        else:
+            counts = self.embed_requests if embedding else self.requests
+            counts[model] = counts.get(model, 0) + 1
+
+    def record_cold_start(self, model: str, seconds: float):
+        """A request that had to wait for the model to load; `seconds` is its time to first byte."""
+        stats = self._stats(model)
+        stats.cold_starts += 1
+        self._observe_load(stats, seconds)
+
+    @staticmethod
+    def _observe_load(stats: LoadStats, seconds: float):
+        if stats.load_seconds is None:
+            stats.load_seconds = seconds
+        else:
+            stats.load_seconds += 0.3 * (seconds - stats.load_seconds)
+
+    # --- preloading ---
+
+    def _shared_counts(self, kind: str) -> Dict[str, float]:
+        prefix = self.shared.SEP.join(("residency", kind, ""))
+        return {name[len(prefix):]: self.shared.total(name) for name in self.shared.names(prefix)}
+
+    def _request_counts(self) -> Dict[str, float]:
+        if self.shared is None:
+            chat, embed = self.requests, self.embed_requests
+        else:
+            chat, embed = self._shared_counts("requests"), self._shared_counts("embed_requests")
+        self.embedding_models.update(embed)
+        return {model: chat.get(model, 0) + embed.get(model, 0) for model in set(chat) | set(embed)}
+
+    def _sample_rates(self, now: float):
+        """Folds the requests since the last sample into each model's per-minute EWMA rate."""
+        elapsed = now - self._sampled_at
+        if elapsed <= 0:
+            return
+        self._sampled_at = now
+        alpha = 1 - math.exp(-elapsed / self.rate_window) if self.rate_window > 0 else 1.0
+        counts = self._request_counts()
+        for model in set(counts) | set(self.rates):
+            count = counts.get(model, 0.0)
+            current = (count - self._counted.get(model, count)) * 60.0 / elapsed
+            self._counted[model] = count
+            rate = self.rates.get(model, 0.0)
+            self.rates[model] = rate + alpha * (current - rate)
+
+    def _loading_on(self, host: str) -> bool:
+        task = self._loading.get(host)
+        return task is not None and not task.done()
+
+    def _ready(self, model: str, host: str, now: float) -> bool:
+        """No load running on the node, its cooldown is over, and no backoff after failed loads of the model."""
+        if self._loading_on(host) or now - self._last_load.get(host, -math.inf) < self.cooldown:
+            return False
+        return now >= self._retry_at.get((model, host), -math.inf)
+
+    def _can_load(self, model: str, host: str, rate: float, now: float) -> bool:
+        if not self._ready(model, host, now):
+            return False
+        victim = self._victim(host)
+        if victim is None:
+            return True
+        # Never swap out a model that was just loaded or used, or one requested more often
+        return not self._protected(host, victim) and self.rates.get(victim, 0.0) < rate
+
+    def tick(self):
+        """One preload round: updates rates, then starts loads and keep_alive refreshes."""
+        now = time.monotonic()
+        self._sample_rates(now)
+        if not self._leader():
+            return
+        active_router = self.router()
+        for model, rate in sorted(self.rates.items(), key=lambda item: -item[1]):
+            if rate < self.min_rate or not active_router.has_model(model):
+                continue
+            excluded = self.exclusions(model, active_router)
+            replicas = [r for r in active_router.replicas[model] if r.host not in excluded]
+            warm = [r for r in replicas if r.host in self.known and not self.is_cold(model, r.host)]
+            for replica in warm:
+                entry = self.nodes[replica.host][model]
+                if entry.expires_at - now < self.refresh_before and self._ready(model, replica.host, now):
+                    self._last_load[replica.host] = now
+                    self._start_load(model, replica.host, "refreshed")
+            # A warm replica with nothing in flight can take the next request as it is
+            if any(active_router.host_in_flight(r.backend) == 0 for r in warm):
+                continue
+            idle = [r for r in replicas if self.is_cold(model, r.host)
+                    and active_router.host_in_flight(r.backend) == 0 and self._can_load(model, r.host, rate, now)]
+            if idle:
+                target = max(idle, key=lambda r: (r.weight, -len(self._live(r.host))))
+                self._last_load[target.host] = now
+                self._start_load(model, target.host, "loaded")
+
+    def _start_load(self, model: str, host: str, kind: str):
+        self._loading_model[host] = model
+        self._loading[host] = asyncio.create_task(self._load(model, host, kind))
+
+    async def _load(self, model: str, host: str, kind: str):
+        """Loads (or keeps loaded) the model on the node: /api/generate with no prompt, /api/embed with no input."""
+        started = time.monotonic()
+        stats = self._stats(model)
+        if model in self.embedding_models:
+            path, body = "/api/embed", {"model": model, "input": [], "keep_alive": self.keep_alive}
+        else:
+            path, body = "/api/generate", {"model": model, "keep_alive": self.keep_alive, "stream": False}
+        try:
+            response = await self.upstream_pool.client(host).post(path, json=body, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (httpx.HTTPError, OSError, ValueError) as e:
+            seconds = time.monotonic() - started
+            stats.failures += 1
+            result = "failed"
+            # Backs off exponentially (up to 32 cooldowns) so a model the node cannot load is not retried every round
+            failures = self._failures[(model, host)] = self._failures.get((model, host), 0) + 1
+            retry_in = self.cooldown * 2 ** min(failures - 1, 5)
+            self._retry_at[(model, host)] = time.monotonic() + retry_in
+            logger.warning(f"Preloading '{model}' on {host} failed after {seconds:.1f}s: {type(e).__name__}: {e} "
+                           f"({failures} in a row; next attempt in {retry_in:.0f}s)")
+        else:
+            self._failures.pop((model, host), None)
+            self._retry_at.pop((model, host), None)
+            seconds = time.monotonic() - started
+            load_duration = data.get("load_duration") if isinstance(data, dict) else None
+            if isinstance(load_duration, (int, float)) and load_duration > 0:
+                seconds = load_duration / 1e9
+            self.touch(model, host, self.keep_alive_seconds)
+            result = kind
+            if kind == "loaded":
+                stats.preloads += 1
+                self._observe_load(stats, seconds)
+                logger.info(f"Preloaded '{model}' on {host} in {seconds:.1f}s (keep_alive {self.keep_alive})")
+            else:
+                stats.refreshes += 1
+        finally:
+            self._loading.pop(host, None)
+            self._loading_model.pop(host, None)
+        if self.on_load is not None:
+            self.on_load(model, host, result, seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "preload": self.preload,
+            "preloader": self.preload and self._leader(),
+            "cold_penalty": self.cold_penalty,
+            "nodes": {
+                host: {
+                    model: {
+                        "loaded_for": round(now - entry.loaded_at, 1),
+                        "idle_for": round(now - entry.last_used, 1),
+                        "expires_in": round(entry.expires_at - now, 1) if entry.expires_at != math.inf else None,
+                    }
+                    for model, entry in self._live(host).items()
+                }
+                for host in sorted(self.known)
+            },
+            "loading": dict(self._loading_model),
+            "backing_off": {
+                f"{model}@{host}": round(retry_at - now, 1)
+                for (model, host), retry_at in self._retry_at.items() if retry_at > now
+            },
+            "models": {
+                model: {
+                    "rate_per_minute": round(self.rates.get(model, 0.0), 3),
+                    "cold_starts": s.cold_starts,
+                    "preloads": s.preloads,
+                    "keep_alive_refreshes": s.refreshes,
+                    "preload_failures": s.failures,
+                    "evictions": s.evictions,
+                    "load_seconds": round(s.load_seconds, 3) if s.load_seconds is not None else None,
+                }
+                for model, s in ((m, self.models.get(m) or LoadStats()) for m in sorted(set(self.models) | set(self.rates)))
+            },
+        }
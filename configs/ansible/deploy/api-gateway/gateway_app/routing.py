@@ -0,0 +1,352 @@
+# routing.py
+import hashlib
+import json
+import logging
+import math
+import random
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("citadel-gateway")
+
+STRATEGIES = ("least_outstanding", "ewma_latency")
+# Conversations per model whose last replica is remembered for affinity accounting
+MAX_TRACKED_CONVERSATIONS = 16384
+
+
+def conversation_key(model: str, messages: Any, session: Optional[str] = None) -> Optional[str]:
+    """
+    A key that stays the same for every turn of one conversation: the session id when
+    the client sends one, otherwise the first user message (later turns only append).
+    """
+    if session:
+        return f"{model}\x00session\x00{session}"
+    if not isinstance(messages, list):
+        return None
+    for message in messages:
+        if isinstance(message, dict) and message.get("role") == "user":
+            content = json.dumps(message.get("content"), sort_keys=True, ensure_ascii=False)
+            return f"{model}\x00{hashlib.blake2b(content.encode(), digest_size=16).hexdigest()}"
+    return None
+
+
+class AffinityStats:
+    """
+    Per-model affinity outcomes, the TTFB baseline of keyed requests that could not reuse
+    a prompt cache, and the replica each recent conversation last went to (this worker's
+    requests only, least recently seen dropped first).
+    """
+    __slots__ = ("hits", "spills", "firsts", "cold_ttfb", "prefill_saved", "last_host")
+
+    def __init__(self):
+        self.hits = 0
+        self.spills = 0
+        self.firsts = 0
+        self.cold_ttfb: Optional[float] = None
+        self.prefill_saved = 0.0
+        self.last_host: "OrderedDict[str, str]" = OrderedDict()
+
+
+class Backend:
+    """Live load for one backend host, shared by every model replica it serves."""
+    __slots__ = ("host", "in_flight", "requests", "in_flight_key", "requests_key")
+
+    def __init__(self, host: str, shared: Any = None):
+        self.host = host
+        # This worker's own counts; the host-wide ones live in the shared segment
+        self.in_flight = 0
+        self.requests = 0
+        self.in_flight_key = self.requests_key = None
+        if shared is not None:
+            self.in_flight_key = shared.SEP.join(("routing", "in_flight", host))
+            self.requests_key = shared.SEP.join(("routing", "requests", host))
+
+
+class Replica:
+    """One model served by one backend host, with its routing weight and latency estimates."""
+    __slots__ = ("model", "backend", "weight", "in_flight", "requests", "ewma_latency", "ewma_duration")
+
+    def __init__(self, model: str, backend: Backend, weight: float = 1.0):
+        self.model = model
+        self.backend = backend
+        self.weight = weight if weight > 0 else 1.0
+        self.in_flight = 0
+        self.requests = 0
+        self.ewma_latency: Optional[float] = None
+        # Smoothed duration of completed generations, used to estimate work saved by cancelling
+        self.ewma_duration: Optional[float] = None
+
+    @property
+    def host(self) -> str:
+        return self.backend.host
+
+
+class ReplicaRouter:
+    """
+    Picks a backend replica for each request. `least_outstanding` prefers the host with
+    the fewest in-flight requests relative to its weight; `ewma_latency` additionally
+    scales that by the replica's smoothed time-to-first-byte.
+
+    With `shared` (a shared_state.SharedState), host load is the in-flight count of
+    every gateway worker on this machine, not just this one.
+
+    With `affinity_load_factor` > 0, requests that carry a conversation key go to the
+    replica that key hashes to (weighted rendezvous hashing), so later turns reuse the
+    prompt prefix the node already processed. Consistent hashing with bounded loads:
+    a replica only takes the request while its load stays within `affinity_load_factor`
+    times its weighted share of the total; otherwise the next replica in the key's
+    ranking is tried, and the normal strategy decides if none qualifies.
+
+    With `residency` (a residency.ModelResidency), a replica whose node does not have the
+    model loaded counts `residency.penalty()` extra requests of load, and conversations
+    stick to the warm replicas when there are any.
+    """
+    def __init__(self, model_replicas: Dict[str, List[Dict[str, Any]]],
+                 strategy: str = "least_outstanding", ewma_alpha: float = 0.3,
+                 previous: Optional["ReplicaRouter"] = None, shared: Any = None,
+                 affinity_load_factor: float = 0.0, residency: Any = None):
+        if strategy not in STRATEGIES:
+            logger.warning(f"Unknown routing strategy '{strategy}', using 'least_outstanding'.")
+            strategy = "least_outstanding"
+        self.strategy = strategy
+        self.ewma_alpha = ewma_alpha
+        self.shared = shared if shared is not None or previous is None else previous.shared
+        self.affinity_load_factor = affinity_load_factor
+        self.residency = residency if residency is not None or previous is None else previous.residency
+        self.affinity: Dict[str, AffinityStats] = dict(previous.affinity) if previous else {}
+        # On a config reload, keep the live Backend objects so in-flight counts from
+        # requests still running on the old table carry over to the new one
+        self.backends: Dict[str, Backend] = dict(previous.backends) if previous else {}
+        self.replicas: Dict[str, List[Replica]] = {}
+        for model, entries in model_replicas.items():
+            self.replicas[model] = [
+                Replica(model, self._backend(e["host"]), float(e.get("weight", 1)))
+                for e in entries
+            ]
+        # Models from model_map; anything else in self.replicas was added by discovery
+        self.configured = set(self.replicas)
+        if previous:
+            self._carry_over(previous)
+
+    def _carry_over(self, previous: "ReplicaRouter"):
+        """Copies latency estimates and request counts for replicas that still exist."""
+        old = {(r.model, r.host): r for replicas in previous.replicas.values() for r in replicas}
+        for replicas in self.replicas.values():
+            for replica in replicas:
+                prior = old.get((replica.model, replica.host))
+                if prior is not None:
+                    replica.ewma_latency = prior.ewma_latency
+                    replica.ewma_duration = prior.ewma_duration
+                    replica.requests = prior.requests
+
+    def _backend(self, host: str) -> Backend:
+        backend = self.backends.get(host)
+        if backend is None:
+            backend = self.backends[host] = Backend(host, self.shared)
+        return backend
+
+    def set_discovered(self, model_hosts: Dict[str, List[str]]):
+        """
+        Adds weight-1 replicas for models that live discovery found on the nodes but that
+        are not in model_map, replacing the previously discovered set. Mapped models keep
+        their configured replicas.
+        """
+        replicas = {model: r for model, r in self.replicas.items() if model in self.configured}
+        for model, hosts in model_hosts.items():
+            if model in self.configured or not hosts:
+                continue
+            existing = {r.host: r for r in self.replicas.get(model, ())}
+            replicas[model] = [existing.get(host) or Replica(model, self._backend(host)) for host in hosts]
+        self.replicas = replicas
+
+    def has_model(self, model: str) -> bool:
+        return bool(self.replicas.get(model))
+
+    def models(self) -> List[str]:
+        return list(self.replicas.keys())
+
+    def host_in_flight(self, backend: Backend) -> float:
+        """In-flight requests on the backend from all workers (this one only without shared state)."""
+        if backend.in_flight_key is None:
+            return backend.in_flight
+        return self.shared.total(backend.in_flight_key)
+
+    def _score(self, replica: Replica) -> float:
+        penalty = self.residency.penalty(replica.model, replica.host) if self.residency is not None else 0.0
+        load = (self.host_in_flight(replica.backend) + 1 + penalty) / replica.weight
+        if self.strategy == "ewma_latency":
+            latency = replica.ewma_latency
+            if latency is None and penalty:
+                # A cold replica is not tried for free; rate it like the slowest sampled one
+                latency = max((r.ewma_latency for r in self.replicas.get(replica.model, ())
+                               if r.ewma_latency is not None), default=0.0)
+            # Replicas without a latency sample yet score 0 so they get tried
+            return load * (latency or 0.0)
+        return load
+
+    @staticmethod
+    def _rank(key: str, replicas: List[Replica]) -> List[Replica]:
+        """Replicas in the key's rendezvous order: stable per key, weighted, minimal reshuffling."""
+        def score(replica: Replica) -> float:
+            digest = hashlib.blake2b(f"{key}\x00{replica.host}".encode(), digest_size=8).digest()
+            # Uniform in (0, 1); -w / ln(u) gives each replica a share proportional to its weight
+            u = (int.from_bytes(digest, "big") + 0.5) / 2 ** 64
+            return -replica.weight / math.log(u)
+        return sorted(replicas, key=score, reverse=True)
+
+    def affinity_host(self, model: str, key: Optional[str]) -> Optional[str]:
+        """The host a conversation key prefers among all of the model's replicas."""
+        replicas = self.replicas.get(model)
+        # With a single replica there is no choice to make, so nothing to count
+        if not key or not replicas or len(replicas) < 2 or not self.affinity_load_factor:
+            return None
+        return self._rank(key, replicas)[0].host
+
+    def _bounded_affinity(self, key: str, candidates: List[Replica]) -> Optional[Replica]:
+        loads = {r.host: self.host_in_flight(r.backend) for r in candidates}
+        total = sum(loads.values()) + 1
+        total_weight = sum(r.weight for r in candidates)
+        for replica in self._rank(key, candidates):
+            capacity = math.ceil(self.affinity_load_factor * total * replica.weight / total_weight)
+            if loads[replica.host] + 1 <= capacity:
+                return replica
+        return None
+
+    def select(self, model: str, exclude: Iterable[str] = (), affinity_key: Optional[str] = None) -> Optional[Replica]:
+        """
+        Returns the best replica for a model, skipping excluded hosts, or None. With an
+        affinity key (and affinity enabled) the key's replica is preferred within the load bound.
+        """
+        candidates = [r for r in self.replicas.get(model, ()) if r.host not in exclude]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        if affinity_key and self.affinity_load_factor:
+            pool = candidates
+            if self.residency is not None:
+                # Only a warm replica keeps a conversation; a cold one has to win on score below
+                pool = [r for r in candidates if not self.residency.is_cold(model, r.host)] or candidates
+            replica = self._bounded_affinity(affinity_key, pool)
+            if replica is not None:
+                return replica
+        scores = [self._score(r) for r in candidates]
+        best = min(scores)
+        # Break ties randomly so equal replicas share the load
+        return random.choice([r for r, score in zip(candidates, scores) if score == best])
+
+    def acquire(self, replica: Replica):
+        """Marks a request as in flight on the replica and its backend host."""
+        replica.in_flight += 1
+        replica.requests += 1
+        replica.backend.in_flight += 1
+        replica.backend.requests += 1
+        if replica.backend.in_flight_key is not None:
+            self.shared.add(replica.backend.in_flight_key, 1, self.shared.GAUGE)
+            self.shared.add(replica.backend.requests_key, 1)
+
+    def release(self, replica: Replica):
+        """Marks a request on the replica as finished."""
+        replica.in_flight -= 1
+        replica.backend.in_flight -= 1
+        if replica.backend.in_flight_key is not None:
+            self.shared.add(replica.backend.in_flight_key, -1, self.shared.GAUGE)
+
+    def observe_latency(self, replica: Replica, seconds: float):
+        """Folds a time-to-first-byte sample into the replica's EWMA latency."""
+        if replica.ewma_latency is None:
+            replica.ewma_latency = seconds
+        else:
+            replica.ewma_latency += self.ewma_alpha * (seconds - replica.ewma_latency)
+
+    def observe_affinity(self, replica: Replica, key: str, ttfb: float) -> Tuple[str, float]:
+        """
+        Records where a request with a conversation key landed and returns (outcome,
+        estimated prefill seconds saved). "hit": the key's previous turn went to this
+        replica, so its prompt prefix can be reused; "spill": it went elsewhere; "first":
+        no earlier turn is known. The saving of a hit is the model's TTFB for spills and
+        first turns minus this one's.
+        """
+        stats = self.affinity.get(replica.model)
+        if stats is None:
+            stats = self.affinity[replica.model] = AffinityStats()
+        previous = stats.last_host.pop(key, None)
+        stats.last_host[key] = replica.host
+        if len(stats.last_host) > MAX_TRACKED_CONVERSATIONS:
+            stats.last_host.popitem(last=False)
+        if previous == replica.host:
+            stats.hits += 1
+            saved = max(0.0, stats.cold_ttfb - ttfb) if stats.cold_ttfb is not None else 0.0
+            stats.prefill_saved += saved
+            return "hit", saved
+        if previous is None:
+            stats.firsts += 1
+            outcome = "first"
+        else:
+            stats.spills += 1
+            outcome = "spill"
+        if stats.cold_ttfb is None:
+            stats.cold_ttfb = ttfb
+        else:
+            stats.cold_ttfb += self.ewma_alpha * (ttfb - stats.cold_ttfb)
+        return outcome, 0.0
+
+    def observe_duration(self, replica: Replica, seconds: float):
+        """Folds a completed stream's duration into the replica's EWMA duration."""
+        if replica.ewma_duration is None:
+            replica.ewma_duration = seconds
+        else:
+            replica.ewma_duration += self.ewma_alpha * (seconds - replica.ewma_duration)
+
+    def remaining_seconds(self, replica: Replica, elapsed: float) -> float:
+        """Estimated generation time left for a request that has run `elapsed` seconds (0 if unknown)."""
+        if replica.ewma_duration is None:
+            return 0.0
+        return max(0.0, replica.ewma_duration - elapsed)
+
+    def _backend_stats(self, backend: Backend) -> Dict[str, Any]:
+        if backend.in_flight_key is None:
+            return {"in_flight": backend.in_flight, "requests": backend.requests}
+        return {
+            "in_flight": int(self.shared.total(backend.in_flight_key)),
+            "requests": int(self.shared.total(backend.requests_key)),
+            "worker_in_flight": backend.in_flight,
+            "worker_requests": backend.requests,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Returns in-flight counters and latency estimates per backend and replica."""
+        return {
+            "strategy": self.strategy,
+            "shared": self.shared is not None,
+            "residency": self.residency is not None,
+            "affinity": {
+                "load_factor": self.affinity_load_factor or None,
+                "models": {
+                    model: {
+                        "hits": a.hits,
+                        "spills": a.spills,
+                        "first_turns": a.firsts,
+                        "hit_rate": round(a.hits / (a.hits + a.spills), 4) if a.hits + a.spills else None,
+                        "cold_ttfb": round(a.cold_ttfb, 4) if a.cold_ttfb is not None else None,
+                        "prefill_saved_seconds": round(a.prefill_saved, 3),
+                    }
+                    for model, a in self.affinity.items()
+                },
+            },
+            "backends": {host: self._backend_stats(b) for host, b in self.backends.items()},
+            "models": {
+                model: [
+                    {
+                        "host": r.host,
+                        "weight": r.weight,
+                        "in_flight": r.in_flight,
+                        "requests": r.requests,
+                        "ewma_latency": round(r.ewma_latency, 4) if r.ewma_latency is not None else None,
+                        "ewma_duration": round(r.ewma_duration, 4) if r.ewma_duration is not None else None,
+                    }
+                    for r in replicas
+                ]
+                for model, replicas in self.replicas.items()
+            },
+        }
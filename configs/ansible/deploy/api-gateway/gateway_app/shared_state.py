@@ -0,0 +1,411 @@
+# shared_state.py
+import asyncio
+import fcntl
+import glob
+import logging
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("citadel-gateway")
+
+# Segment file layout:
+#   header:  magic, version, max_workers, max_keys, key_count (padded to 64 bytes)
+#   workers: max_workers x (pid, start time); pid 0 marks a free slot
+#   keys:    max_keys x (kind, length, utf-8 name); append-only, published by bumping key_count
+#   values:  max_keys x max_workers float64; one row per key, one column per worker
+# Every worker writes only its own column, so updates are plain stores with no atomics
+# and no lock; a reader sums the row. The flock is taken only to allocate keys, to claim
+# or reap worker slots, and by callers that need check-then-act across workers.
+# The file name carries the version and sizes (state.bin -> state.v1-16x16384.bin), so a
+# layout change opens a new file and never resizes one that running workers have mapped.
+MAGIC = b"CGSS"
+VERSION = 1
+HEADER = struct.Struct("<4sIIII")
+KEY_COUNT_OFFSET = 16
+HEADER_SIZE = 64
+WORKER = struct.Struct("<qd")
+KEY_SLOT = 256
+KEY_HEADER = struct.Struct("<BH")
+MAX_NAME = KEY_SLOT - KEY_HEADER.size
+
+COUNTER = 1
+GAUGE = 2
+# Separates a key's parts, e.g. metric name and label values
+SEP = "\x1f"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedState:
+    """
+    Named float counters and gauges in a memory-mapped file shared by all gateway
+    workers on the host. add()/set() touch only this worker's column; total() sums
+    the columns, so every worker sees host-wide values without any IPC round trip.
+    Gauges of a worker that exits (or dies) are zeroed; counters keep their value so
+    host-wide totals never go backwards. The segment is mapped by start(); until then,
+    or if it cannot be opened, every value stays local to this worker.
+    """
+    # Re-exported so callers that cannot import this module by name (routing.py is also
+    # loaded as gateway_app.routing) can build keys from the instance they are given
+    COUNTER = COUNTER
+    GAUGE = GAUGE
+    SEP = SEP
+
+    def __init__(self, path: str, max_workers: int = 16, max_keys: int = 16384, reap_interval: float = 10.0):
+        self.max_workers = max(1, max_workers)
+        self.max_keys = max(1, max_keys)
+        self.path = self.layout_path(path, self.max_workers, self.max_keys)
+        self.reap_interval = reap_interval
+        self._workers_offset = HEADER_SIZE
+        self._keys_offset = self._workers_offset + self.max_workers * WORKER.size
+        self._values_offset = self._keys_offset + self.max_keys * KEY_SLOT
+        self._size = self._values_offset + self.max_keys * self.max_workers * 8
+        self._configured_path = path
+        self._slots: Dict[str, int] = {}
+        self._kinds: List[int] = []
+        self._names: List[str] = []
+        self._prefix_cache: Dict[str, Tuple[int, List[str]]] = {}
+        self._overflow: Dict[str, float] = {}
+        self._overflow_kinds: Dict[str, int] = {}
+        # Keys that found the key space full. Counted, not logged here: add() is reached from
+        # the log queue's drop hook, and logging from it could drop (and land here) again.
+        self.rejected_keys = 0
+        self._full_reported = False
+        self._task: Optional[asyncio.Task] = None
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        self.worker: Optional[int] = None
+
+    def open(self):
+        """Maps the segment (creating it if needed) and claims a worker slot."""
+        size = self._size
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            self._fd = os.open(self.path, os.O_RDWR)
+        except FileNotFoundError:
+            self._create(self._configured_path, size)
+            self._fd = os.open(self.path, os.O_RDWR)
+        try:
+            with self.locked():
+                header = os.pread(self._fd, HEADER.size, 0)
+                if len(header) < HEADER.size or HEADER.unpack(header)[:4] != (MAGIC, VERSION, self.max_workers,
+                                                                              self.max_keys) \
+                        or os.fstat(self._fd).st_size != size:
+                    # Workers may have it mapped, so it is never resized or rewritten in place
+                    raise OSError(f"{self.path} is not a shared state segment of this layout; "
+                                  f"remove it once no gateway worker is running")
+                self._map = mmap.mmap(self._fd, size)
+                self._values = memoryview(self._map)[self._values_offset:].cast("d")
+                self._refresh()
+                self._reap_locked()
+                self.worker = self._claim_locked()
+        except BaseException:
+            self._detach()
+            raise
+        if self.worker is not None:
+            self._fold_overflow()
+        if self.worker is None:
+            logger.error(f"Shared state: all {self.max_workers} worker slots are taken; "
+                         f"this worker's updates stay local. Raise shared_state.max_workers.")
+        else:
+            logger.info(f"Shared state: worker {os.getpid()} uses slot {self.worker} of {self.path}")
+
+    def _create(self, path: str, size: int):
+        """
+        Writes a new segment under a temporary name and links it into place, so the file
+        at self.path is always complete. Another worker may publish first; its file wins.
+        """
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(temporary, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            os.pwrite(fd, HEADER.pack(MAGIC, VERSION, self.max_workers, self.max_keys, 0), 0)
+            os.link(temporary, self.path)
+        except FileExistsError:
+            return
+        finally:
+            os.close(fd)
+            os.unlink(temporary)
+        logger.info(f"Initialized shared state segment at {self.path} ({size} bytes, "
+                    f"{self.max_workers} workers x {self.max_keys} keys)")
+        self._remove_other_layouts(path)
+
+    def _fold_overflow(self):
+        """Moves values recorded before the segment was mapped into this worker's column."""
+        for name, value in list(self._overflow.items()):
+            kind = self._overflow_kinds.get(name, COUNTER)
+            index = self._slot(name, kind)
+            if index is None:
+                continue
+            position = index * self.max_workers + self.worker
+            self._values[position] = self._values[position] + value if kind == COUNTER else value
+            del self._overflow[name]
+            self._overflow_kinds.pop(name, None)
+
+    @staticmethod
+    def layout_path(path: str, max_workers: int, max_keys: int) -> str:
+        """The segment file for this version and these sizes, next to the configured `path`."""
+        root, extension = os.path.splitext(path)
+        return f"{root}.v{VERSION}-{max_workers}x{max_keys}{extension}"
+
+    def _remove_other_layouts(self, path: str):
+        # Workers still using an old layout keep their mapping; the memory is freed when they exit
+        root, extension = os.path.splitext(path)
+        for stale in glob.glob(f"{glob.escape(root)}.v*-*x*{glob.escape(extension)}") + [path]:
+            if stale != self.path and os.path.isfile(stale):
+                try:
+                    os.unlink(stale)
+                    logger.info(f"Removed shared state segment {stale} of an older layout")
+                except OSError:
+                    pass
+
+    @contextmanager
+    def locked(self):
+        """Exclusive lock across all workers, for allocation and check-then-act updates."""
+        if self._fd is None:
+            # Not attached: there is no other worker to exclude
+            yield
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # --- worker slots ---
+
+    def _worker_position(self, slot: int) -> int:
+        return self._workers_offset + slot * WORKER.size
+
+    def _claim_locked(self) -> Optional[int]:
+        for slot in range(self.max_workers):
+            pid, _ = WORKER.unpack_from(self._map, self._worker_position(slot))
+            if pid == 0:
+                WORKER.pack_into(self._map, self._worker_position(slot), os.getpid(), time.time())
+                self._zero_gauges(slot)
+                return slot
+        return None
+
+    def _zero_gauges(self, slot: int):
+        for index, kind in enumerate(self._kinds):
+            if kind == GAUGE:
+                self._values[index * self.max_workers + slot] = 0.0
+
+    def _reap_locked(self) -> int:
+        reaped = 0
+        for slot in range(self.max_workers):
+            pid, _ = WORKER.unpack_from(self._map, self._worker_position(slot))
+            if pid and pid != os.getpid() and not _alive(pid):
+                self._zero_gauges(slot)
+                WORKER.pack_into(self._map, self._worker_position(slot), 0, 0.0)
+                reaped += 1
+        return reaped
+
+    def reap(self) -> int:
+        """Frees the slots of workers that died without closing; returns how many."""
+        if self._map is None:
+            return 0
+        with self.locked():
+            self._refresh()
+            reaped = self._reap_locked()
+        if reaped:
+            logger.warning(f"Shared state: reclaimed {reaped} slot(s) from exited workers")
+        return reaped
+
+    def workers(self) -> List[int]:
+        if self._map is None:
+            return []
+        pids = []
+        for slot in range(self.max_workers):
+            pid, _ = WORKER.unpack_from(self._map, self._worker_position(slot))
+            if pid:
+                pids.append(pid)
+        return pids
+
+    # --- keys ---
+
+    def _refresh(self):
+        """Picks up keys allocated by other workers since the last look."""
+        if self._map is None:
+            return
+        count = struct.unpack_from("<I", self._map, KEY_COUNT_OFFSET)[0]
+        for index in range(len(self._names), count):
+            position = self._keys_offset + index * KEY_SLOT
+            kind, length = KEY_HEADER.unpack_from(self._map, position)
+            name = bytes(self._map[position + KEY_HEADER.size:position + KEY_HEADER.size + length]).decode()
+            self._names.append(name)
+            self._kinds.append(kind)
+            self._slots[name] = index
+
+    def _slot(self, name: str, kind: int, create: bool = True) -> Optional[int]:
+        index = self._slots.get(name)
+        if index is not None:
+            return index
+        if self._map is None:
+            return None
+        self._refresh()
+        index = self._slots.get(name)
+        if index is not None or not create:
+            return index
+        encoded = name.encode()
+        if len(encoded) > MAX_NAME:
+            return None
+        with self.locked():
+            self._refresh()
+            index = self._slots.get(name)
+            if index is not None:
+                return index
+            count = len(self._names)
+            if count >= self.max_keys:
+                self.rejected_keys += 1
+                return None
+            position = self._keys_offset + count * KEY_SLOT
+            KEY_HEADER.pack_into(self._map, position, kind, len(encoded))
+            self._map[position + KEY_HEADER.size:position + KEY_HEADER.size + len(encoded)] = encoded
+            # Publish the key only after its slot is fully written
+            struct.pack_into("<I", self._map, KEY_COUNT_OFFSET, count + 1)
+            self._refresh()
+            return count
+
+    def names(self, prefix: str) -> List[str]:
+        """Key names starting with `prefix`; cached until another key is allocated."""
+        self._refresh()
+        cached = self._prefix_cache.get(prefix)
+        if cached is not None and cached[0] == len(self._names):
+            return cached[1]
+        matching = [name for name in self._names if name.startswith(prefix)]
+        matching += [name for name in self._overflow if name.startswith(prefix) and name not in self._slots]
+        self._prefix_cache[prefix] = (len(self._names), matching)
+        return matching
+
+    # --- values ---
+
+    def add(self, name: str, amount: float = 1.0, kind: int = COUNTER):
+        index = self._slot(name, kind)
+        if index is None or self.worker is None:
+            self._overflow[name] = self._overflow.get(name, 0.0) + amount
+            self._overflow_kinds[name] = kind
+            return
+        self._values[index * self.max_workers + self.worker] += amount
+
+    def set(self, name: str, value: float, kind: int = GAUGE):
+        index = self._slot(name, kind)
+        if index is None or self.worker is None:
+            self._overflow[name] = float(value)
+            self._overflow_kinds[name] = kind
+            return
+        self._values[index * self.max_workers + self.worker] = float(value)
+
+    def local(self, name: str) -> float:
+        """This worker's own contribution."""
+        index = self._slot(name, COUNTER, create=False)
+        if index is None or self.worker is None:
+            return self._overflow.get(name, 0.0)
+        return self._values[index * self.max_workers + self.worker]
+
+    def total(self, name: str) -> float:
+        """Sum over all workers on the host."""
+        index = self._slot(name, COUNTER, create=False)
+        extra = self._overflow.get(name, 0.0) if self._overflow else 0.0
+        if index is None:
+            return extra
+        start = index * self.max_workers
+        return sum(self._values[start:start + self.max_workers]) + extra
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        """(name, host-wide total) for every key."""
+        self._refresh()
+        width = self.max_workers
+        for index, name in enumerate(self._names):
+            yield name, sum(self._values[index * width:(index + 1) * width]) + self._overflow.get(name, 0.0)
+        for name, value in self._overflow.items():
+            if name not in self._slots:
+                yield name, value
+
+    # --- lifecycle ---
+
+    async def start(self):
+        if self._map is None:
+            try:
+                self.open()
+            except OSError as e:
+                logger.error(f"Shared state unavailable, could not open {self.path}: {e}; "
+                             f"routing load, admission slots and metrics stay per worker")
+                return
+        if self._task is None and self.reap_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            try:
+                self.reap()
+            except OSError as e:
+                logger.error(f"Shared state reap failed: {e}")
+            if self.rejected_keys and not self._full_reported:
+                self._full_reported = True
+                logger.error(f"Shared state is full ({self.max_keys} keys); new series stay per worker. "
+                             f"Raise shared_state.max_keys.")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.close()
+
+    def close(self):
+        """Gives up this worker's slot; its gauges drop to zero, its counters stay."""
+        if self._map is None:
+            return
+        if self.worker is not None:
+            with self.locked():
+                self._refresh()
+                self._zero_gauges(self.worker)
+                WORKER.pack_into(self._map, self._worker_position(self.worker), 0, 0.0)
+            self.worker = None
+        self._detach()
+
+    def _detach(self):
+        if self._map is not None:
+            self._values.release()
+            self._map.close()
+            self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._slots.clear()
+        self._kinds.clear()
+        self._names.clear()
+        self._prefix_cache.clear()
+
+    def stats(self) -> Dict[str, object]:
+        self._refresh()
+        return {
+            "path": self.path,
+            "attached": self._map is not None,
+            "worker_slot": self.worker,
+            "workers": self.workers(),
+            "max_workers": self.max_workers,
+            "keys": len(self._names),
+            "max_keys": self.max_keys,
+            "overflow_keys": len(self._overflow),
+            "rejected_keys": self.rejected_keys,
+        }
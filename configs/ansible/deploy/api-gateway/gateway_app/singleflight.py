@@ -0,0 +1,119 @@
+# singleflight.py
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("citadel-gateway")
+
+
+class Flight:
+    """
+    One upstream call whose output is shared by every identical request. Chunks are
+    buffered so late joiners first replay the prefix and then follow the live stream.
+    The call is cancelled when its last subscriber goes away before it finishes.
+    """
+    def __init__(self, key: str):
+        self.key = key
+        self.started = time.monotonic()
+        self.chunks: List[bytes] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.abandoned = False
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def run(self, source: AsyncIterator[bytes]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            logger.error(f"Coalesced upstream call failed: {e}")
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[bytes]:
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                # Nobody is reading any more: stop the backend generating for no one
+                self.abandoned = True
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight chat requests. The first request for a key starts
+    the upstream call in its own task; identical requests arriving within `window`
+    seconds subscribe to it instead of hitting the backend again.
+    """
+    def __init__(self, window: float = 30.0, models: Optional[Iterable[str]] = None):
+        self.window = window
+        self.models = set(models) if models else None
+        self._flights: Dict[str, Flight] = {}
+        self._tasks = set()
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    def eligible(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def _joinable(self, key: str) -> Optional[Flight]:
+        flight = self._flights.get(key)
+        if flight is None or flight.done or time.monotonic() - flight.started > self.window:
+            return None
+        return flight
+
+    def joinable(self, key: str) -> bool:
+        """True if a request for `key` would join an in-flight call right now."""
+        return self._joinable(key) is not None
+
+    async def stream(self, key: str, source_factory: Callable[[], AsyncIterator[bytes]]) -> AsyncIterator[bytes]:
+        """Yields the response for `key`, joining an in-flight call when one exists."""
+        flight = self._joinable(key)
+        if flight is not None:
+            self.coalesced += 1
+        else:
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.leaders += 1
+            task = flight.task = asyncio.create_task(flight.run(source_factory()))
+            self._tasks.add(task)
+            task.add_done_callback(lambda t, k=key, f=flight: self._finished(t, k, f))
+
+        async for chunk in flight.subscribe():
+            yield chunk
+
+    def _finished(self, task: asyncio.Task, key: str, flight: Flight):
+        self._tasks.discard(task)
+        if flight.abandoned:
+            self.abandoned += 1
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "window": self.window,
+            "models": sorted(self.models) if self.models is not None else "all",
+        }
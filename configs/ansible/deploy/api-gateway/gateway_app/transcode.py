@@ -0,0 +1,325 @@
+# transcode.py
+import json
+import time
+from datetime import datetime, timezone
+from json.decoder import scanstring
+from typing import Any, AsyncIterator, Dict, Optional
+
+# Streaming converters between the two chat APIs the gateway serves:
+#   OpenAI  /v1/chat/completions -> Server-Sent Events ("data: {...}\n\n", ends with "data: [DONE]")
+#   Ollama  /api/chat            -> newline-delimited JSON ("{...}\n", last object has "done": true)
+# Each converter is fed upstream chunks as they arrive and returns whatever complete
+# output is ready, so nothing is buffered beyond one partial line. Output objects are
+# assembled from pre-encoded byte prefixes. Plain token chunks take a fast path that
+# copies the content's JSON string literal as-is instead of parsing the whole event;
+# anything else (final chunks, usage, tool calls, errors) is parsed in full.
+
+_dumps = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_CONTENT_KEY = '"content":'
+
+
+def _content_literal(text: str) -> Optional[str]:
+    """The raw JSON string literal of the first "content" value, or None if it is not a string."""
+    start = text.find(_CONTENT_KEY)
+    if start < 0:
+        return None
+    start += len(_CONTENT_KEY)
+    while text[start:start + 1] == " ":
+        start += 1
+    if text[start:start + 1] != '"':
+        return None
+    try:
+        _, end = scanstring(text, start + 1)
+    except ValueError:
+        return None
+    return text[start:end]
+
+
+def _fast_path(text: str, marker: str) -> bool:
+    return (marker in text and '"error"' not in text and '"tool_calls"' not in text
+            and '"usage"' not in text)
+
+
+def _created_at() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class _LineSplitter:
+    """Splits a byte stream into complete lines, keeping only the unfinished tail."""
+    __slots__ = ("_partial",)
+
+    def __init__(self):
+        self._partial = b""
+
+    def split(self, chunk: bytes):
+        if self._partial:
+            chunk = self._partial + chunk
+        lines = chunk.split(b"\n")
+        self._partial = lines.pop()
+        return lines
+
+    def rest(self) -> bytes:
+        rest, self._partial = self._partial, b""
+        return rest
+
+    @property
+    def pending(self) -> bool:
+        return bool(self._partial)
+
+
+class SSEToNDJSON:
+    """OpenAI chat.completion.chunk SSE stream -> Ollama /api/chat NDJSON stream."""
+    def __init__(self, model: str):
+        self._lines = _LineSplitter()
+        self._prefix = (
+            b'{"model":' + _dumps(model).encode() + b',"created_at":"' + _created_at().encode()
+            + b'","message":{"role":"assistant","content":'
+        )
+        self._model = model
+        self._done = False
+        self._usage: Optional[Dict[str, Any]] = None
+        self._finish_reason = "stop"
+
+    def feed(self, chunk: bytes) -> bytes:
+        out = []
+        for line in self._lines.split(chunk):
+            converted = self._convert(line)
+            if converted:
+                out.append(converted)
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        out = self._convert(self._lines.rest())
+        if not self._done:
+            out += self._final()
+        return out
+
+    def _convert(self, line: bytes) -> bytes:
+        line = line.strip()
+        if not line.startswith(b"data:"):
+            return b""
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return self._final()
+        text = data.decode("utf-8", "replace")
+        # A plain token chunk: exactly one choice, still generating
+        if _fast_path(text, '"finish_reason":null') and text.count('"index"') == 1:
+            literal = _content_literal(text)
+            if literal is not None:
+                return self._prefix + literal.encode() + b'},"done":false}\n' if literal != '""' else b""
+        try:
+            event = json.loads(text)
+        except ValueError:
+            return b""
+        if "error" in event:
+            return b'{"error":' + _dumps(str(event["error"])).encode() + b"}\n"
+        if event.get("usage"):
+            self._usage = event["usage"]
+        out = b""
+        for choice in event.get("choices") or ():
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                out += self._prefix + _dumps(content).encode() + b'},"done":false}\n'
+            if choice.get("finish_reason"):
+                self._finish_reason = choice["finish_reason"]
+        return out
+
+    def _final(self) -> bytes:
+        if self._done:
+            return b""
+        self._done = True
+        final: Dict[str, Any] = {
+            "model": self._model,
+            "created_at": _created_at(),
+            "message": {"role": "assistant", "content": ""},
+            "done_reason": self._finish_reason,
+            "done": True,
+        }
+        if self._usage:
+            final["prompt_eval_count"] = self._usage.get("prompt_tokens", 0)
+            final["eval_count"] = self._usage.get("completion_tokens", 0)
+        return _dumps(final).encode() + b"\n"
+
+
+class NDJSONToSSE:
+    """Ollama /api/chat NDJSON stream -> OpenAI chat.completion.chunk SSE stream."""
+    def __init__(self, model: str, completion_id: Optional[str] = None):
+        self._lines = _LineSplitter()
+        self._model = model
+        self._created = int(time.time())
+        self._id = completion_id or f"chatcmpl-{time.time_ns():x}"
+        self._prefix = (
+            b'data: {"id":' + _dumps(self._id).encode() + b',"object":"chat.completion.chunk","created":'
+            + str(self._created).encode() + b',"model":' + _dumps(model).encode()
+            + b',"choices":[{"index":0,"delta":{'
+        )
+        self._sent_role = False
+        self._done = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        out = []
+        for line in self._lines.split(chunk):
+            converted = self._convert(line)
+            if converted:
+                out.append(converted)
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        out = self._convert(self._lines.rest())
+        if not self._done:
+            out += b"data: [DONE]\n\n"
+        return out
+
+    def _convert(self, line: bytes) -> bytes:
+        line = line.strip()
+        if not line.startswith(b"{"):
+            return b""
+        text = line.decode("utf-8", "replace")
+        if _fast_path(text, '"done":false'):
+            literal = _content_literal(text)
+            if literal is not None:
+                if literal == '""':
+                    return b""
+                role = b"" if self._sent_role else b'"role":"assistant",'
+                self._sent_role = True
+                return self._prefix + role + b'"content":' + literal.encode() + b'},"finish_reason":null}]}\n\n'
+        try:
+            event = json.loads(text)
+        except ValueError:
+            return b""
+        if "error" in event:
+            return b'data: {"error":' + _dumps(str(event["error"])).encode() + b"}\n\n"
+        out = b""
+        content = (event.get("message") or {}).get("content")
+        if content:
+            role = b"" if self._sent_role else b'"role":"assistant",'
+            self._sent_role = True
+            out += self._prefix + role + b'"content":' + _dumps(content).encode() + b'},"finish_reason":null}]}\n\n'
+        if event.get("done"):
+            self._done = True
+            finish = _dumps(event.get("done_reason") or "stop").encode()
+            out += self._prefix + b'},"finish_reason":' + finish + b"}]"
+            if "eval_count" in event:
+                prompt_tokens = int(event.get("prompt_eval_count", 0))
+                completion_tokens = int(event["eval_count"])
+                out += (b',"usage":' + _dumps({
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }).encode())
+            out += b"}\n\ndata: [DONE]\n\n"
+        return out
+
+
+class UsageChunkFilter:
+    """
+    Drops the usage-only event ("choices": [] plus "usage") from an OpenAI SSE stream, for
+    clients that did not ask for it. Chunks without a "usage" key pass through untouched.
+    """
+    def __init__(self):
+        self._lines = _LineSplitter()
+        self._dropped = False
+
+    def feed(self, chunk: bytes) -> bytes:
+        # Whole lines with no usage in them: nothing to look at
+        if b'"usage"' not in chunk and chunk.endswith(b"\n") and not self._lines.pending and not self._dropped:
+            return chunk
+        out = []
+        for line in self._lines.split(chunk):
+            if self._keep(line):
+                out.append(line + b"\n")
+        return b"".join(out)
+
+    def close(self) -> bytes:
+        rest = self._lines.rest()
+        return rest if self._keep(rest) else b""
+
+    def _keep(self, line: bytes) -> bool:
+        if self._dropped:
+            # The blank line that ended the dropped event
+            self._dropped = False
+            if not line.strip():
+                return False
+        if b'"usage"' not in line or not line.startswith(b"data:"):
+            return True
+        try:
+            event = json.loads(line[5:])
+        except ValueError:
+            return True
+        if event.get("choices") or "usage" not in event:
+            return True
+        self._dropped = True
+        return False
+
+
+def openai_to_ollama_response(body: bytes, model: str) -> bytes:
+    """Non-streaming chat.completion JSON -> one Ollama /api/chat response object."""
+    # Gateway errors are emitted as a single SSE event even for non-streaming requests
+    if body.startswith(b"data:"):
+        body = body[5:].strip()
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if "error" in data or not data.get("choices"):
+        return body
+    choice = data["choices"][0]
+    response: Dict[str, Any] = {
+        "model": data.get("model", model),
+        "created_at": _created_at(),
+        "message": choice.get("message") or {"role": "assistant", "content": ""},
+        "done_reason": choice.get("finish_reason") or "stop",
+        "done": True,
+    }
+    usage = data.get("usage") or {}
+    if usage:
+        response["prompt_eval_count"] = usage.get("prompt_tokens", 0)
+        response["eval_count"] = usage.get("completion_tokens", 0)
+    return _dumps(response).encode()
+
+
+def ollama_to_openai_response(body: bytes, model: str) -> bytes:
+    """Non-streaming Ollama /api/chat object -> OpenAI chat.completion JSON."""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return body
+    if "error" in data or "message" not in data:
+        return body
+    prompt_tokens = int(data.get("prompt_eval_count", 0))
+    completion_tokens = int(data.get("eval_count", 0))
+    return _dumps({
+        "id": f"chatcmpl-{time.time_ns():x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": data.get("model", model),
+        "choices": [{
+            "index": 0,
+            "message": data["message"],
+            "finish_reason": data.get("done_reason") or "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }).encode()
+
+
+async def transcode_stream(source: AsyncIterator[bytes], transcoder) -> AsyncIterator[bytes]:
+    """Runs a streaming converter over an async byte stream, chunk by chunk."""
+    async for chunk in source:
+        out = transcoder.feed(chunk)
+        if out:
+            yield out
+    tail = transcoder.close()
+    if tail:
+        yield tail
+
+
+async def transcode_body(source: AsyncIterator[bytes], convert, model: str) -> AsyncIterator[bytes]:
+    """Converts a non-streaming response, which is a single JSON document, once it is complete."""
+    parts = []
+    async for chunk in source:
+        parts.append(chunk)
+    yield convert(b"".join(parts), model)
@@ -0,0 +1,132 @@
+# upstream.py
+import logging
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger("citadel-gateway")
+
+# Defaults used when the `upstream` section of config.yaml omits a key
+DEFAULT_UPSTREAM_SETTINGS = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "connect_timeout": 5.0,
+    "read_timeout": 300.0,
+    "write_timeout": 30.0,
+    "pool_timeout": 10.0,
+}
+
+
+class UpstreamPool:
+    """
+    One long-lived httpx.AsyncClient per backend host, so chat requests reuse
+    keep-alive connections to the Ollama nodes instead of opening a new one each time.
+    """
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        self.settings = {**DEFAULT_UPSTREAM_SETTINGS, **(settings or {})}
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+        self.requests: Dict[str, int] = {}
+        self.connects: Dict[str, int] = {}
+
+    def _build_client(self, host: str) -> httpx.AsyncClient:
+        s = self.settings
+        limits = httpx.Limits(
+            max_connections=int(s["max_connections"]),
+            max_keepalive_connections=int(s["max_keepalive_connections"]),
+            keepalive_expiry=float(s["keepalive_expiry"]),
+        )
+        timeout = httpx.Timeout(
+            connect=float(s["connect_timeout"]),
+            read=float(s["read_timeout"]),
+            write=float(s["write_timeout"]),
+            pool=float(s["pool_timeout"]),
+        )
+        return httpx.AsyncClient(base_url=f"http://{host}", limits=limits, timeout=timeout)
+
+    async def start(self, hosts: Iterable[str]):
+        """Creates a client for each backend host. Called once at app startup."""
+        for host in hosts:
+            self.client(host)
+        logger.info(f"Upstream pool ready for {len(self.clients)} backend hosts.")
+
+    async def close(self):
+        """Closes every client and its pooled connections. Called at app shutdown."""
+        for host, client in list(self.clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing upstream client for {host}: {e}")
+        self.clients.clear()
+
+    def client(self, host: str) -> httpx.AsyncClient:
+        """Returns the shared client for a host, creating it on first use."""
+        client = self.clients.get(host)
+        if client is None or client.is_closed:
+            client = self._build_client(host)
+            self.clients[host] = client
+            self.requests.setdefault(host, 0)
+            self.connects.setdefault(host, 0)
+        return client
+
+    def _traced(self, host: str, on_connected: Optional[Callable[[], None]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Counts the request and adds the trace hook that counts its new TCP connections."""
+        self.requests[host] += 1
+
+        async def trace(event_name: str, info: Dict[str, Any]):
+            if event_name == "connection.connect_tcp.complete":
+                self.connects[host] += 1
+            elif event_name == "http11.send_request_headers.started" and on_connected is not None:
+                on_connected()
+
+        extensions = kwargs.pop("extensions", {}) or {}
+        extensions.setdefault("trace", trace)
+        return extensions
+
+    def stream(self, host: str, method: str, path: str, on_connected: Optional[Callable[[], None]] = None, **kwargs):
+        """
+        Opens a streaming request on the host's pooled client. New TCP connections
+        are counted through httpcore's trace hook so connection reuse can be measured;
+        `on_connected` is called once a connection is ready and the request starts going out.
+        """
+        client = self.client(host)
+        return client.stream(method, path, extensions=self._traced(host, on_connected, kwargs), **kwargs)
+
+    async def request(self, host: str, method: str, path: str, **kwargs) -> httpx.Response:
+        """A complete (non-streaming) request on the host's pooled client, counted like stream()."""
+        client = self.client(host)
+        return await client.request(method, path, extensions=self._traced(host, None, kwargs), **kwargs)
+
+    @staticmethod
+    def _pool_connections(client: httpx.AsyncClient) -> Optional[Tuple[int, int]]:
+        """
+        (open, idle) connections in the client's pool, or None when they cannot be read.
+        httpx has no public API for this, so it looks at the transport's httpcore pool;
+        another httpx/httpcore version may lay that out differently, and then the counts
+        are reported as unknown rather than guessed.
+        """
+        try:
+            connections = list(client._transport._pool.connections)
+            return len(connections), sum(1 for c in connections if c.is_idle())
+        except (AttributeError, TypeError):
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns per-host pool statistics for connection reuse checks. Requests and
+        connections opened come from the trace hook; open and idle connections are
+        None when the pool's internals are not available (see _pool_connections).
+        """
+        hosts = {}
+        for host, client in self.clients.items():
+            requests = self.requests.get(host, 0)
+            connects = self.connects.get(host, 0)
+            pooled = self._pool_connections(client)
+            hosts[host] = {
+                "requests": requests,
+                "connections_opened": connects,
+                "reuse_ratio": round(1 - connects / requests, 4) if requests else None,
+                "open_connections": pooled[0] if pooled else None,
+                "idle_connections": pooled[1] if pooled else None,
+            }
+        return {"settings": self.settings, "hosts": hosts}
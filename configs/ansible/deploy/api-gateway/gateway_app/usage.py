@@ -0,0 +1,228 @@
+# usage.py
+import asyncio
+import logging
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import asyncpg
+except ImportError:  # Only needed when the usage sink is enabled
+    asyncpg = None
+
+logger = logging.getLogger("citadel-gateway")
+
+COLUMNS = (
+    "ts", "gateway", "model", "backend", "api", "client", "stream", "outcome",
+    "prompt_tokens", "eval_tokens", "eval_seconds", "ttfb_seconds", "duration_seconds",
+)
+
+# Append-only and queried by time range, so a BRIN index on ts is enough
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    ts               timestamptz      NOT NULL,
+    gateway          text             NOT NULL,
+    model            text             NOT NULL,
+    backend          text             NOT NULL,
+    api              text             NOT NULL,
+    client           text,
+    stream           boolean          NOT NULL,
+    outcome          text             NOT NULL,
+    prompt_tokens    integer,
+    eval_tokens      integer,
+    eval_seconds     double precision,  -- First to last byte of a stream
+    ttfb_seconds     double precision,
+    duration_seconds double precision NOT NULL
+);
+CREATE INDEX IF NOT EXISTS {index} ON {table} USING brin (ts);
+"""
+
+
+class UsageSink:
+    """
+    Per-request usage records (model, backend, client, token counts, durations) written to
+    PostgreSQL in batches, off the request path. record() only appends to a bounded
+    in-memory queue; a background task takes up to `batch_size` records, or whatever
+    arrived within `flush_interval` seconds, and writes them with COPY over a small
+    connection pool, up to `pool_size` batches at once.
+
+    The database never slows a request down: when it is slow or unreachable the queue
+    fills and new records are dropped, and a batch that fails or exceeds `write_timeout`
+    is dropped too. Both are counted (on_result(result, count) with result "written",
+    "queue_full" or "write_failed").
+    """
+    def __init__(self, dsn: str, password: Optional[str] = None, table: str = "gateway_usage",
+                 max_queue: int = 10000, batch_size: int = 500, flush_interval: float = 1.0,
+                 pool_size: int = 2, write_timeout: float = 5.0, connect_timeout: float = 5.0,
+                 retry_interval: float = 10.0, create_table: bool = False,
+                 on_result: Optional[Callable[[str, int], None]] = None):
+        self.dsn = dsn
+        self.password = password
+        self.table = table
+        # "table" or "schema.table"; COPY takes the two separately
+        self.schema_name, _, self.table_name = table.rpartition(".")
+        if not self.table_name or "." in self.schema_name:
+            raise ValueError(f"Usage table must be 'table' or 'schema.table', not '{table}'")
+        self.max_queue = max(1, max_queue)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.pool_size = max(1, pool_size)
+        self.write_timeout = write_timeout
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.create_table = create_table
+        self.on_result = on_result
+        self.gateway = socket.gethostname()
+        self.queue: asyncio.Queue = asyncio.Queue(self.max_queue)
+        self.written = 0
+        self.dropped: Dict[str, int] = {"queue_full": 0, "write_failed": 0}
+        self.batches = 0
+        self.last_error: Optional[str] = None
+        self._pool = None
+        self._slots = asyncio.Semaphore(self.pool_size)
+        self._flushes: set = set()
+        # Collected but still waiting for a connection
+        self._pending: List[Tuple] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if asyncpg is None:
+            logger.error("Usage sink disabled: the asyncpg package is not installed.")
+            return
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Usage sink started (table {self.table}, batches of {self.batch_size} "
+                        f"every {self.flush_interval}s).")
+
+    async def stop(self, drain_timeout: float = 5.0):
+        """Writes what is queued (within `drain_timeout`), then closes the pool."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            batch, self._pending = self._pending, []
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            if self._pool is not None and batch:
+                self._flush_later(batch)
+            elif batch:
+                # Never connected: these can no longer be written
+                self._count("write_failed", len(batch))
+            if self._flushes:
+                await asyncio.wait(self._flushes, timeout=drain_timeout)
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def _count(self, result: str, count: int):
+        if result == "written":
+            self.written += count
+        else:
+            self.dropped[result] += count
+        if self.on_result is not None:
+            self.on_result(result, count)
+
+    def record(self, model: str, backend: str, api: str, client: Optional[str], stream: bool, outcome: str,
+               stats: Optional[Dict[str, Any]], ttfb: Optional[float], duration: float):
+        """Queues one request's usage; never waits. `stats` is metrics.parse_final_stats() output."""
+        stats = stats or {}
+        row = (
+            datetime.now(timezone.utc), self.gateway, model, backend, api, client, bool(stream), outcome,
+            stats.get("prompt_tokens"), stats.get("eval_tokens"), stats.get("eval_seconds"), ttfb, duration,
+        )
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            self._count("queue_full", 1)
+
+    async def _connect(self):
+        pool = await asyncpg.create_pool(
+            self.dsn, password=self.password, min_size=1, max_size=self.pool_size,
+            timeout=self.connect_timeout, command_timeout=self.write_timeout,
+        )
+        if self.create_table:
+            index = f"{self.table_name}_ts_brin"
+            try:
+                async with pool.acquire() as connection:
+                    await connection.execute(SCHEMA.format(table=self.table, index=index))
+            except BaseException:
+                pool.terminate()
+                raise
+        self._pool = pool
+        logger.info(f"Usage sink connected to PostgreSQL ({self.table}).")
+
+    async def _run(self):
+        while True:
+            if self._pool is None:
+                try:
+                    await self._connect()
+                except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                    # Records keep queueing (and overflowing) while the database is unreachable
+                    error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+                    # Logged once per distinct error, not on every retry
+                    log = logger.error if error != self.last_error else logger.debug
+                    self.last_error = error
+                    log(f"Usage sink cannot connect to PostgreSQL: {error}; retrying in {self.retry_interval}s")
+                    await asyncio.sleep(self.retry_interval)
+                    continue
+            self._pending = await self._collect()
+            # Waits while every pooled connection is busy; meanwhile the queue absorbs (or drops) records
+            await self._slots.acquire()
+            batch, self._pending = self._pending, []
+            self._flush_later(batch, acquired=True)
+
+    async def _collect(self) -> List[Tuple]:
+        """The next batch: blocks for the first record, then takes more until full or the interval ends."""
+        batch = [await self.queue.get()]
+        self._pending = batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _flush_later(self, batch: List[Tuple], acquired: bool = False):
+        task = asyncio.create_task(self._flush(batch, acquired))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch: List[Tuple], acquired: bool):
+        if not acquired:
+            await self._slots.acquire()
+        try:
+            async with self._pool.acquire(timeout=self.write_timeout) as connection:
+                await connection.copy_records_to_table(self.table_name, schema_name=self.schema_name or None,
+                                                       records=batch, columns=COLUMNS, timeout=self.write_timeout)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            self.last_error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            logger.warning(f"Usage sink dropped a batch of {len(batch)} records: {self.last_error}")
+            self._count("write_failed", len(batch))
+        else:
+            self.batches += 1
+            self._count("written", len(batch))
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "table": self.table,
+            "connected": self._pool is not None,
+            "queued": self.queue.qsize(),
+            "max_queue": self.max_queue,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": dict(self.dropped),
+            "flushing": len(self._flushes),
+            "last_error": self.last_error,
+        }
@@ -2,7 +2,9 @@ import httpx
 import logging
 import os
 import sys
+import time
 from pathlib import Path
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
@@ -10,7 +12,10 @@ from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
 
 # --- The only configuration logic needed is to import and instantiate the class ---
-from gateway_app.config import GatewayConfig
+from gateway_app.config import GatewayConfig, validate_model_replicas
+from gateway_app.upstream import UpstreamPool
+from gateway_app.routing import ReplicaRouter
+from gateway_app.transcode import NDJSONToSSE, ollama_to_openai_response, transcode_body, transcode_stream
 
 # ===================================================================
 # --- Centralized Configuration with Dynamic Path Resolution ---
@@ -28,29 +33,8 @@ try:
         logging.error("CRITICAL: No model mappings found in configuration!")
         raise RuntimeError("Configuration validation failed: Empty model map")
     
-    # Validate each MODEL_MAP entry
-    invalid_entries = []
-    for model_name, backend_host in MODEL_MAP.items():
-        # Check model name is a non-empty string
-        if not isinstance(model_name, str) or not model_name.strip():
-            invalid_entries.append(f"Invalid model name: '{model_name}' (must be non-empty string)")
-        
-        # Check backend host format (should be host:port)
-        if not isinstance(backend_host, str) or not backend_host.strip():
-            invalid_entries.append(f"Invalid backend host for '{model_name}': '{backend_host}' (must be non-empty string)")
-        elif ':' not in backend_host or len(backend_host.split(':')) != 2:
-            invalid_entries.append(f"Invalid backend host format for '{model_name}': '{backend_host}' (expected format: host:port)")
-        else:
-            # Validate port is numeric
-            try:
-                host, port = backend_host.split(':')
-                if not host.strip():
-                    invalid_entries.append(f"Empty host in '{model_name}': '{backend_host}'")
-                port_num = int(port)
-                if not (1 <= port_num <= 65535):
-                    invalid_entries.append(f"Invalid port range for '{model_name}': {port_num} (must be 1-65535)")
-            except ValueError:
-                invalid_entries.append(f"Non-numeric port for '{model_name}': '{backend_host}'")
+    # Validate each MODEL_MAP entry (a single host or a list of weighted replicas)
+    invalid_entries = validate_model_replicas(config.get_model_replicas())
     
     # Log validation results
     if invalid_entries:
@@ -59,8 +43,8 @@ try:
         raise RuntimeError(f"Configuration validation failed: {len(invalid_entries)} invalid entries found")
     else:
         logging.info(f"Configuration validation passed: {len(MODEL_MAP)} valid model mappings loaded")
-        for model, host in MODEL_MAP.items():
-            logging.info(f"  ✓ {model} → {host}")
+        for model, replicas in config.get_model_replicas().items():
+            logging.info(f"  ✓ {model} → {', '.join(r['host'] for r in replicas)}")
 
 except Exception as e:
     logging.error(f"CRITICAL: Failed to load or validate configuration: {e}")
@@ -72,8 +56,25 @@ except Exception as e:
 logging.basicConfig(level="INFO", format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger("webui-gateway")
 
+# --- Replica Routing ---
+routing_settings = config.get_routing_settings()
+router = ReplicaRouter(
+    config.get_model_replicas(),
+    strategy=routing_settings.get("strategy", "least_outstanding"),
+    ewma_alpha=float(routing_settings.get("ewma_alpha", 0.3)),
+)
+
+# --- Upstream Connection Pools ---
+upstream_pool = UpstreamPool(config.get_upstream_settings())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream_pool.start(config.get_backend_hosts())
+    yield
+    await upstream_pool.close()
+
 # --- FastAPI App ---
-app = FastAPI(title="Custom WebUI Gateway")
+app = FastAPI(title="Custom WebUI Gateway", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
@@ -85,24 +86,55 @@ class OllamaChatRequest(BaseModel):
     messages: List[Dict[str, Any]]
     stream: Optional[bool] = True
 
+class OpenAIChatRequest(BaseModel):
+    model: str
+    messages: List[Dict[str, Any]]
+    stream: Optional[bool] = False
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+
 # --- Streaming Proxy Helper ---
-async def stream_ollama_response(backend_url: str, payload: OllamaChatRequest):
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        try:
-            async with client.stream(
-                "POST", backend_url, json=payload.dict(exclude_none=True), headers={"Content-Type": "application/json"}
-            ) as response:
-                response.raise_for_status()
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Backend error: {e.response.status_code} - {e.response.text}")
-            yield f'{{"error": "Backend server returned an error."}}'.encode()
-        except httpx.RequestError as e:
-            logger.error(f"Connection failed: {e}")
-            yield f'{{"error": "Failed to connect to backend server."}}'.encode()
+async def stream_ollama_response(payload: OllamaChatRequest, options: Optional[Dict[str, Any]] = None):
+    # Select and claim the replica before the first await so concurrent requests see the load
+    replica = router.select(payload.model)
+    backend_host = replica.host
+    router.acquire(replica)
+    logger.info(f"Routing '{payload.model}' to '{backend_host}'")
+    started = time.monotonic()
+    first_chunk = True
+    body = payload.dict(exclude_none=True)
+    if options:
+        body["options"] = options
+    try:
+        async with upstream_pool.stream(
+            backend_host, "POST", "/api/chat", json=body, headers={"Content-Type": "application/json"}
+        ) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes():
+                if first_chunk:
+                    router.observe_latency(replica, time.monotonic() - started)
+                    first_chunk = False
+                yield chunk
+    except httpx.HTTPStatusError as e:
+        logger.error(f"Backend error: {e.response.status_code} from {backend_host}")
+        yield f'{{"error": "Backend server returned an error."}}'.encode()
+    except httpx.RequestError as e:
+        logger.error(f"Connection failed: {e}")
+        yield f'{{"error": "Failed to connect to backend server."}}'.encode()
+    finally:
+        router.release(replica)
 
 # --- API Endpoints ---
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """Exposes per-backend connection pool statistics (requests vs. new connections)."""
+    return upstream_pool.stats()
+
+@app.get("/routing/stats")
+async def routing_stats():
+    """Exposes per-replica in-flight counters and latency estimates."""
+    return router.stats()
+
 @app.get("/api/tags")
 async def api_tags():
     """Returns the list of models defined in our MODEL_MAP."""
@@ -115,15 +147,10 @@ async def api_chat(payload: OllamaChatRequest):
     """Routes chat requests for models in our MODEL_MAP."""
     model_id = payload.model
     
-    if model_id in MODEL_MAP:
-        backend_host = MODEL_MAP[model_id]
-        logger.info(f"Routing '{model_id}' to '{backend_host}'")
-        
+    if router.has_model(model_id):
         # Note: We are forwarding to Ollama's native /api/chat endpoint
-        backend_url = f"http://{backend_host}/api/chat"
-        
         return StreamingResponse(
-            stream_ollama_response(backend_url, payload),
+            stream_ollama_response(payload),
             media_type="application/x-ndjson",
         )
     else:
@@ -132,6 +159,30 @@ async def api_chat(payload: OllamaChatRequest):
             status_code=404, detail=f"Model '{model_id}' not found in gateway configuration."
         )
 
+@app.post("/v1/chat/completions")
+async def chat_completions(payload: OpenAIChatRequest):
+    """OpenAI-compatible endpoint: forwarded to native /api/chat and transcoded back to OpenAI format."""
+    model_id = payload.model
+    if not router.has_model(model_id):
+        logger.warning(f"Rejecting request for unmapped model: '{model_id}'")
+        raise HTTPException(
+            status_code=404, detail=f"Model '{model_id}' not found in gateway configuration."
+        )
+    options = {}
+    if payload.temperature is not None:
+        options["temperature"] = payload.temperature
+    if payload.max_tokens is not None:
+        options["num_predict"] = payload.max_tokens
+    native = OllamaChatRequest(model=model_id, messages=payload.messages, stream=payload.stream)
+    body_stream = stream_ollama_response(native, options or None)
+    if payload.stream:
+        return StreamingResponse(
+            transcode_stream(body_stream, NDJSONToSSE(model_id)), media_type="text/event-stream"
+        )
+    return StreamingResponse(
+        transcode_body(body_stream, ollama_to_openai_response, model_id), media_type="application/json"
+    )
+
 # --- Entry Point ---
 if __name__ == "__main__":
     import uvicorn
@@ -1,25 +1,45 @@
+#!/usr/bin/env python3
+import argparse
 import os
-import platform
-import socket
-import subprocess
 
-output_path = "/opt/gateway/system_info.txt"
+from ssh_pool import SSHPool
 
-def run_cmd(cmd):
-    try:
-        return subprocess.check_output(cmd, shell=True, text=True).strip()
-    except:
-        return "Unavailable"
+# Same sections as before, now gathered over SSH from every gateway host in parallel
+SECTIONS = {
+    "HOSTNAME": "hostname",
+    "IP ADDRESS": "hostname -I | awk '{print $1}'",
+    "OS & KERNEL": "uname -srmo",
+    "UPTIME": "uptime -p",
+    "CPU MODEL": "lscpu | grep 'Model name' | awk -F: '{print $2}'",
+    "MEMORY": "free -h",
+    "DISK USAGE": "df -h /",
+    "OPEN PORTS (8000)": "ss -tuln | grep ':8000' || echo 'Port 8000 not open'",
+    "VIRTUAL ENVIRONMENTS": "find /opt/gateway -type d -name 'bin' -exec ls {}/activate \\; 2>/dev/null",
+}
 
-with open(output_path, "w") as f:
-    f.write("HOSTNAME:\n" + socket.gethostname() + "\n\n")
-    f.write("IP ADDRESS:\n" + run_cmd("hostname -I | awk '{print $1}'") + "\n\n")
-    f.write("OS & KERNEL:\n" + platform.platform() + "\n\n")
-    f.write("UPTIME:\n" + run_cmd("uptime -p") + "\n\n")
-    f.write("CPU MODEL:\n" + run_cmd("lscpu | grep 'Model name' | awk -F: '{print $2}'") + "\n\n")
-    f.write("MEMORY:\n" + run_cmd("free -h") + "\n\n")
-    f.write("DISK USAGE:\n" + run_cmd("df -h /") + "\n\n")
-    f.write("OPEN PORTS (8000):\n" + (run_cmd("ss -tuln | grep ':8000'") or "Port 8000 not open") + "\n\n")
-    f.write("VIRTUAL ENVIRONMENTS:\n" + run_cmd("find /opt/gateway -type d -name 'bin' -exec ls {}/activate \\; 2>/dev/null") + "\n\n")
+def main():
+    parser = argparse.ArgumentParser(description="Collect system info from API gateway hosts over SSH")
+    parser.add_argument("hosts", nargs="*", default=["192.168.10.39"])
+    parser.add_argument("--user", default="agent0")
+    parser.add_argument("--output-dir", default=".", help="One <host>_system_info.txt per host is written here")
+    args = parser.parse_args()
 
-print(f"✅ System info written to {output_path}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    with SSHPool(username=args.user) as pool:
+        results = pool.collect(args.hosts, SECTIONS)
+
+    for host in args.hosts:
+        output_path = os.path.join(args.output_dir, f"{host}_system_info.txt")
+        with open(output_path, "w") as f:
+            for section in SECTIONS:
+                result = results[host][section]
+                f.write(f"{section}:\n" + (result.stdout if result.ok else "Unavailable") + "\n\n")
+        failed = [s for s in SECTIONS if not results[host][s].ok]
+        if len(failed) == len(SECTIONS):
+            print(f"❌ {host}: {results[host]['HOSTNAME'].output}")
+        else:
+            print(f"✅ System info for {host} written to {output_path}"
+                  + (f" ({len(failed)} sections unavailable)" if failed else ""))
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,16 @@
 #!/usr/bin/env python3
-import subprocess
-import paramiko
+import argparse
 import socket
 
+import requests
+
+from ssh_pool import SSHPool
+
 # Server Configuration
 remote_host = "192.168.10.38"
 remote_user = "agent0"
 webui_port = 3000
 
-# SSH Command Runner
-def ssh_run(cmd):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    try:
-        ssh.connect(remote_host, username=remote_user, timeout=10)
-        stdin, stdout, stderr = ssh.exec_command(cmd)
-        return stdout.read().decode().strip(), stderr.read().decode().strip()
-    except Exception as e:
-        return "", f"Error: {e}"
-    finally:
-        ssh.close()
-
-# Check Port Accessibility
-def is_port_open(host, port):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-        sock.settimeout(2)
-        return sock.connect_ex((host, port)) == 0
-
-# Main Check
-print(f"🔍 Checking HX-Web-Server ({remote_host}) for OpenWebUI status...\n")
-
 cmds = {
     "🖥️ Hostname": "hostname",
     "🌐 IP Address": "hostname -I | awk '{print $1}'",
@@ -45,24 +26,44 @@ cmds = {
     "🔹 OpenWebUI Container": "docker ps --filter 'ancestor=openwebui/openwebui' --format '{{.Names}}'"
 }
 
-for label, command in cmds.items():
-    out, err = ssh_run(command)
-    if err:
-        print(f"{label}: ❌ {err.strip()}")
-    else:
-        print(f"{label}: {out.strip()}")
-
-# Port check
-port_open = is_port_open(remote_host, webui_port)
-print(f"🔌 Port {webui_port} Reachable: {'✅ Yes' if port_open else '❌ No'}")
+# Check Port Accessibility
+def is_port_open(host, port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.settimeout(2)
+        return sock.connect_ex((host, port)) == 0
 
 # Web UI availability
-import requests
-try:
-    resp = requests.get(f"http://{remote_host}:{webui_port}", timeout=5)
-    if resp.status_code == 200:
-        print(f"🌍 OpenWebUI Web Interface: ✅ HTTP {resp.status_code} OK")
-    else:
-        print(f"🌍 OpenWebUI Web Interface: ❌ HTTP {resp.status_code}")
-except Exception as e:
-    print(f"🌍 OpenWebUI Web Interface: ❌ {e}")
+def check_web_ui(host):
+    try:
+        resp = requests.get(f"http://{host}:{webui_port}", timeout=5)
+        if resp.status_code == 200:
+            return f"✅ HTTP {resp.status_code} OK"
+        return f"❌ HTTP {resp.status_code}"
+    except Exception as e:
+        return f"❌ {e}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Check OpenWebUI servers over SSH (all hosts and commands in parallel)")
+    parser.add_argument("hosts", nargs="*", default=[remote_host], help=f"Servers to check (default: {remote_host})")
+    parser.add_argument("--user", default=remote_user)
+    args = parser.parse_args()
+
+    print(f"🔍 Checking {', '.join(args.hosts)} for OpenWebUI status...\n")
+    multi_host = len(args.hosts) > 1
+    # Every command runs on a channel of one shared connection per host; print each as it finishes
+    with SSHPool(username=args.user) as pool:
+        for result in pool.fan_out(args.hosts, cmds):
+            prefix = f"[{result.host}] " if multi_host else ""
+            if result.ok:
+                print(f"{prefix}{result.label}: {result.stdout}")
+            else:
+                print(f"{prefix}{result.label}: ❌ {result.output}")
+
+    for host in args.hosts:
+        prefix = f"[{host}] " if multi_host else ""
+        port_open = is_port_open(host, webui_port)
+        print(f"{prefix}🔌 Port {webui_port} Reachable: {'✅ Yes' if port_open else '❌ No'}")
+        print(f"{prefix}🌍 OpenWebUI Web Interface: {check_web_ui(host)}")
+
+if __name__ == "__main__":
+    main()
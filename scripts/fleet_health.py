@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+CX R&D Infrastructure fleet health check.
+
+Reads the Ansible inventory and probes every host at once: SSH reachability over TCP,
+HTTP health endpoints for the services each host runs (gateway /health, Ollama /api/tags,
+Qdrant /healthz, Prometheus /-/healthy, ...), and a protocol-level PostgreSQL / Redis
+handshake. Each probe is sampled several times for latency percentiles and has its own
+deadline, so a full sweep takes about as long as the slowest single probe.
+
+Writes the same JSON report as health-check.sh (reports/health-report-<timestamp>.json),
+extended with per-server, per-probe results.
+A host is online when every probe answers, degraded when some do (e.g. SSH is up but a
+service is down) and offline when none do. Exits non-zero unless every host is online.
+
+Usage: python3 fleet_health.py [--inventory PATH] [--limit GROUP_OR_HOST] [--samples 5] [--timeout 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import yaml
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INVENTORY = os.path.join(PROJECT_ROOT, "configs", "ansible", "inventory", "main.yaml")
+
+# service name in the inventory -> probes as (label, kind, port host var, default port, HTTP path)
+SERVICE_PROBES = {
+    "ollama": [("ollama", "http", "ollama_port", 11434, "/api/tags")],
+    "fastapi": [("gateway", "http", "gateway_port", 8000, "/health")],
+    "nginx": [("nginx", "http", "nginx_port", 80, "/")],
+    "qdrant": [("qdrant", "http", "qdrant_port", 6333, "/healthz")],
+    "postgresql": [("postgresql", "postgres", "postgres_port", 5432, None)],
+    "redis": [("redis", "redis", "redis_port", 6379, None)],
+    "prometheus": [("prometheus", "http", "prometheus_port", 9090, "/-/healthy")],
+    "grafana": [("grafana", "http", "grafana_port", 3000, "/api/health")],
+    "node_exporter": [("node_exporter", "http", "node_exporter_port", 9100, "/metrics")],
+}
+# PostgreSQL SSLRequest: length 8, code 80877103. Any server answers with a single 'S' or 'N'.
+PG_SSL_REQUEST = (8).to_bytes(4, "big") + (80877103).to_bytes(4, "big")
+
+
+def load_inventory(path, limit=None):
+    """Flattens the inventory into {host: vars}, merging vars from every group a host appears in."""
+    with open(path) as f:
+        inventory = yaml.safe_load(f)
+    root = inventory.get("all", {})
+    common = root.get("vars", {}) or {}
+    hosts, groups = {}, {}
+
+    def walk(name, group):
+        group = group or {}
+        members = set()
+        for host, host_vars in (group.get("hosts") or {}).items():
+            hosts.setdefault(host, dict(common)).update(host_vars or {})
+            members.add(host)
+        for child, child_group in (group.get("children") or {}).items():
+            # A child listed without a body is defined elsewhere under the same name
+            members |= walk(child, child_group or root.get("children", {}).get(child))
+        groups[name] = groups.get(name, set()) | members
+        return members
+
+    walk("all", root)
+    if limit:
+        selected = groups.get(limit, {limit} if limit in hosts else set())
+        hosts = {name: hosts[name] for name in selected}
+    # Hosts without an address (only listed in a group by name) cannot be probed
+    return {name: host_vars for name, host_vars in sorted(hosts.items()) if host_vars.get("ansible_host")}
+
+
+def plan_probes(host_vars):
+    """Returns the probes for one host as (label, kind, port, path) tuples."""
+    probes = [("ssh", "tcp", host_vars.get("ansible_port", 22), None)]
+    services = list(host_vars.get("services") or [])
+    if "ollama_port" in host_vars and "ollama" not in services:
+        services.append("ollama")
+    for service in services:
+        for label, kind, port_var, default_port, path in SERVICE_PROBES.get(service, []):
+            probes.append((label, kind, host_vars.get(port_var, default_port), path))
+    return probes
+
+
+async def probe_tcp(address, port, path, client):
+    reader, writer = await asyncio.open_connection(address, port)
+    writer.close()
+    return "connected"
+
+
+async def probe_http(address, port, path, client):
+    response = await client.get(f"http://{address}:{port}{path}")
+    if response.status_code >= 400:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return f"HTTP {response.status_code}"
+
+
+async def probe_postgres(address, port, path, client):
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        writer.write(PG_SSL_REQUEST)
+        await writer.drain()
+        answer = await reader.read(1)
+    finally:
+        writer.close()
+    if answer not in (b"S", b"N"):
+        raise RuntimeError(f"not a PostgreSQL server (got {answer!r})")
+    return "accepting connections"
+
+
+async def probe_redis(address, port, path, client):
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        writer.write(b"PING\r\n")
+        await writer.drain()
+        answer = await reader.readline()
+    finally:
+        writer.close()
+    # +PONG, or -NOAUTH when a password is set: either way Redis is answering
+    if not answer.startswith((b"+PONG", b"-NOAUTH")):
+        raise RuntimeError(f"unexpected reply {answer[:40]!r}")
+    return answer.decode(errors="replace").strip()
+
+
+PROBES = {"tcp": probe_tcp, "http": probe_http, "postgres": probe_postgres, "redis": probe_redis}
+
+
+async def sample(kind, address, port, path, client, timeout, delay):
+    """One timed attempt. Returns (latency in seconds or None, detail)."""
+    await asyncio.sleep(delay)
+    started = time.perf_counter()
+    try:
+        detail = await asyncio.wait_for(PROBES[kind](address, port, path, client), timeout)
+        return time.perf_counter() - started, detail
+    except asyncio.TimeoutError:
+        return None, f"timed out after {timeout}s"
+    except (OSError, httpx.HTTPError, RuntimeError) as e:
+        return None, f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+async def run_probe(probe, address, client, args):
+    label, kind, port, path = probe
+    # Samples run concurrently, staggered slightly so they do not all hit the same accept queue at once
+    results = await asyncio.gather(*(
+        sample(kind, address, port, path, client, args.timeout, i * args.sample_gap) for i in range(args.samples)
+    ))
+    latencies = sorted(1000 * latency for latency, _ in results if latency is not None)
+    errors = [detail for latency, detail in results if latency is None]
+    return {
+        "probe": label,
+        "kind": kind,
+        "target": f"{address}:{port}{path or ''}",
+        "status": "up" if not errors else "flaky" if latencies else "down",
+        "samples": args.samples,
+        "successes": len(latencies),
+        "latency_ms": {
+            "min": round(latencies[0], 2) if latencies else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+        "detail": errors[-1] if errors else results[-1][1],
+    }
+
+
+async def check_host(name, host_vars, client, args):
+    address = host_vars["ansible_host"]
+    probes = await asyncio.gather(*(run_probe(p, address, client, args) for p in plan_probes(host_vars)))
+    up = sum(1 for p in probes if p["status"] != "down")
+    status = "online" if up == len(probes) else "degraded" if up else "offline"
+    return name, {"address": address, "role": host_vars.get("server_role"), "status": status, "probes": probes}
+
+
+def system_health():
+    """Local disk, memory and load figures, as in health-check.sh."""
+    disk = shutil.disk_usage("/")
+    meminfo = {}
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                meminfo[key] = int(value.split()[0])
+    except OSError:
+        pass
+    total = meminfo.get("MemTotal")
+    return {
+        "disk_usage_percent": round(100 * disk.used / disk.total),
+        "memory_usage_percent": round(100 * (total - meminfo.get("MemAvailable", 0)) / total) if total else None,
+        "load_average": f"{os.getloadavg()[0]:.2f}",
+    }
+
+
+def print_host(name, result):
+    icon = {"online": "✅", "degraded": "⚠️", "offline": "❌"}[result["status"]]
+    print(f"{icon} {name} ({result['role'] or 'unknown role'}) at {result['address']} - {result['status'].upper()}")
+    for probe in result["probes"]:
+        mark = {"up": "✅", "flaky": "⚠️", "down": "❌"}[probe["status"]]
+        latency = probe["latency_ms"]
+        timing = f"p50 {latency['p50']}ms p95 {latency['p95']}ms" if latency["p50"] is not None else ""
+        print(f"    {mark} {probe['probe']:<14} {probe['target']:<32} "
+              f"{probe['successes']}/{probe['samples']}  {timing}  {probe['detail']}")
+
+
+async def sweep(hosts, args):
+    # One pool for every HTTP probe, without keep-alive so each sample pays for its own connect
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits, follow_redirects=False) as client:
+        return dict(await asyncio.gather(*(check_host(name, host_vars, client, args)
+                                            for name, host_vars in hosts.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--inventory", default=DEFAULT_INVENTORY)
+    parser.add_argument("--limit", help="Only check this inventory group or host")
+    parser.add_argument("--samples", type=int, default=5, help="Attempts per probe, for latency percentiles")
+    parser.add_argument("--sample-gap", type=float, default=0.05, help="Seconds between a probe's attempts")
+    parser.add_argument("--timeout", type=float, default=3.0, help="Deadline per attempt in seconds")
+    parser.add_argument("--report", help="Report path (default: reports/health-report-<timestamp>.json)")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
+    args = parser.parse_args()
+    args.samples = max(1, args.samples)
+
+    hosts = load_inventory(args.inventory, args.limit)
+    if not hosts:
+        print(f"❌ No hosts with an ansible_host in {args.inventory}" + (f" for '{args.limit}'" if args.limit else ""))
+        sys.exit(2)
+    print(f"🔍 Checking {len(hosts)} servers from {args.inventory} "
+          f"({args.samples} samples per probe, {args.timeout}s deadline)")
+
+    started = time.perf_counter()
+    results = asyncio.run(sweep(hosts, args))
+    elapsed = time.perf_counter() - started
+
+    if not args.quiet:
+        for name, result in results.items():
+            print_host(name, result)
+    # A degraded host answers on SSH but has a service down, so it does not count as online
+    online = sum(1 for r in results.values() if r["status"] == "online")
+    degraded = sum(1 for r in results.values() if r["status"] == "degraded")
+    offline = sum(1 for r in results.values() if r["status"] == "offline")
+    total = len(results)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "infrastructure": "CX R&D Infrastructure",
+        "health_check": {
+            "total_servers": total,
+            "online_servers": online,
+            "degraded_servers": degraded,
+            "offline_servers": offline,
+            "success_rate": round(online * 100 / total, 2),
+            "sweep_seconds": round(elapsed, 3),
+        },
+        "system": system_health(),
+        "servers": results,
+    }
+    report_path = args.report or os.path.join(
+        PROJECT_ROOT, "reports", f"health-report-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    system = report["system"]
+    print(f"\n🔧 Local system: disk {system['disk_usage_percent']}%, memory {system['memory_usage_percent']}%, "
+          f"load {system['load_average']}")
+    print(f"📊 {online}/{total} servers online, {degraded} degraded, {offline} offline in {elapsed:.2f}s")
+    print(f"📄 Report written to {report_path}")
+    sys.exit(0 if online == total else 1)
+
+
+if __name__ == "__main__":
+    main()
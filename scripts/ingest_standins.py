@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for Ollama's embedding API and Qdrant's points API, for running and
+benchmarking qdrant_ingest.py offline. Standard library only.
+
+  Ollama  (--ollama-port, default 11434): POST /api/embed, POST /v1/embeddings
+          Vectors are deterministic (derived from a hash of the text) with --dim dimensions.
+          --embed-latency adds a fixed delay per call, --per-item-latency one per input text.
+  Qdrant  (--qdrant-port, default 6333): GET/PUT /collections/{name},
+          PUT /collections/{name}/points. Points are counted, not stored.
+          --upsert-latency adds a delay per upsert call.
+
+Usage: python3 ingest_standins.py [--dim 768] [--embed-latency 0.02] [--upsert-latency 0.01]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+
+ARGS = None
+COLLECTIONS = {}
+
+
+def fake_vector(text):
+    seed = hashlib.sha256(text.encode()).digest()
+    return [seed[i % len(seed)] / 255.0 for i in range(ARGS.dim)]
+
+
+async def handle_ollama(method, path, body):
+    if method != "POST" or path not in ("/api/embed", "/v1/embeddings"):
+        return 404, {"error": f"{method} {path} not found"}
+    request = json.loads(body or b"{}")
+    texts = request.get("input", [])
+    texts = [texts] if isinstance(texts, str) else texts
+    await asyncio.sleep(ARGS.embed_latency + ARGS.per_item_latency * len(texts))
+    vectors = [fake_vector(text) for text in texts]
+    tokens = sum(len(text.split()) for text in texts)
+    if path == "/api/embed":
+        return 200, {"model": request.get("model"), "embeddings": vectors, "prompt_eval_count": tokens}
+    return 200, {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "model": request.get("model"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    }
+
+
+async def handle_qdrant(method, path, body):
+    parts = path.split("?")[0].strip("/").split("/")
+    if len(parts) < 2 or parts[0] != "collections":
+        return 404, {"status": {"error": "not found"}}
+    name = parts[1]
+    if len(parts) == 2 and method == "GET":
+        if name not in COLLECTIONS:
+            return 404, {"status": {"error": f"Collection `{name}` doesn't exist!"}}
+        info = COLLECTIONS[name]
+        return 200, {"result": {"points_count": info["points"], "config": {"params": {"vectors": info["vectors"]}}},
+                     "status": "ok"}
+    if len(parts) == 2 and method == "PUT":
+        COLLECTIONS[name] = {"vectors": json.loads(body)["vectors"], "points": 0}
+        return 200, {"result": True, "status": "ok"}
+    if len(parts) == 3 and parts[2] == "points" and method == "PUT":
+        if name not in COLLECTIONS:
+            return 404, {"status": {"error": f"Collection `{name}` doesn't exist!"}}
+        points = json.loads(body)["points"]
+        size = COLLECTIONS[name]["vectors"]["size"]
+        if any(len(p["vector"]) != size for p in points):
+            return 400, {"status": {"error": "Wrong input: vector dimension mismatch"}}
+        await asyncio.sleep(ARGS.upsert_latency)
+        COLLECTIONS[name]["points"] += len(points)
+        return 200, {"result": {"operation_id": 0, "status": "completed"}, "status": "ok"}
+    return 404, {"status": {"error": "not found"}}
+
+
+def serve(handler):
+    """A minimal HTTP/1.1 keep-alive server; enough for httpx clients."""
+    async def connection(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(" ", 2)
+                length = 0
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode().partition(":")
+                    if name.strip().lower() == "content-length":
+                        length = int(value.strip())
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await handler(method, path, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return connection
+
+
+async def main():
+    ollama = await asyncio.start_server(serve(handle_ollama), "127.0.0.1", ARGS.ollama_port)
+    qdrant = await asyncio.start_server(serve(handle_qdrant), "127.0.0.1", ARGS.qdrant_port)
+    print(f"🧪 Ollama stand-in on :{ARGS.ollama_port} (dim {ARGS.dim}), Qdrant stand-in on :{ARGS.qdrant_port}")
+    async with ollama, qdrant:
+        await asyncio.gather(ollama.serve_forever(), qdrant.serve_forever())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ollama-port", type=int, default=11434)
+    parser.add_argument("--qdrant-port", type=int, default=6333)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per embedding call")
+    parser.add_argument("--per-item-latency", type=float, default=0.0, help="Extra seconds per input text")
+    parser.add_argument("--upsert-latency", type=float, default=0.0, help="Seconds per upsert call")
+    ARGS = parser.parse_args()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Streams a corpus into Qdrant: read -> chunk -> embed (via the gateway / Ollama) -> upsert.
+
+Stages run concurrently and are connected by bounded queues, so memory stays flat
+whatever the corpus size and a slow stage throttles the ones before it. Point ids
+are derived from (document id, chunk index), which makes re-runs idempotent; a
+checkpoint file records the last input document whose chunks are all stored, and
+--resume skips everything up to it.
+
+Input is either a JSONL file ({"id": ..., "text": ..., other fields become payload})
+or a directory of .txt/.md files (the relative path is the document id).
+
+Examples:
+  python3 qdrant_ingest.py corpus.jsonl --collection citadel_documents
+  python3 qdrant_ingest.py ./docs --resume --embed-concurrency 8 --upsert-batch 512
+  # Offline, against the stand-ins from ingest_standins.py:
+  python3 qdrant_ingest.py corpus.jsonl --embed-url http://127.0.0.1:11434 \\
+      --qdrant-url http://127.0.0.1:6333 --create-collection
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+GATEWAY_URL = "http://192.168.10.39:8000"
+QDRANT_URL = "http://192.168.10.30:6333"
+TEXT_SUFFIXES = {".txt", ".md", ".rst"}
+DONE = object()
+
+
+class StageStats:
+    """Item counts and busy time for one pipeline stage."""
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.retries = 0
+        self._last_items = 0
+
+    def delta(self):
+        items, self._last_items = self.items - self._last_items, self.items
+        return items
+
+
+class CheckpointTracker:
+    """
+    Tracks which input documents have every chunk stored. Only documents still in
+    flight are kept in memory; `done_through` is the highest sequence number below
+    which everything is complete, and is what gets persisted.
+    """
+    def __init__(self, done_through=-1):
+        self.done_through = done_through
+        self.remaining = {}
+        self.finished = set()
+
+    def add(self, seq, chunks):
+        if chunks == 0:
+            self._complete(seq)
+        else:
+            self.remaining[seq] = chunks
+
+    def stored(self, seqs):
+        for seq in seqs:
+            self.remaining[seq] -= 1
+            if self.remaining[seq] == 0:
+                del self.remaining[seq]
+                self._complete(seq)
+
+    def _complete(self, seq):
+        self.finished.add(seq)
+        while self.done_through + 1 in self.finished:
+            self.done_through += 1
+            self.finished.discard(self.done_through)
+
+
+def load_checkpoint(path, source, collection):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return -1
+    if data.get("source") != source or data.get("collection") != collection:
+        print(f"⚠️ Checkpoint {path} is for {data.get('source')} -> {data.get('collection')}; ignoring it")
+        return -1
+    return int(data.get("done_through", -1))
+
+
+def save_checkpoint(path, source, collection, done_through):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"source": source, "collection": collection, "done_through": done_through,
+                   "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}, f)
+    os.replace(tmp, path)
+
+
+def iter_documents(source):
+    """Yields (doc_id, text, payload) in a stable order so sequence numbers survive restarts."""
+    path = Path(source)
+    if path.is_dir():
+        for file in sorted(p for p in path.rglob("*") if p.is_file() and p.suffix in TEXT_SUFFIXES):
+            rel = str(file.relative_to(path))
+            yield rel, file.read_text(encoding="utf-8", errors="replace"), {"source": rel}
+        return
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            text = record.pop("text", "")
+            doc_id = str(record.pop("id", line_no))
+            yield doc_id, text, record
+
+
+def chunk_text(text, size, overlap):
+    """Splits text into ~size character chunks, breaking on whitespace where possible."""
+    text = text.strip()
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            space = text.rfind(" ", start + size // 2, end)
+            if space > start:
+                end = space
+        yield text[start:end].strip()
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+
+
+async def request_with_retry(client, method, url, stats, attempts=5, **kwargs):
+    """Retries 429/5xx responses and connection errors with backoff, honouring Retry-After."""
+    delay = 0.5
+    for attempt in range(attempts):
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code != 429 and response.status_code < 500:
+                response.raise_for_status()
+                return response
+            wait = float(response.headers.get("retry-after", delay))
+            error = f"HTTP {response.status_code}"
+        except httpx.RequestError as e:
+            wait, error = delay, f"{type(e).__name__}: {e}"
+        if attempt == attempts - 1:
+            raise RuntimeError(f"{method} {url} failed after {attempts} attempts: {error}")
+        stats.retries += 1
+        await asyncio.sleep(wait)
+        delay = min(delay * 2, 10.0)
+
+
+class Pipeline:
+    def __init__(self, args):
+        self.args = args
+        self.source = str(Path(args.source).resolve())
+        self.checkpoint_path = args.checkpoint or f"{args.source.rstrip('/')}.{args.collection}.checkpoint.json"
+        done_through = load_checkpoint(self.checkpoint_path, self.source, args.collection) if args.resume else -1
+        self.tracker = CheckpointTracker(done_through)
+        self.skip_through = done_through
+        self.stats = {name: StageStats(name) for name in ("read", "chunk", "embed", "upsert")}
+        # Bounded queues give backpressure: a slow stage blocks the one feeding it
+        self.doc_queue = asyncio.Queue(maxsize=args.queue_size)
+        self.embed_queue = asyncio.Queue(maxsize=args.embed_concurrency * 2)
+        self.point_queue = asyncio.Queue(maxsize=args.embed_concurrency * 2)
+        self.vector_size = None
+        self.collection_lock = asyncio.Lock()
+        self.failed = None
+
+    async def run(self):
+        args = self.args
+        if self.skip_through >= 0:
+            print(f"↪️ Resuming after document #{self.skip_through} ({self.checkpoint_path})")
+        limits = httpx.Limits(max_connections=args.embed_concurrency + args.upsert_concurrency + 2)
+        headers = {"api-key": args.qdrant_api_key} if args.qdrant_api_key else {}
+        async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as embed_client, \
+                httpx.AsyncClient(base_url=args.qdrant_url, timeout=args.timeout, limits=limits,
+                                  headers=headers) as qdrant_client:
+            self.embed_client, self.qdrant_client = embed_client, qdrant_client
+            started = time.monotonic()
+            reporter = asyncio.create_task(self.report_progress(started))
+            checkpointer = asyncio.create_task(self.checkpoint_loop())
+            embedders = [asyncio.create_task(self.embed_worker()) for _ in range(args.embed_concurrency)]
+            stages = [
+                asyncio.create_task(self.read_stage()),
+                asyncio.create_task(self.chunk_stage()),
+                asyncio.create_task(self.finish_embedding(embedders)),
+                asyncio.create_task(self.upsert_stage()),
+            ]
+            try:
+                await asyncio.gather(*stages, *embedders)
+            except Exception as e:
+                self.failed = e
+                for task in stages + embedders:
+                    task.cancel()
+            finally:
+                reporter.cancel()
+                checkpointer.cancel()
+                save_checkpoint(self.checkpoint_path, self.source, args.collection, self.tracker.done_through)
+            return self.summary(time.monotonic() - started)
+
+    async def read_stage(self):
+        stats = self.stats["read"]
+        for seq, document in enumerate(iter_documents(self.args.source)):
+            if seq <= self.skip_through:
+                continue
+            stats.items += 1
+            await self.doc_queue.put((seq, document))
+        await self.doc_queue.put(DONE)
+
+    async def chunk_stage(self):
+        args, stats = self.args, self.stats["chunk"]
+        batch = []
+        while True:
+            item = await self.doc_queue.get()
+            if item is DONE:
+                break
+            seq, (doc_id, text, payload) = item
+            started = time.monotonic()
+            chunks = list(chunk_text(text, args.chunk_size, args.chunk_overlap))
+            self.tracker.add(seq, len(chunks))
+            stats.busy += time.monotonic() - started
+            for index, chunk in enumerate(chunks):
+                stats.items += 1
+                point_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}#{index}"))
+                batch.append((seq, point_id, chunk, {**payload, "doc_id": doc_id, "chunk_index": index, "text": chunk}))
+                if len(batch) >= args.embed_batch:
+                    stats.batches += 1
+                    await self.embed_queue.put(batch)
+                    batch = []
+        if batch:
+            stats.batches += 1
+            await self.embed_queue.put(batch)
+        for _ in range(args.embed_concurrency):
+            await self.embed_queue.put(DONE)
+
+    async def embed_worker(self):
+        args, stats = self.args, self.stats["embed"]
+        while True:
+            batch = await self.embed_queue.get()
+            if batch is DONE:
+                return
+            texts = [chunk for _, _, chunk, _ in batch]
+            started = time.monotonic()
+            if args.embed_api == "openai":
+                response = await request_with_retry(
+                    self.embed_client, "POST", f"{args.embed_url}/v1/embeddings", stats,
+                    json={"model": args.model, "input": texts})
+                vectors = [item["embedding"] for item in sorted(response.json()["data"], key=lambda d: d["index"])]
+            else:
+                response = await request_with_retry(
+                    self.embed_client, "POST", f"{args.embed_url}/api/embed", stats,
+                    json={"model": args.model, "input": texts})
+                vectors = response.json()["embeddings"]
+            stats.busy += time.monotonic() - started
+            if len(vectors) != len(batch):
+                raise RuntimeError(f"Embedding backend returned {len(vectors)} vectors for {len(batch)} texts")
+            await self.ensure_collection(len(vectors[0]))
+            stats.items += len(batch)
+            stats.batches += 1
+            await self.point_queue.put([
+                (seq, {"id": point_id, "vector": vector, "payload": payload})
+                for (seq, point_id, _, payload), vector in zip(batch, vectors)
+            ])
+
+    async def finish_embedding(self, embedders):
+        await asyncio.gather(*embedders)
+        await self.point_queue.put(DONE)
+
+    async def ensure_collection(self, size):
+        async with self.collection_lock:
+            if self.vector_size is None:
+                await self.prepare_collection(size)
+                self.vector_size = size
+        if size != self.vector_size:
+            raise RuntimeError(f"Embedding size changed from {self.vector_size} to {size}")
+
+    async def prepare_collection(self, size):
+        args = self.args
+        response = await self.qdrant_client.get(f"/collections/{args.collection}")
+        if response.status_code == 200:
+            vectors = response.json()["result"]["config"]["params"]["vectors"]
+            existing = vectors.get("size") if isinstance(vectors, dict) else None
+            if existing is not None and existing != size:
+                raise RuntimeError(f"Collection '{args.collection}' has vector size {existing}, "
+                                   f"but {args.model} produces {size}")
+        elif args.create_collection:
+            print(f"🆕 Creating collection '{args.collection}' (size {size}, {args.distance})")
+            created = await self.qdrant_client.put(
+                f"/collections/{args.collection}", json={"vectors": {"size": size, "distance": args.distance}})
+            created.raise_for_status()
+        else:
+            raise RuntimeError(f"Collection '{args.collection}' does not exist (use --create-collection)")
+
+    async def upsert_stage(self):
+        args = self.args
+        slots = asyncio.Semaphore(args.upsert_concurrency)
+        pending = set()
+        buffer = []
+        errors = []
+
+        async def flush(points):
+            try:
+                await self.upsert(points)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        while True:
+            if errors:
+                raise errors[0]
+            item = await self.point_queue.get()
+            if item is not DONE:
+                buffer.extend(item)
+            while len(buffer) >= args.upsert_batch or (item is DONE and buffer):
+                points, buffer = buffer[:args.upsert_batch], buffer[args.upsert_batch:]
+                # Waiting for a free upsert slot is what pushes back on the embedders
+                await slots.acquire()
+                task = asyncio.create_task(flush(points))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if item is DONE:
+                break
+        if pending:
+            await asyncio.gather(*pending)
+        if errors:
+            raise errors[0]
+
+    async def upsert(self, points):
+        stats = self.stats["upsert"]
+        started = time.monotonic()
+        await request_with_retry(
+            self.qdrant_client, "PUT", f"/collections/{self.args.collection}/points", stats,
+            params={"wait": "true"}, json={"points": [point for _, point in points]})
+        stats.busy += time.monotonic() - started
+        stats.items += len(points)
+        stats.batches += 1
+        self.tracker.stored(seq for seq, _ in points)
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.args.checkpoint_interval)
+            save_checkpoint(self.checkpoint_path, self.source, self.args.collection, self.tracker.done_through)
+
+    async def report_progress(self, started):
+        interval = self.args.report_interval
+        while True:
+            await asyncio.sleep(interval)
+            rates = "  ".join(f"{s.name} {s.delta() / interval:,.0f}/s" for s in self.stats.values())
+            queues = f"queues doc={self.doc_queue.qsize()} embed={self.embed_queue.qsize()} point={self.point_queue.qsize()}"
+            print(f"⏱️ {time.monotonic() - started:6.1f}s  {rates}  |  {queues}", flush=True)
+
+    def summary(self, elapsed):
+        return {
+            "source": self.source,
+            "collection": self.args.collection,
+            "elapsed_seconds": round(elapsed, 3),
+            "done_through": self.tracker.done_through,
+            "error": str(self.failed) if self.failed else None,
+            "stages": {
+                s.name: {
+                    "items": s.items,
+                    "batches": s.batches,
+                    "items_per_second": round(s.items / elapsed, 1) if elapsed else None,
+                    "busy_seconds": round(s.busy, 3),
+                    "retries": s.retries,
+                }
+                for s in self.stats.values()
+            },
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="JSONL file or directory of text files")
+    parser.add_argument("--collection", default="citadel_documents")
+    parser.add_argument("--model", default="nomic-embed-text:v1.5")
+    parser.add_argument("--embed-url", default=GATEWAY_URL, help="Gateway or Ollama base URL")
+    parser.add_argument("--embed-api", choices=("ollama", "openai"), default="ollama",
+                        help="Use /api/embed (ollama) or /v1/embeddings (openai)")
+    parser.add_argument("--qdrant-url", default=QDRANT_URL)
+    parser.add_argument("--qdrant-api-key", default=os.getenv("QDRANT_API_KEY"))
+    parser.add_argument("--create-collection", action="store_true", help="Create the collection if missing")
+    parser.add_argument("--distance", default="Cosine")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--embed-batch", type=int, default=32, help="Chunks per embedding request")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding requests in flight")
+    parser.add_argument("--upsert-batch", type=int, default=256, help="Points per Qdrant upsert")
+    parser.add_argument("--upsert-concurrency", type=int, default=2, help="Upserts in flight")
+    parser.add_argument("--queue-size", type=int, default=64, help="Documents buffered ahead of the chunker")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <source>.<collection>.checkpoint.json)")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0)
+    parser.add_argument("--resume", action="store_true", help="Skip documents recorded in the checkpoint")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    parser.add_argument("--report-json", help="Write the final per-stage report to this file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(f"🚚 Ingesting {args.source} -> {args.qdrant_url}/collections/{args.collection} ({args.model})")
+    try:
+        summary = asyncio.run(Pipeline(args).run())
+    except KeyboardInterrupt:
+        # run() saves the checkpoint on its way out
+        print("⚠️ Interrupted; re-run with --resume to continue")
+        sys.exit(130)
+    print(json.dumps(summary, indent=2))
+    if args.report_json:
+        with open(args.report_json, "w") as f:
+            json.dump(summary, f, indent=2)
+    if summary["error"]:
+        print(f"❌ Ingestion stopped: {summary['error']} (re-run with --resume to continue)")
+        sys.exit(1)
+    print(f"✅ Done: {summary['stages']['upsert']['items']} points in {summary['elapsed_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,17 @@
 #!/usr/bin/env python3
-import subprocess
+import argparse
+
 import requests
 
-def run_ssh_cmd(ip, cmd):
-    try:
-        result = subprocess.run(f"ssh agent0@{ip} '{cmd}'", shell=True, capture_output=True, text=True, timeout=10)
-        return result.stdout.strip() if result.returncode == 0 else f"Error: {result.stderr.strip()}"
-    except subprocess.TimeoutExpired:
-        return "Timeout"
-    except Exception as e:
-        return f"Error: {e}"
+from ssh_pool import SSHPool
+
+COMMANDS = {
+    "hostname": "hostname",
+    "uptime": "uptime -p",
+    "docker_version": "docker --version",
+    "containers": "docker ps --format '{{.Names}} ({{.Status}})'",
+    "port_3000": "ss -tuln | grep :3000",
+}
 
 def test_http(url):
     try:
@@ -18,22 +20,37 @@ def test_http(url):
     except Exception as e:
         return f"❌ HTTP Error: {e}"
 
+def show(result):
+    if result.ok:
+        return result.stdout
+    return "Timeout" if "timed out" in result.output.lower() else f"Error: {result.output}"
+
 def main():
-    ip = "192.168.10.38"
-    print(f"🔍 Web Server Status Check ({ip})")
-    print("=" * 50)
-    
-    print("🖥️  Server Info:")
-    print(f"   Hostname: {run_ssh_cmd(ip, 'hostname')}")
-    print(f"   Uptime: {run_ssh_cmd(ip, 'uptime -p')}")
-    
-    print("\n📦 Docker Status:")
-    print(f"   Version: {run_ssh_cmd(ip, 'docker --version')}")
-    print(f"   Container: {run_ssh_cmd(ip, 'docker ps --format \"{{.Names}} ({{.Status}})\"')}")
-    
-    print("\n🌐 Network Status:")
-    print(f"   Port 3000: {run_ssh_cmd(ip, 'ss -tuln | grep :3000')}")
-    print(f"   HTTP Test: {test_http(f'http://{ip}:3000')}")
+    parser = argparse.ArgumentParser(description="Quick web server status check")
+    parser.add_argument("hosts", nargs="*", default=["192.168.10.38"])
+    args = parser.parse_args()
+
+    # All commands for all hosts run at once over one SSH connection per host
+    with SSHPool(username="agent0", command_timeout=10) as pool:
+        results = pool.collect(args.hosts, COMMANDS)
+
+    for ip in args.hosts:
+        r = results[ip]
+        print(f"🔍 Web Server Status Check ({ip})")
+        print("=" * 50)
+
+        print("🖥️  Server Info:")
+        print(f"   Hostname: {show(r['hostname'])}")
+        print(f"   Uptime: {show(r['uptime'])}")
+
+        print("\n📦 Docker Status:")
+        print(f"   Version: {show(r['docker_version'])}")
+        print(f"   Container: {show(r['containers'])}")
+
+        print("\n🌐 Network Status:")
+        print(f"   Port 3000: {show(r['port_3000'])}")
+        print(f"   HTTP Test: {test_http(f'http://{ip}:3000')}")
+        print()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Pooled, concurrent SSH command execution for the diagnostic scripts.
+
+SSHPool keeps one authenticated Paramiko connection per host and runs commands on it as
+parallel channels (bounded per host to stay under sshd's MaxSessions), while different
+hosts are worked on at the same time. Results are yielded as soon as each command finishes.
+
+    from ssh_pool import SSHPool
+
+    with SSHPool(username="agent0") as pool:
+        for result in pool.fan_out(["192.168.10.38", "192.168.10.39"], {"Uptime": "uptime -p"}):
+            print(result.host, result.label, result.output)
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, Optional
+
+import paramiko
+
+
+class CommandResult:
+    __slots__ = ("host", "label", "command", "stdout", "stderr", "exit_status", "elapsed", "error")
+
+    def __init__(self, host, label, command, stdout="", stderr="", exit_status=None, elapsed=0.0, error=None):
+        self.host = host
+        self.label = label
+        self.command = command
+        self.stdout = stdout
+        self.stderr = stderr
+        self.exit_status = exit_status
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.exit_status == 0
+
+    @property
+    def output(self) -> str:
+        """stdout on success, otherwise the most useful error text."""
+        if self.ok:
+            return self.stdout
+        return self.error or self.stderr or f"exit status {self.exit_status}"
+
+
+class _HostConnection:
+    def __init__(self, max_channels: int):
+        self.lock = threading.Lock()
+        self.channels = threading.BoundedSemaphore(max_channels)
+        self.client: Optional[paramiko.SSHClient] = None
+        self.error: Optional[str] = None
+
+
+class SSHPool:
+    """One SSH connection per host, shared by all commands sent to that host."""
+
+    def __init__(self, username: str = "agent0", port: int = 22, key_filename: Optional[str] = None,
+                 connect_timeout: float = 10.0, command_timeout: float = 30.0,
+                 max_channels: int = 8, max_workers: int = 32):
+        self.username = username
+        self.port = port
+        self.key_filename = key_filename
+        self.connect_timeout = connect_timeout
+        self.command_timeout = command_timeout
+        self.max_channels = max_channels
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ssh")
+        self._hosts: Dict[str, _HostConnection] = {}
+        self._hosts_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _connection(self, host: str) -> _HostConnection:
+        with self._hosts_lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostConnection(self.max_channels)
+            return self._hosts[host]
+
+    def _client(self, host: str) -> paramiko.SSHClient:
+        """Returns the host's live client, connecting (once, for all waiting threads) if needed."""
+        connection = self._connection(host)
+        with connection.lock:
+            client = connection.client
+            if client is not None and client.get_transport() is not None and client.get_transport().is_active():
+                return client
+            if connection.error is not None:
+                # Fail the rest of a command set fast instead of waiting out the timeout per command
+                raise ConnectionError(connection.error)
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(host, port=self.port, username=self.username, key_filename=self.key_filename,
+                               timeout=self.connect_timeout, banner_timeout=self.connect_timeout,
+                               auth_timeout=self.connect_timeout)
+            except Exception as e:
+                client.close()
+                connection.error = f"SSH connection to {host} failed: {e}"
+                raise ConnectionError(connection.error) from e
+            transport = client.get_transport()
+            transport.set_keepalive(30)
+            connection.client = client
+            return client
+
+    def run(self, host: str, command: str, label: Optional[str] = None,
+            timeout: Optional[float] = None) -> CommandResult:
+        """Runs one command on a channel of the host's shared connection."""
+        started = time.monotonic()
+        timeout = timeout or self.command_timeout
+        try:
+            client = self._client(host)
+            with self._connection(host).channels:
+                _, stdout, stderr = client.exec_command(command, timeout=timeout)
+                out = stdout.read().decode(errors="replace").strip()
+                err = stderr.read().decode(errors="replace").strip()
+                status = stdout.channel.recv_exit_status()
+            return CommandResult(host, label or command, command, out, err, status, time.monotonic() - started)
+        except Exception as e:
+            return CommandResult(host, label or command, command, elapsed=time.monotonic() - started,
+                                 error=str(e) or type(e).__name__)
+
+    def run_many(self, host: str, commands: Dict[str, str]) -> Iterator[CommandResult]:
+        """Runs a labelled command set on one host in parallel, yielding results as they finish."""
+        return self.fan_out([host], commands)
+
+    def fan_out(self, hosts: Iterable[str], commands: Dict[str, str]) -> Iterator[CommandResult]:
+        """Runs the same command set on every host, yielding results in completion order."""
+        futures = [
+            self._executor.submit(self.run, host, command, label)
+            for host in hosts for label, command in commands.items()
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def collect(self, hosts: Iterable[str], commands: Dict[str, str]) -> Dict[str, Dict[str, CommandResult]]:
+        """Like fan_out, but waits for everything and returns {host: {label: result}}."""
+        results: Dict[str, Dict[str, CommandResult]] = {}
+        for result in self.fan_out(hosts, commands):
+            results.setdefault(result.host, {})[result.label] = result
+        return results
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._hosts_lock:
+            for connection in self._hosts.values():
+                if connection.client is not None:
+                    connection.client.close()
+            self._hosts.clear()
+